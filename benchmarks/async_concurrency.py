@@ -0,0 +1,216 @@
+"""
+Compares running many matches concurrently with EngineRunner on a thread pool and with AsyncEngineRunner
+on a single event loop.
+By default both runners talk to in-memory fake clients which answer every request after --api-latency
+milliseconds and let containers run for --run-time milliseconds. With --backend stub they talk to the stub
+Docker Engine API server of engine_latency.py over a unix socket instead (threads of the stub server are
+counted in peak threads then).
+
+    python benchmarks/async_concurrency.py --matches 2000 --concurrency 10 100 500
+"""
+import argparse
+import asyncio
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from docker_sandboxer.aio import AsyncEngineRunner  # noqa: E402
+from docker_sandboxer.engine import EngineRunner  # noqa: E402
+from engine_latency import COMPOSE_DATA, StubDockerServer  # noqa: E402
+
+
+class FakeLogStream(object):
+
+    def __init__(self, frames):
+        self.frames = frames
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def close(self):
+        pass
+
+
+class FakeAsyncLogStream(FakeLogStream):
+
+    def __aiter__(self):
+        return self._frames()
+
+    async def _frames(self):
+        for frame in self.frames:
+            yield frame
+
+
+class FakeClient(object):
+
+    def __init__(self, api_latency, run_time):
+        self.api_latency = api_latency
+        self.run_time = run_time
+        self.killed = set()
+
+    def _call(self, *args, **kwargs):
+        time.sleep(self.api_latency)
+
+    def create_network(self, name, labels=None):
+        self._call()
+        return uuid.uuid4().hex
+
+    def create_container(self, name, config):
+        self._call()
+        return uuid.uuid4().hex
+
+    def wait_container(self, container_id):
+        if container_id in self.killed:
+            self._call()
+            return 137
+        time.sleep(self.api_latency + self.run_time)
+        return 0
+
+    def kill_container(self, container_id, signal="SIGKILL"):
+        self._call()
+        self.killed.add(container_id)
+
+    def container_logs(self, container_id, tty=False):
+        self._call()
+        return [(1, b"game finished\n")]
+
+    def stream_logs(self, container_id, tty=False, follow=True):
+        self._call()
+        return FakeLogStream([(1, b"game finished\n")])
+
+    start_container = remove_container = remove_network = _call
+
+
+class FakeAsyncClient(FakeClient):
+
+    async def _call(self, *args, **kwargs):
+        await asyncio.sleep(self.api_latency)
+
+    async def create_network(self, name, labels=None):
+        await self._call()
+        return uuid.uuid4().hex
+
+    async def create_container(self, name, config):
+        await self._call()
+        return uuid.uuid4().hex
+
+    async def wait_container(self, container_id):
+        await asyncio.sleep(self.api_latency + self.run_time)
+        return 0
+
+    async def container_logs(self, container_id, tty=False):
+        await self._call()
+        return [(1, b"game finished\n")]
+
+    async def stream_logs(self, container_id, tty=False, follow=True):
+        await self._call()
+        return FakeAsyncLogStream([(1, b"game finished\n")])
+
+    start_container = remove_container = remove_network = _call
+
+
+class ThreadCounter(object):
+    """
+    Samples the number of live threads in the background and keeps the maximum.
+    """
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(0.005):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_threaded(runner, docker_host, matches, concurrency):
+    def match(index):
+        start = time.perf_counter()
+        runner.run("bench%d" % index, COMPOSE_DATA, ["server"], 60, docker_host=docker_host)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(match, range(matches)))
+
+
+def run_async(runner, docker_host, matches, concurrency):
+    async def match(index, semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            await runner.run("bench%d" % index, COMPOSE_DATA, ["server"], 60, docker_host=docker_host)
+            return time.perf_counter() - start
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*[match(index, semaphore) for index in range(matches)])
+
+    return asyncio.get_event_loop().run_until_complete(main())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--matches", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--api-latency", type=float, default=1, help="Milliseconds")
+    parser.add_argument("--run-time", type=float, default=100, help="Milliseconds")
+    parser.add_argument("--backend", choices=["fake", "stub"], default="fake")
+    args = parser.parse_args()
+    api_latency, run_time = args.api_latency / 1000.0, args.run_time / 1000.0
+
+    directory = server = None
+    docker_host = None
+    if args.backend == "stub":
+        directory = tempfile.mkdtemp()
+        socket_path = os.path.join(directory, "docker.sock")
+        server = StubDockerServer(socket_path, api_latency, run_time)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        docker_host = "unix://" + socket_path
+
+    try:
+        print("%-8s %12s %8s %8s %8s %10s %12s" % ("runner", "concurrency", "p50 ms", "p95 ms", "max ms",
+                                                  "matches/s", "peak threads"))
+        for concurrency in args.concurrency:
+            for name, runner, run in (("threads", EngineRunner(max_idle_connections=concurrency), run_threaded),
+                                      ("asyncio", AsyncEngineRunner(max_idle_connections=concurrency), run_async)):
+                if args.backend == "fake":
+                    client_class = FakeAsyncClient if name == "asyncio" else FakeClient
+                    client = client_class(api_latency, run_time)
+                    runner.get_client = lambda docker_host=None, client=client: client
+                with redirect_stdout(io.StringIO()), ThreadCounter() as threads:
+                    start = time.perf_counter()
+                    latencies = sorted(run(runner, docker_host, args.matches, concurrency))
+                    elapsed = time.perf_counter() - start
+
+                def percentile(p):
+                    return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+                print("%-8s %12d %8.1f %8.1f %8.1f %10.1f %12d" % (
+                    name, concurrency, percentile(0.5), percentile(0.95), latencies[-1] * 1000,
+                    args.matches / elapsed, threads.peak))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Measures the per-match latency of EngineRunner against a stub Docker Engine API server on a unix socket.
+The stub answers every request after --api-latency milliseconds, takes --create-latency milliseconds to create a
+container and --remove-latency milliseconds to remove one, and lets containers run for --run-time milliseconds
+unless they are killed.
+The "warm pool" runner takes containers from a ContainerPool which is refilled in the background.
+Matches end once their containers are killed, removal is done by the runner's teardown in the background;
+the kill latency and removal counters of the teardown are printed after each runner.
+
+    python benchmarks/engine_latency.py --matches 200 --concurrency 8
+"""
+import argparse
+import http.server
+import io
+import json
+import os
+import shutil
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from docker_sandboxer.engine import EngineRunner  # noqa: E402
+from docker_sandboxer.pool import ContainerPool  # noqa: E402
+from docker_sandboxer.teardown import Teardown  # noqa: E402
+
+
+class StubDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, socket_path, api_latency, run_time, create_latency=0, remove_latency=0):
+        self.api_latency = api_latency
+        self.create_latency = create_latency
+        self.remove_latency = remove_latency
+        self.run_time = run_time
+        self.killed = set()
+        self.request_count = 0
+        self.connection_count = 0
+        self.lock = threading.Lock()
+        super().__init__(socket_path, StubDockerHandler)
+
+
+class StubDockerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b"", content_type="application/json"):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        with self.server.lock:
+            self.server.request_count += 1
+        time.sleep(self.server.api_latency)
+        path = self.path.split("?")[0]
+        if path.endswith("/create"):
+            if path.endswith("/containers/create"):
+                time.sleep(self.server.create_latency)
+            self._reply(201, {"Id": uuid.uuid4().hex})
+        elif path.endswith("/wait"):
+            if path.split("/")[-2] not in self.server.killed:
+                time.sleep(self.server.run_time)
+            self._reply(200, {"StatusCode": 0})
+        elif path.endswith("/kill"):
+            with self.server.lock:
+                self.server.killed.add(path.split("/")[-2])
+            self._reply(204)
+        elif self.command == "DELETE" and "/containers/" in path:
+            time.sleep(self.server.remove_latency)
+            self._reply(204)
+        elif path.endswith("/logs"):
+            line = b"game finished\n"
+            self._reply(200, struct.pack(">BxxxL", 1, len(line)) + line, "application/vnd.docker.raw-stream")
+        else:
+            self._reply(204)
+
+    do_GET = do_POST = do_DELETE = _handle
+
+
+COMPOSE_DATA = {
+    "server": {"image": "server", "command": "run-server", "mem_limit": 1 << 30, "cpuset": "0",
+               "ulimits": {"nproc": 20000, "nofile": {"soft": 20000, "hard": 20000}}},
+    "client1": {"image": "client", "links": ["server:game"], "cpuset": "1"},
+    "client2": {"image": "client", "links": ["server:game"], "cpuset": "2"},
+}
+
+
+def run_matches(runner, socket_path, matches, concurrency):
+    def match(index):
+        start = time.perf_counter()
+        runner.run("bench%d" % index, COMPOSE_DATA, ["server"], None, docker_host="unix://" + socket_path)
+        return time.perf_counter() - start
+
+    with redirect_stdout(io.StringIO()):
+        with ThreadPoolExecutor(concurrency) as executor:
+            start = time.perf_counter()
+            latencies = sorted(executor.map(match, range(matches)))
+            elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--matches", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--api-latency", type=float, default=1, help="Milliseconds")
+    parser.add_argument("--run-time", type=float, default=10, help="Milliseconds")
+    parser.add_argument("--create-latency", type=float, default=30, help="Milliseconds")
+    parser.add_argument("--remove-latency", type=float, default=20, help="Milliseconds")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    socket_path = os.path.join(directory, "docker.sock")
+    server = StubDockerServer(socket_path, args.api_latency / 1000.0, args.run_time / 1000.0,
+                              args.create_latency / 1000.0, args.remove_latency / 1000.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        print("%-10s %8s %8s %8s %8s %10s %12s" % ("pool", "p50 ms", "p95 ms", "p99 ms", "max ms", "matches/s",
+                                                  "connections"))
+        for name, idle_connections, pool in (("none", 0, None), ("pooled", args.concurrency, None),
+                                             ("warm pool", args.concurrency, ContainerPool(size=args.concurrency))):
+            server.connection_count = 0
+            teardown = Teardown()
+            runner = EngineRunner(max_idle_connections=idle_connections, pool=pool, teardown=teardown)
+            if pool is not None:
+                runner.warm(COMPOSE_DATA, docker_host="unix://" + socket_path)
+                pool.start()
+            latencies, elapsed = run_matches(runner, socket_path, args.matches, args.concurrency)
+            if pool is not None:
+                pool_stats = pool.stats()
+                pool.close()
+
+            def percentile(p):
+                return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+            print("%-10s %8.2f %8.2f %8.2f %8.2f %10.1f %12d" % (
+                name, percentile(0.5), percentile(0.95), percentile(0.99), latencies[-1] * 1000,
+                args.matches / elapsed, server.connection_count))
+            if pool is not None:
+                print("warm pool: %s" % ", ".join(["%s=%s" % item for item in sorted(pool_stats.items())]))
+            teardown.wait()
+            teardown_stats = teardown.stats()
+            print("teardown: %d kills, kill mean %.2f ms, kill max %.2f ms, %d removed, %d failed" % (
+                teardown_stats["kills"], teardown_stats["kill_mean"] * 1000, teardown_stats["kill_max"] * 1000,
+                teardown_stats["removed"], teardown_stats["failed"]))
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Simulates placement policies on a synthetic workload and reports placement quality.
+Runs entirely in memory on a fake sysfs tree, no redis or docker is needed.
+
+    python benchmarks/placement_simulator.py --packages 2 --llcs 2 --cores 8 --threads 2 --jobs 20000
+"""
+import argparse
+import heapq
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from docker_sandboxer.placement import policies  # noqa: E402
+from docker_sandboxer.topology import CPUTopology  # noqa: E402
+
+
+WORKLOAD = [
+    # (probability, cpu shares of a job)
+    (0.35, [1024, 1024]),
+    (0.25, [1024]),
+    (0.20, [512, 256]),
+    (0.10, [768]),
+    (0.10, [1024, 1024, 512, 512]),
+]
+
+
+def _write(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, "w") as f:
+        f.write(content + "\n")
+
+
+def write_fake_sysfs(root, packages, llcs_per_package, cores_per_llc, threads_per_core):
+    """
+    Writes a fake /sys/devices/system/cpu tree. Hardware threads of a core are numbered like linux does on x86:
+    the first threads of all cores come first, then the second threads and so on.
+    Each package is a NUMA node.
+    """
+    physical_cores = packages * llcs_per_package * cores_per_llc
+
+    def cpu_list(cpus):
+        return ",".join([str(cpu) for cpu in sorted(cpus)])
+
+    for thread in range(threads_per_core):
+        for core in range(physical_cores):
+            cpu = thread * physical_cores + core
+            package = core // (llcs_per_package * cores_per_llc)
+            llc_first_core = core - core % cores_per_llc
+            siblings = [t * physical_cores + core for t in range(threads_per_core)]
+            llc_cpus = [t * physical_cores + c for t in range(threads_per_core)
+                        for c in range(llc_first_core, llc_first_core + cores_per_llc)]
+
+            cpu_dir = os.path.join(root, "cpu%d" % cpu)
+            _write(os.path.join(cpu_dir, "online"), "1")
+            _write(os.path.join(cpu_dir, "topology", "physical_package_id"), str(package))
+            _write(os.path.join(cpu_dir, "topology", "thread_siblings_list"), cpu_list(siblings))
+            for index, (level, cache_type, shared) in enumerate([(1, "Data", siblings),
+                                                                  (1, "Instruction", siblings),
+                                                                  (2, "Unified", siblings),
+                                                                  (3, "Unified", llc_cpus)]):
+                index_dir = os.path.join(cpu_dir, "cache", "index%d" % index)
+                _write(os.path.join(index_dir, "level"), str(level))
+                _write(os.path.join(index_dir, "type"), cache_type)
+                _write(os.path.join(index_dir, "shared_cpu_list"), cpu_list(shared))
+            os.makedirs(os.path.join(cpu_dir, "node%d" % package))
+
+
+def _pick_job(rng):
+    value = rng.random()
+    for probability, shares in WORKLOAD:
+        value -= probability
+        if value <= 0:
+            return shares
+    return WORKLOAD[-1][1]
+
+
+def simulate(policy, topology, jobs, load, seed):
+    """
+    Jobs arrive as a poisson process and wait in a FIFO queue until they fit.
+    :param load: Offered load relative to the total capacity.
+    """
+    rng = random.Random(seed)
+    cores = {cpu: 1024 for cpu in topology.cpus}
+    capacity = 1024 * len(cores)
+    mean_shares = sum([p * sum(shares) for p, shares in WORKLOAD])
+    mean_duration = 1.0
+    arrival_rate = load * capacity / (mean_shares * mean_duration)
+
+    now = 0.0
+    departures = []
+    queue = []
+    stats = {"jobs": 0, "multi_share_jobs": 0, "split_llc": 0, "split_numa": 0, "split_core": 0,
+             "wait": 0.0, "used_time": 0.0, "whole_cores_free_time": 0.0}
+    last_event = 0.0
+
+    def advance(to):
+        duration = to - last_event
+        stats["used_time"] += duration * (capacity - sum(cores.values()))
+        stats["whole_cores_free_time"] += duration * len([cpu for cpu in cores if cores[cpu] == 1024])
+
+    def start_waiting_jobs():
+        while queue:
+            arrival, shares = queue[0]
+            placement = policy.place(cores, shares, topology)
+            if placement is None:
+                return
+            queue.pop(0)
+            for share, cpu in zip(shares, placement):
+                cores[cpu] -= share
+            stats["jobs"] += 1
+            stats["wait"] += now - arrival
+            if len(shares) > 1:
+                stats["multi_share_jobs"] += 1
+                stats["split_core"] += topology.domain_count("core", placement) > 1
+                stats["split_llc"] += topology.domain_count("llc", placement) > 1
+                stats["split_numa"] += topology.domain_count("numa_node", placement) > 1
+            heapq.heappush(departures, (now + rng.expovariate(1.0 / mean_duration), list(zip(shares, placement))))
+
+    next_arrival = rng.expovariate(arrival_rate)
+    arrived = 0
+    while stats["jobs"] < jobs:
+        if departures and (departures[0][0] <= next_arrival or arrived >= jobs):
+            event_time, assignment = heapq.heappop(departures)
+            advance(event_time)
+            now = last_event = event_time
+            for share, cpu in assignment:
+                cores[cpu] += share
+        elif arrived < jobs:
+            advance(next_arrival)
+            now = last_event = next_arrival
+            queue.append((now, _pick_job(rng)))
+            arrived += 1
+            next_arrival = now + rng.expovariate(arrival_rate)
+        start_waiting_jobs()
+
+    multi = max(stats["multi_share_jobs"], 1)
+    return {
+        "utilization": stats["used_time"] / (capacity * now),
+        "mean_wait": stats["wait"] / stats["jobs"],
+        "mean_whole_cores_free": stats["whole_cores_free_time"] / now,
+        "split_core": stats["split_core"] / multi,
+        "split_llc": stats["split_llc"] / multi,
+        "split_numa": stats["split_numa"] / multi,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=2)
+    parser.add_argument("--llcs", type=int, default=2, help="Last level caches per package")
+    parser.add_argument("--cores", type=int, default=8, help="Physical cores per last level cache")
+    parser.add_argument("--threads", type=int, default=2, help="Hardware threads per physical core")
+    parser.add_argument("--jobs", type=int, default=20000)
+    parser.add_argument("--load", type=float, default=0.85)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--sysfs", help="Use an existing sysfs cpu directory instead of a fake one")
+    args = parser.parse_args()
+
+    root = args.sysfs
+    if root is None:
+        root = tempfile.mkdtemp()
+        write_fake_sysfs(root, args.packages, args.llcs, args.cores, args.threads)
+    try:
+        topology = CPUTopology.from_sysfs(root)
+    finally:
+        if args.sysfs is None:
+            shutil.rmtree(root)
+
+    print("%d cpus, %d last level caches, %d NUMA nodes" % (
+        len(topology.cpus), len(topology.domains("llc")), len(topology.domains("numa_node"))))
+    print("%-10s %11s %9s %16s %10s %9s %10s" % (
+        "policy", "utilization", "mean wait", "whole cores free", "split core", "split llc", "split numa"))
+    for name in sorted(policies):
+        result = simulate(policies[name](), topology, args.jobs, args.load, args.seed)
+        print("%-10s %11.3f %9.3f %16.1f %10.3f %9.3f %10.3f" % (
+            name, result["utilization"], result["mean_wait"], result["mean_whole_cores_free"],
+            result["split_core"], result["split_llc"], result["split_numa"]))
+
+
+if __name__ == "__main__":
+    main()
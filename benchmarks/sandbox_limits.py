@@ -0,0 +1,45 @@
+"""
+Measures the per-sandbox cost of creating, copying and deriving Sandbox and FrozenSandbox objects and of
+translating their limits to docker-compose keys.
+
+    python benchmarks/sandbox_limits.py --sandboxes 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from docker_sandboxer.sandboxer import Sandbox, FrozenSandbox  # noqa: E402
+
+
+def measure(function, count):
+    start = time.perf_counter()
+    for i in range(count):
+        function(i)
+    return (time.perf_counter() - start) / count * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sandboxes", type=int, default=5000)
+    args = parser.parse_args()
+
+    sandbox = Sandbox(cpu=[512], memory=1 << 28)
+    frozen = FrozenSandbox(cpu=[512], memory=1 << 28)
+    rows = [
+        ("Sandbox(...)", lambda i: Sandbox(cpu=[512], memory=1 << 28)),
+        ("FrozenSandbox(...)", lambda i: FrozenSandbox(cpu=[512], memory=1 << 28)),
+        ("Sandbox.copy()", lambda i: sandbox.copy()),
+        ("Sandbox.with_limits()", lambda i: sandbox.with_limits(memory=i)),
+        ("FrozenSandbox.with_limits()", lambda i: frozen.with_limits(memory=i)),
+        ("get_docker_limits()", lambda i: sandbox.get_docker_limits()),
+        ("update + get_docker_limits()", lambda i: (sandbox.update_limits(memory=i), sandbox.get_docker_limits())),
+    ]
+    for name, function in rows:
+        print("%-30s %8.2f us per sandbox" % (name, measure(function, args.sandboxes)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Load test of the cpu schedulers: many concurrent uids reserve mixed cpu shares, hold them for a while and release
+them, following an arrival pattern. Reports reservation latency percentiles, throughput, core utilization and
+fragmentation, and optionally writes them as json to compare scheduler versions.
+
+Needs a running redis-server (every run wipes the scheduler keys of the selected database), or fakeredis
+(pip install fakeredis lupa) for --backend fake.
+
+    python benchmarks/scheduler_load.py --uids 256 --cores 64 --arrival poisson --rate 400 --json after.json
+    python benchmarks/scheduler_load.py --uids 256 --cores 64 --arrival poisson --rate 400 --baseline after.json
+
+Arrival patterns:
+    closed   every uid asks again after releasing and thinking for --think seconds (exponential)
+    poisson  requests arrive at --rate per second (exponential gaps) and are served by the first free uid
+    burst    --burst requests arrive together every --burst / --rate seconds
+Latencies of poisson and burst requests are measured from their arrival, so they include waiting for a free uid.
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from docker_sandboxer.scheduler import CPUScheduler  # noqa: E402
+from docker_sandboxer.atomic_scheduler import AtomicCPUScheduler  # noqa: E402
+
+
+# (weight, cpu shares of a request)
+DEFAULT_MIX = "4:1024;3:512,256;2:768;1:1024,1024,512"
+
+SCHEDULERS = {
+    "semaphore": CPUScheduler,
+    "atomic": AtomicCPUScheduler,
+}
+
+
+def parse_mix(text):
+    """
+    Parses "weight:share,share;weight:share" (the weight may be omitted).
+    :return: list of (weight, cpu shares)
+    """
+    mix = []
+    for item in text.split(";"):
+        weight, _, shares = item.rpartition(":")
+        mix.append((float(weight or 1), [int(share) for share in shares.split(",")]))
+    return mix
+
+
+def use_fakeredis():
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit("--backend fake needs fakeredis (and lupa for AtomicCPUScheduler's lua scripts)")
+    import redis
+    server = fakeredis.FakeServer()
+    redis.StrictRedis = lambda host=None, port=None, db=0: fakeredis.FakeStrictRedis(server=server, db=db)
+
+
+def core_availability(scheduler):
+    """
+    :return: list of the available share of every core
+    """
+    if isinstance(scheduler, AtomicCPUScheduler):
+        status, waiting = scheduler.get_status()
+        return [core['available'] for node in status.values() for core in node['cores'].values()]
+    return [json.loads(core.decode('utf8'))['available']
+            for core in scheduler.redis_connection.hvals(CPUScheduler.cpu_status_map)]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def arrivals(args, rng):
+    """
+    :return: list of arrival times (seconds since the start) of the open arrival patterns
+    """
+    times = []
+    now = 0.0
+    if args.arrival == "poisson":
+        for i in range(args.requests):
+            now += rng.expovariate(args.rate)
+            times.append(now)
+    else:
+        gap = float(args.burst) / args.rate
+        while len(times) < args.requests:
+            times.extend([now] * min(args.burst, args.requests - len(times)))
+            now += gap
+    return times
+
+
+class Sampler(object):
+    """
+    Samples utilization and fragmentation of the cores while the load runs.
+    Fragmentation is the part of the free shares which is not on fully free cores, and a sample is unplaceable
+    if at least a whole core's worth of shares is free but no core is fully free.
+    """
+
+    def __init__(self, scheduler, interval):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.utilization = []
+        self.fragmentation = []
+        self.unplaceable = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        available = core_availability(self.scheduler)
+        capacity = 1024 * len(available)
+        free = sum(available)
+        whole = 1024 * len([share for share in available if share == 1024])
+        self.utilization.append(1 - float(free) / capacity if capacity else 0.0)
+        self.fragmentation.append(1 - float(whole) / free if free else 0.0)
+        if free >= 1024 and not whole:
+            self.unplaceable += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+
+def run(name, scheduler, args):
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    weights = [weight for weight, shares in mix]
+    requests = [rng.choices(mix, weights)[0][1] for i in range(args.requests)]
+    holds = [rng.expovariate(1.0 / args.hold) if args.hold > 0 else 0 for i in range(args.requests)]
+    timeout = args.timeout if isinstance(scheduler, AtomicCPUScheduler) else None
+
+    pending = queue.Queue()
+    if args.arrival == "closed":
+        for index in range(args.requests):
+            pending.put((index, None))
+    else:
+        for index, arrival in enumerate(arrivals(args, rng)):
+            pending.put((index, arrival))
+
+    latencies = []
+    timeouts = [0]
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def client(uid_index):
+        client_rng = random.Random("%s-%d" % (args.seed, uid_index))
+        user = "load-%d" % uid_index
+        while True:
+            try:
+                index, arrival = pending.get_nowait()
+            except queue.Empty:
+                return
+            if arrival is None:
+                if args.think > 0:
+                    time.sleep(client_rng.expovariate(1.0 / args.think))
+                arrived = time.perf_counter()
+            else:
+                arrived = start + arrival
+                delay = arrived - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                reservation = scheduler.reserve(user, requests[index], timeout=timeout)
+            except TimeoutError:
+                with lock:
+                    timeouts[0] += 1
+                continue
+            latency = time.perf_counter() - arrived
+            with lock:
+                latencies.append(latency)
+            time.sleep(holds[index])
+            reservation.release()
+
+    sampler = Sampler(scheduler, args.sample_interval)
+    sampler.start()
+    clients = [threading.Thread(target=client, args=(index,)) for index in range(args.uids)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+
+    def summary(values):
+        return {
+            "mean": sum(values) / len(values) if values else None,
+            "max": max(values) if values else None,
+        }
+
+    return {
+        "scheduler": name,
+        "requests": args.requests,
+        "granted": len(latencies),
+        "timeouts": timeouts[0],
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "latency_ms": {
+            "p50": 1000 * percentile(latencies, 0.5) if latencies else None,
+            "p90": 1000 * percentile(latencies, 0.9) if latencies else None,
+            "p99": 1000 * percentile(latencies, 0.99) if latencies else None,
+            "max": 1000 * max(latencies) if latencies else None,
+            "mean": 1000 * sum(latencies) / len(latencies) if latencies else None,
+        },
+        "utilization": summary(sampler.utilization),
+        "fragmentation": summary(sampler.fragmentation),
+        "unplaceable_samples": float(sampler.unplaceable) / len(sampler.utilization) if sampler.utilization else 0.0,
+        "samples": len(sampler.utilization),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: list of regressions of throughput and p99 latency beyond tolerance (a fraction) against baseline
+    """
+    regressions = []
+    previous = {result["scheduler"]: result for result in baseline["results"]}
+    for result in results:
+        old = previous.get(result["scheduler"])
+        if old is None:
+            continue
+        if result["throughput"] < old["throughput"] * (1 - tolerance):
+            regressions.append("%s: throughput %.1f/s, was %.1f/s" % (
+                result["scheduler"], result["throughput"], old["throughput"]))
+        new_p99, old_p99 = result["latency_ms"]["p99"], old["latency_ms"]["p99"]
+        if new_p99 is not None and old_p99 is not None and new_p99 > old_p99 * (1 + tolerance):
+            regressions.append("%s: p99 latency %.1fms, was %.1fms" % (result["scheduler"], new_p99, old_p99))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("redis", "fake"), default="redis")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--db", type=int, default=15)
+    parser.add_argument("--schedulers", default="semaphore,atomic", help="Comma separated: semaphore, atomic")
+    parser.add_argument("--uids", type=int, default=256, help="Concurrent uids")
+    parser.add_argument("--cores", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Requests as weight:share,share;... (default %(default)s)")
+    parser.add_argument("--arrival", choices=("closed", "poisson", "burst"), default="closed")
+    parser.add_argument("--rate", type=float, default=200, help="Requests per second of poisson and burst arrivals")
+    parser.add_argument("--burst", type=int, default=64, help="Requests per burst")
+    parser.add_argument("--think", type=float, default=0.0, help="Mean seconds between requests of a closed uid")
+    parser.add_argument("--hold", type=float, default=0.05, help="Mean seconds a reservation is held")
+    parser.add_argument("--timeout", type=float, default=None, help="Reservation timeout (atomic scheduler only)")
+    parser.add_argument("--sample-interval", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Write the results as json to this file, - for standard output")
+    parser.add_argument("--baseline", help="Json results of a previous run, exit with 1 if this run regresses")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression against the baseline")
+    args = parser.parse_args()
+
+    if args.backend == "fake":
+        use_fakeredis()
+
+    results = []
+    for name in args.schedulers.split(","):
+        if name not in SCHEDULERS:
+            parser.error("Unknown scheduler: %s" % name)
+        scheduler = SCHEDULERS[name](args.host, args.port, args.db)
+        scheduler.initialize_semaphores()
+        scheduler.remove_cpu_stats()
+        scheduler.add_ases_available_cpus(range(args.cores))
+        result = run(name, scheduler, args)
+        results.append(result)
+        latency = result["latency_ms"]
+        print("%-10s %6d granted %4d timed out  %8.1f/s  latency p50 %7.1fms p90 %7.1fms p99 %7.1fms  "
+              "utilization %3.0f%%  fragmentation %3.0f%%" % (
+                  name, result["granted"], result["timeouts"], result["throughput"],
+                  latency["p50"] or 0, latency["p90"] or 0, latency["p99"] or 0,
+                  100 * (result["utilization"]["mean"] or 0), 100 * (result["fragmentation"]["mean"] or 0)))
+
+    output = {"config": vars(args), "results": results}
+    if args.json == "-":
+        print(json.dumps(output, indent=2, sort_keys=True))
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("regression: %s" % regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Compares acquire/release throughput of CPUScheduler and AtomicCPUScheduler.
+Needs a running redis-server. Every run wipes the scheduler keys of the selected database.
+
+    python benchmarks/scheduler_throughput.py --host localhost --port 6379 --db 15 --threads 32 --cores 64
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from docker_sandboxer.scheduler import CPUScheduler  # noqa: E402
+from docker_sandboxer.atomic_scheduler import AtomicCPUScheduler  # noqa: E402
+
+
+REQUESTS = [[1024], [512, 256], [768], [1024, 1024, 512]]
+
+
+def prepare(scheduler, cores):
+    scheduler.initialize_semaphores()
+    scheduler.remove_cpu_stats()
+    scheduler.add_ases_available_cpus(range(cores))
+
+
+def run(scheduler_factory, threads, iterations):
+    def worker(index):
+        scheduler = scheduler_factory()
+        for iteration in range(iterations):
+            user = "bench-%d-%d" % (index, iteration)
+            scheduler.acquire_cpu(user, REQUESTS[(index + iteration) % len(REQUESTS)])
+            scheduler.release_all_cpus(user)
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--db", type=int, default=15)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--cores", type=int, default=64)
+    args = parser.parse_args()
+
+    for name, scheduler_class in (("semaphore", CPUScheduler), ("atomic", AtomicCPUScheduler)):
+        def factory():
+            return scheduler_class(args.host, args.port, args.db)
+        prepare(factory(), args.cores)
+        elapsed = run(factory, args.threads, args.iterations)
+        reservations = args.threads * args.iterations
+        print("%-10s %8d reservations in %7.3fs  %10.1f reservations/s" % (
+            name, reservations, elapsed, reservations / elapsed))
+
+
+if __name__ == "__main__":
+    main()
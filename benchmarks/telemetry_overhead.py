@@ -0,0 +1,76 @@
+"""
+Measures the cost of one CgroupSampler sample against a fake cgroup v2 tree, and records a fake run
+whose counters grow between samples to show the time series and summary a Parser returns.
+
+    python benchmarks/telemetry_overhead.py --containers 16 --samples 2000
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from docker_sandboxer.telemetry import CgroupSampler  # noqa: E402
+
+
+def write_fake_cgroup(root, container_id, cpu_usec=0, memory=0, memory_peak=None, read_bytes=0, write_bytes=0):
+    """
+    Writes the files CgroupSampler reads for a container managed by docker's systemd cgroup driver.
+    """
+    path = os.path.join(root, "system.slice", "docker-%s.scope" % container_id)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    with open(os.path.join(path, "cpu.stat"), "w") as f:
+        f.write("usage_usec %d\nuser_usec %d\nsystem_usec %d\nnr_periods 0\nnr_throttled 0\nthrottled_usec 0\n" %
+                (cpu_usec, cpu_usec * 3 // 4, cpu_usec // 4))
+    with open(os.path.join(path, "memory.current"), "w") as f:
+        f.write("%d\n" % memory)
+    if memory_peak is not None:
+        with open(os.path.join(path, "memory.peak"), "w") as f:
+            f.write("%d\n" % memory_peak)
+    with open(os.path.join(path, "io.stat"), "w") as f:
+        f.write("8:0 rbytes=%d wbytes=%d rios=10 wios=10 dbytes=0 dios=0\n" % (read_bytes, write_bytes))
+        f.write("8:16 rbytes=0 wbytes=4096 rios=0 wios=1 dbytes=0 dios=0\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--containers", type=int, default=16)
+    parser.add_argument("--samples", type=int, default=2000)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        containers = {"service%d" % index: "%064x" % index for index in range(args.containers)}
+        for container_id in containers.values():
+            write_fake_cgroup(root, container_id, memory=1 << 20)
+
+        sampler = CgroupSampler(interval=0.05, cgroup_root=root, find_containers=lambda project, host: containers)
+        recording = sampler.start("bench")
+        recording.stop()
+        start = time.perf_counter()
+        for i in range(args.samples):
+            recording.sample()
+        elapsed = time.perf_counter() - start
+        print("%d containers: %.1f us per sample of all containers, %.1f us per container" % (
+            args.containers, elapsed / args.samples * 1000000, elapsed / args.samples / args.containers * 1000000))
+
+        recording = sampler.start("bench")
+        for step in range(1, 6):
+            time.sleep(0.06)
+            for index, container_id in enumerate(containers.values()):
+                write_fake_cgroup(root, container_id, cpu_usec=step * 30000 * (index + 1), memory=step << 20,
+                                  memory_peak=(step + 1) << 20, read_bytes=step * 4096, write_bytes=step * 8192)
+        telemetry = recording.stop()
+        print("summary of service0: %s" % json.dumps(telemetry["summary"]["service0"], sort_keys=True))
+        print("series of service0: %s" % json.dumps(telemetry["series"]["service0"], sort_keys=True))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
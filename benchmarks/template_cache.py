@@ -0,0 +1,107 @@
+"""
+Measures the per-call cost of Parser.create_yml_and_run with and without the compiled template cache.
+The scheduler and the runner are no-op fakes, so only rendering, parsing, substituting and storing is measured.
+With a "same" context every match renders the same text, with a "per match" context each match has its own
+log directory and team names, so each rendering is new and the cache only costs its lookup.
+
+    python benchmarks/template_cache.py --calls 2000 --clients 8
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from docker_sandboxer.sandboxer import Parser, Sandbox  # noqa: E402
+from docker_sandboxer.scheduler import CPUReservation  # noqa: E402
+
+
+TEMPLATE = """server:
+    image: {{ server_image }}
+    command: run-server --clients {{ clients|length }}
+    environment:
+        MAP: {{ map }}
+        TIMEOUT: 1000
+    volumes:
+        - /srv/maps:/maps:ro
+        - /srv/logs/{{ log_dir }}:/logs
+    {{ server_sandbox }}
+    {{ make_manager }}
+{% for client in clients %}
+client{{ loop.index }}:
+    image: {{ client.image }}
+    links:
+        - server:game
+    environment:
+        TEAM: {{ client.team }}
+    {{ client.sandbox }}
+{% endfor %}
+"""
+
+
+class FakeScheduler(object):
+
+    def reserve(self, user, cpu_shares, timeout=None, priority=0, memory=0):
+        return CPUReservation(self, user, cpu_shares, list(range(len(cpu_shares))), memory=memory)
+
+    def release_all_cpus(self, user):
+        pass
+
+
+class FakeRunner(object):
+
+    def run(self, project_name, compose_data, manager_services, timeout, docker_host=None):
+        pass
+
+
+def measure(parser, calls, clients, per_match):
+    context = {
+        "server_image": "game-server:latest",
+        "map": "maps/default.map",
+        "log_dir": "matches",
+        "server_sandbox": Sandbox(cpu=[1024], memory=2 * 1024 ** 3),
+        "clients": [{"image": "client-%d:latest" % index, "team": "team-%d" % index, "sandbox": Sandbox(cpu=[512])}
+                    for index in range(clients)],
+    }
+    start = time.perf_counter()
+    for call in range(calls):
+        if per_match:
+            context["log_dir"] = "matches/match%d" % call
+            for index, client in enumerate(context["clients"]):
+                client["team"] = "team-%d-%d" % (call, index)
+        parser.create_yml_and_run("match%d" % (call % 100), "match.yml", context)
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=8)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        templates = os.path.join(directory, "templates")
+        os.makedirs(templates)
+        with open(os.path.join(templates, "match.yml"), "w") as f:
+            f.write(TEMPLATE)
+
+        print("%-8s %-14s %-10s %12s" % ("cache", "storage", "context", "us per call"))
+        for storage in ("yml file", "none"):
+            for per_match in (False, True):
+                for cache_size in (0, 128):
+                    yaml_storage_folder = os.path.join(directory, "yaml_logs") if storage == "yml file" else None
+                    sandbox_parser = Parser(FakeScheduler(), templates, yaml_storage_folder, runner=FakeRunner(),
+                                            template_cache_size=cache_size)
+                    seconds = measure(sandbox_parser, args.calls, args.clients, per_match)
+                    print("%-8s %-14s %-10s %12.1f" % ("on" if cache_size else "off", storage,
+                                                       "per match" if per_match else "same", seconds * 1000000))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+import asyncio
+import json
+import os
+import struct
+import sys
+import uuid
+from urllib.parse import urlencode, urlparse
+
+from . import metrics
+from .engine import DockerEngineError, container_config, demultiplex
+
+
+class AsyncDockerEngineClient(object):
+    """
+    asyncio version of engine.DockerEngineClient.
+    Keeps idle keep-alive connections in a pool, so consecutive requests don't reconnect.
+    A client must only be used from the event loop it was first used on.
+    """
+
+    def __init__(self, base_url=None, api_version="1.25", max_idle_connections=8, timeout=60):
+        """
+        :param base_url: unix:///path/to/docker.sock or tcp://host:port. Defaults to $DOCKER_HOST or the local socket.
+        :param max_idle_connections: Maximum number of idle connections kept open.
+        :param timeout: Seconds to wait for a response, except for requests which wait for containers.
+        """
+        self.base_url = base_url or os.environ.get("DOCKER_HOST", "unix:///var/run/docker.sock")
+        self.api_version = api_version
+        self.max_idle_connections = max_idle_connections
+        self.timeout = timeout
+        self._idle_connections = []
+
+    async def _new_connection(self):
+        url = urlparse(self.base_url)
+        if url.scheme == "unix":
+            return await asyncio.open_unix_connection(url.path)
+        if url.scheme in ("tcp", "http"):
+            return await asyncio.open_connection(url.hostname, url.port or 2375)
+        raise AssertionError("Unsupported docker host: %s" % self.base_url)
+
+    async def _get_connection(self):
+        if self._idle_connections:
+            return self._idle_connections.pop(), True
+        return await self._new_connection(), False
+
+    def _put_connection(self, connection):
+        if len(self._idle_connections) < self.max_idle_connections:
+            self._idle_connections.append(connection)
+        else:
+            connection[1].close()
+
+    def close(self):
+        connections, self._idle_connections = self._idle_connections, []
+        for reader, writer in connections:
+            writer.close()
+
+    @staticmethod
+    async def _read_head(reader):
+        """
+        :return: (status, headers)
+        """
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by the docker daemon")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return status, headers
+
+    @staticmethod
+    async def _read_response(reader):
+        """
+        :return: (status, headers, body, will_close)
+        """
+        status, headers = await AsyncDockerEngineClient._read_head(reader)
+        will_close = headers.get("connection", "").lower() == "close"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            # Trailers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif status in (204, 304) or status < 200:
+            body = b""
+        else:
+            body = await reader.read()
+            will_close = True
+        return status, headers, body, will_close
+
+    @staticmethod
+    def _error(status, data):
+        try:
+            message = json.loads(data.decode("utf8")).get("message", "")
+        except ValueError:
+            message = data.decode("utf8", "replace")
+        return DockerEngineError(status, message)
+
+    async def request(self, method, path, params=None, body=None, timeout=-1, raw=False):
+        """
+        :param timeout: Seconds to wait for the response, None to wait forever. Defaults to the client's timeout.
+        :param raw: Return the response body as bytes instead of decoding it as json.
+        :return: Decoded response (None for empty responses)
+        """
+        url = "/v%s%s" % (self.api_version, path)
+        if params:
+            url += "?" + urlencode(params)
+        payload = b""
+        head = "%s %s HTTP/1.1\r\nHost: localhost\r\n" % (method, url)
+        if body is not None:
+            payload = json.dumps(body).encode("utf8")
+            head += "Content-Type: application/json\r\n"
+        head += "Content-Length: %d\r\n\r\n" % len(payload)
+        message = head.encode("latin-1") + payload
+
+        while True:
+            connection, reused = await self._get_connection()
+            reader, writer = connection
+            try:
+                writer.write(message)
+                await writer.drain()
+                status, headers, data, will_close = await asyncio.wait_for(
+                    self._read_response(reader), self.timeout if timeout == -1 else timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    # The daemon has closed an idle connection, retry on a new one.
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if will_close:
+                writer.close()
+            else:
+                self._put_connection(connection)
+            break
+
+        if status >= 400:
+            raise self._error(status, data)
+        if raw:
+            return data
+        if not data:
+            return None
+        return json.loads(data.decode("utf8"))
+
+    async def create_network(self, name, labels=None):
+        return (await self.request("POST", "/networks/create", body={
+            "Name": name, "CheckDuplicate": True, "Labels": labels or {},
+        }))["Id"]
+
+    async def remove_network(self, network_id):
+        await self.request("DELETE", "/networks/%s" % network_id)
+
+    async def create_container(self, name, config):
+        return (await self.request("POST", "/containers/create", params={"name": name}, body=config))["Id"]
+
+    async def start_container(self, container_id):
+        await self.request("POST", "/containers/%s/start" % container_id)
+
+    async def wait_container(self, container_id):
+        """
+        Waits until the container stops.
+        :return: exit code of the container
+        """
+        return (await self.request("POST", "/containers/%s/wait" % container_id, timeout=None))["StatusCode"]
+
+    async def kill_container(self, container_id, signal="SIGKILL"):
+        await self.request("POST", "/containers/%s/kill" % container_id, params={"signal": signal})
+
+    async def remove_container(self, container_id, force=True, volumes=True):
+        await self.request("DELETE", "/containers/%s" % container_id,
+                           params={"force": int(force), "v": int(volumes)})
+
+    async def update_container(self, container_id, **resources):
+        await self.request("POST", "/containers/%s/update" % container_id, body=resources)
+
+    async def list_containers(self, all=True, **filters):
+        params = {"all": int(all)}
+        if filters:
+            params["filters"] = json.dumps(filters)
+        return await self.request("GET", "/containers/json", params=params)
+
+    async def container_logs(self, container_id, tty=False):
+        """
+        :return: list of (stream, bytes) where stream is 1 for stdout and 2 for stderr
+        """
+        data = await self.request("GET", "/containers/%s/logs" % container_id,
+                                  params={"stdout": 1, "stderr": 1}, raw=True)
+        if tty:
+            return [(1, data)]
+        return demultiplex(data)
+
+    async def stream_logs(self, container_id, tty=False, follow=True):
+        """
+        Streams the output of a container on a connection of its own, until the container stops (or close is called).
+        :param tty: Whether the container has a tty. Output of such containers is not multiplexed.
+        :return: An AsyncLogStream
+        """
+        url = "/v%s/containers/%s/logs?%s" % (self.api_version, container_id, urlencode({
+            "stdout": 1, "stderr": 1, "follow": int(follow),
+        }))
+        reader, writer = await self._new_connection()
+        try:
+            writer.write(("GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n" % url).encode("latin-1"))
+            await writer.drain()
+            status, headers = await asyncio.wait_for(self._read_head(reader), self.timeout)
+            if status >= 400:
+                length = headers.get("content-length")
+                data = await asyncio.wait_for(reader.readexactly(int(length)) if length else reader.read(65536),
+                                              self.timeout)
+                raise self._error(status, data)
+        except BaseException:
+            writer.close()
+            raise
+        return AsyncLogStream(reader, writer, headers, tty)
+
+
+class AsyncLogStream(object):
+    """
+    asyncio version of engine.LogStream: iterates (async for) over the output of a container as (stream, bytes)
+    frames while it is produced. Only one frame is held in memory at a time.
+    """
+
+    def __init__(self, reader, writer, headers, tty=False):
+        self.reader = reader
+        self.writer = writer
+        self.tty = tty
+        self._chunked = headers.get("transfer-encoding", "").lower() == "chunked"
+        self._remaining = int(headers["content-length"]) if "content-length" in headers else None
+        self._buffer = b""
+
+    async def _read_more(self):
+        """
+        Appends the next piece of the response body to the buffer.
+        :return: False at the end of the body
+        """
+        if self._chunked:
+            size = int((await self.reader.readline()).split(b";")[0] or b"0", 16)
+            if size == 0:
+                return False
+            data = await self.reader.readexactly(size)
+            await self.reader.readline()
+        else:
+            if self._remaining == 0:
+                return False
+            data = await self.reader.read(65536 if self._remaining is None else min(self._remaining, 65536))
+            if not data:
+                return False
+            if self._remaining is not None:
+                self._remaining -= len(data)
+        self._buffer += data
+        return True
+
+    async def _read(self, size):
+        while len(self._buffer) < size:
+            if not await self._read_more():
+                break
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def __aiter__(self):
+        return self
+
+    async def _next_frame(self):
+        """
+        :return: (stream, bytes), or None at the end of the output
+        """
+        if self.tty:
+            if not self._buffer and not await self._read_more():
+                return None
+            data, self._buffer = self._buffer, b""
+            return 1, data
+        header = await self._read(8)
+        if len(header) < 8:
+            return None
+        stream, size = struct.unpack(">BxxxL", header)
+        data = await self._read(size)
+        if len(data) < size:
+            return None
+        return stream, data
+
+    async def __anext__(self):
+        try:
+            frame = await self._next_frame()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # The connection is closed.
+            frame = None
+        if frame is None:
+            self.close()
+            raise StopAsyncIteration
+        return frame
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncEngineRunner(object):
+    """
+    asyncio version of engine.EngineRunner. A single event loop can run hundreds of matches concurrently
+    without a thread per match.
+    """
+
+    # Seconds to wait for the rest of the managers' output after they stop.
+    log_drain_timeout = 5
+
+    def __init__(self, api_version="1.25", max_idle_connections=8):
+        self.api_version = api_version
+        self.max_idle_connections = max_idle_connections
+        self._clients = {}
+
+    def get_client(self, docker_host=None):
+        if docker_host not in self._clients:
+            self._clients[docker_host] = AsyncDockerEngineClient(docker_host, self.api_version,
+                                                                 self.max_idle_connections)
+        return self._clients[docker_host]
+
+    @staticmethod
+    async def _create_container(client, name, config):
+        try:
+            return await client.create_container(name, config)
+        except DockerEngineError as e:
+            if e.status != 409:
+                raise
+            # A container of a previous run with the same name is left, remove it.
+            await client.remove_container(name)
+            return await client.create_container(name, config)
+
+    @staticmethod
+    async def _remove_all(client, container_ids, network_id):
+        results = await asyncio.gather(*[client.remove_container(container_id, force=True)
+                                         for container_id in container_ids], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, DockerEngineError):
+                raise result
+        try:
+            await client.remove_network(network_id)
+        except DockerEngineError:
+            pass
+
+    @staticmethod
+    async def _capture(client, service_name, container_id, tty, logs):
+        """
+        Feeds the output of a container to logs (prints it if logs is None) while it is produced, until the
+        container stops or logs has enough of it.
+        """
+        try:
+            log_stream = await client.stream_logs(container_id, tty)
+        except (ConnectionError, DockerEngineError):
+            return
+        loop = asyncio.get_event_loop()
+        partial_line = b""
+        try:
+            async for stream, data in log_stream:
+                if logs is None:
+                    lines = (partial_line + data).split(b"\n")
+                    partial_line = lines.pop()
+                    for line in lines:
+                        sys.stdout.write("%s | %s\n" % (service_name, line.decode("utf8", "replace")))
+                # Waits for room in the capture's queue on the default executor, not on the loop.
+                elif not await loop.run_in_executor(None, logs.feed, service_name, stream, data):
+                    return
+        finally:
+            log_stream.close()
+            if partial_line:
+                sys.stdout.write("%s | %s\n" % (service_name, partial_line.decode("utf8", "replace")))
+
+    async def run(self, project_name, compose_data, manager_services, timeout, docker_host=None, logs=None):
+        """
+        Coroutine with the same parameters as EngineRunner.run.
+        Raises TimeoutError if managers don't stop in timeout seconds.
+        Output of managers is streamed to logs (printed if logs is None) while they run.
+        """
+        client = self.get_client(docker_host)
+        if not manager_services:
+            manager_services = list(compose_data.keys())
+        labels = {"com.docker.compose.project": project_name}
+
+        network_name = "%s_default" % project_name
+        try:
+            network_id = await client.create_network(network_name, labels)
+        except DockerEngineError as e:
+            if e.status != 409:
+                raise
+            await client.remove_network(network_name)
+            network_id = await client.create_network(network_name, labels)
+
+        container_ids = []
+        captures = []
+        timed_out = False
+        try:
+            start = metrics.start()
+            containers = {}
+            for service_name, service in compose_data.items():
+                name, config = container_config(project_name, service_name, service, network_name)
+                containers[service_name] = await self._create_container(client, name, config)
+                container_ids.append(containers[service_name])
+            await asyncio.gather(*[client.start_container(container_id) for container_id in container_ids])
+            metrics.START_SECONDS.observe_since(start, runner="aio")
+
+            captures = [asyncio.ensure_future(self._capture(client, service_name, containers[service_name],
+                                                            compose_data[service_name].get("tty", False), logs))
+                        for service_name in manager_services]
+            try:
+                await asyncio.wait_for(asyncio.gather(*[client.wait_container(containers[service_name])
+                                                        for service_name in manager_services]), timeout or None)
+            except asyncio.TimeoutError:
+                timed_out = True
+            if not timed_out and captures:
+                # The rest of the managers' output.
+                await asyncio.wait(captures, timeout=self.log_drain_timeout)
+        finally:
+            for capture in captures:
+                capture.cancel()
+            await asyncio.gather(*captures, return_exceptions=True)
+            if logs is not None:
+                await asyncio.get_event_loop().run_in_executor(None, logs.close)
+            start = metrics.start()
+            await self._remove_all(client, container_ids, network_id)
+            # Forced removal kills the containers too, it is not a kill latency comparable to the other runners'.
+            metrics.CLEANUP_SECONDS.observe_since(start)
+        if timed_out:
+            raise TimeoutError()
+
+
+class AsyncCPUScheduler(object):
+    """
+    Lets coroutines reserve cpu shares from an AtomicCPUScheduler.
+    Redis calls run in an executor and waiting is done with asyncio.sleep, so waiting requests hold no thread.
+    """
+
+    def __init__(self, scheduler, executor=None, poll_interval=0.1):
+        """
+        :param scheduler: An AtomicCPUScheduler.
+        :param executor: concurrent.futures executor running redis calls. None means the loop's default executor.
+        :param poll_interval: Seconds between two attempts of a waiting request.
+        """
+        if not hasattr(scheduler, "_try_acquire"):
+            raise AssertionError("AsyncCPUScheduler needs an AtomicCPUScheduler")
+        self.scheduler = scheduler
+        self.executor = executor
+        self.poll_interval = poll_interval
+
+    def _run(self, function, *args):
+        return asyncio.get_event_loop().run_in_executor(self.executor, function, *args)
+
+    async def reserve(self, user, cpu_shares, timeout=None, priority=0, memory=0):
+        """
+        Coroutine version of AtomicCPUScheduler.reserve. Waiting requests keep their place in the scheduler's queue.
+        """
+        for share in cpu_shares:
+            if not self.scheduler.is_valid_share(share):
+                raise AssertionError("Invalid CPU share: %s" % share)
+        loop = asyncio.get_event_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        ticket = uuid.uuid4().hex
+        start = metrics.start()
+        try:
+            while True:
+                reservation = await self._run(self.scheduler._try_acquire, user, cpu_shares, ticket, priority,
+                                              int(memory))
+                if reservation is not None:
+                    metrics.SCHEDULER_SECONDS.observe_since(start, scheduler="atomic", operation="acquire")
+                    return reservation
+                wait = self.poll_interval
+                if deadline is not None:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        metrics.TIMEOUTS.inc(kind="reserve")
+                        raise TimeoutError("Could not reserve cpu shares %s and %d bytes of memory for %s" %
+                                           (cpu_shares, memory, user))
+                    wait = min(wait, remaining)
+                await asyncio.sleep(wait)
+        except BaseException:
+            await self._run(self.scheduler._cancel_ticket, ticket)
+            raise
+
+    async def release_cpu(self, user, cpu_number):
+        await self._run(self.scheduler.release_cpu, user, cpu_number)
+
+    async def release_all_cpus(self, user):
+        await self._run(self.scheduler.release_all_cpus, user)
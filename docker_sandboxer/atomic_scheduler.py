@@ -0,0 +1,556 @@
+import json
+import threading
+import time
+import uuid
+
+from . import metrics
+from .placement import get_policy, PackPolicy
+from .scheduler import CPUScheduler, CPUReservation
+from .topology import CPUTopology
+from .scheduler_scripts import ACQUIRE_SCRIPT, RELEASE_SCRIPT, ADD_CPU_SCRIPT, SNAPSHOT_SCRIPT, CLEAR_SCRIPT, \
+    AVAILABILITY_SCRIPT, SET_MEMORY_SCRIPT, RENEW_SCRIPT, REAP_SCRIPT, CHECK_SCRIPT, MOVE_SCRIPT, \
+    SET_GRANULARITY_SCRIPT, CORE_AVAILABLE_PREFIX, \
+    FREE_SET_PREFIX, CORE_USERS_PREFIX, USER_CPUS_PREFIX
+
+
+class AtomicCPUScheduler(CPUScheduler):
+    """
+    A CPUScheduler which reserves and releases all shares of a user in a single atomic redis script.
+    It does not use the global semaphores, so initialize_semaphores is not needed.
+    State is kept in native redis hashes and sorted sets (see scheduler_scripts) instead of json blobs,
+    use migrate_from_json_layout to move the state of a CPUScheduler to this layout.
+
+    Cores may belong to several nodes (docker hosts) sharing the same redis database.
+    A reservation is always placed on a single node, the least loaded one which can fit all of its shares.
+
+    By default shares are placed on cpus by best fit inside the acquire script: the largest share first, each on
+    the fullest cpu it fits on, so whole cpus stay free for whole-cpu requests. If a placement_policy is given,
+    the policy chooses the cpus (using the node's CPUTopology, see register_topology) from a snapshot of the
+    available shares, and the acquire script only grants the request if that placement still fits
+    (after placement_attempts outdated placements, best fit is used).
+
+    Shares are multiples of share_granularity (256 by default, down to 16), shared by every scheduler of
+    the database. defragmentation_hints suggests moves of held shares which would free whole cpus.
+
+    Memory (including swap) of a node can be accounted too, see set_memory. A reservation then holds its
+    memory on the same node as its shares, and both are granted and released together.
+
+    Requests which can not be granted right away wait in a queue ordered by priority and then by arrival.
+    Only the head of the queue may be granted, except that while the head has been waiting for less than
+    backfill_window seconds, any other request that fits the free shares (whatever its size) is granted around it.
+
+    Reservations carry a lease of lease_ttl seconds, renewed by a background thread of the scheduler which
+    granted them until they are released. If the worker dies, the lease expires and reap (see reaper) reclaims
+    the reservation.
+    """
+
+    default_node = "local"
+
+    nodes_map = "cpu-scheduler-nodes"
+    node_capacity_map = "cpu-scheduler-node-capacity"
+    node_free_map = "cpu-scheduler-node-free"
+    user_node_map = "cpu-scheduler-user-node"
+    release_notify_list = "cpu-scheduler-release-notify"
+    waiting_queue = "cpu-scheduler-waiting-queue"
+    waiting_since_map = "cpu-scheduler-waiting-since"
+    waiting_heartbeat_map = "cpu-scheduler-waiting-heartbeat"
+    ticket_counter = "cpu-scheduler-ticket-counter"
+    node_topology_map = "cpu-scheduler-node-topology"
+    node_memory_map = "cpu-scheduler-node-memory"
+    node_free_memory_map = "cpu-scheduler-node-free-memory"
+    user_memory_map = "cpu-scheduler-user-memory"
+    user_lease_map = "cpu-scheduler-user-lease"
+    user_since_map = "cpu-scheduler-user-since"
+    share_granularity_key = "cpu-scheduler-share-granularity"
+
+    placement_attempts = 3
+
+    def __init__(self, host="localhost", port=6379, db=10, poll_interval=1, backfill_window=30,
+                 stale_ticket_timeout=30, placement_policy=None, lease_ttl=60, share_granularity=None):
+        """
+        :param poll_interval: Maximum seconds to wait for a release notification before retrying an acquire.
+        :param backfill_window: Seconds the head of the queue tolerates other requests being granted before it.
+        :param stale_ticket_timeout: Seconds after which a waiter that has not retried is dropped from the queue.
+        :param placement_policy: None for best fit, a PlacementPolicy or one of "pack", "spread" and "topology".
+        :param lease_ttl: Seconds a reservation outlives its worker. None for reservations without a lease.
+        :param share_granularity: A power of two between 16 and 1024. Sets the granularity of the database
+        (see set_share_granularity), None keeps the current one.
+        """
+        super().__init__(host, port, db)
+        self.poll_interval = poll_interval
+        self.backfill_window = backfill_window
+        self.stale_ticket_timeout = stale_ticket_timeout
+        self.placement_policy = get_policy(placement_policy) if placement_policy is not None else None
+        self._topologies = {}
+        self._acquire_script = self.redis_connection.register_script(ACQUIRE_SCRIPT)
+        self._release_script = self.redis_connection.register_script(RELEASE_SCRIPT)
+        self._add_cpu_script = self.redis_connection.register_script(ADD_CPU_SCRIPT)
+        self._snapshot_script = self.redis_connection.register_script(SNAPSHOT_SCRIPT)
+        self._clear_script = self.redis_connection.register_script(CLEAR_SCRIPT)
+        self._availability_script = self.redis_connection.register_script(AVAILABILITY_SCRIPT)
+        self._set_memory_script = self.redis_connection.register_script(SET_MEMORY_SCRIPT)
+        self._renew_script = self.redis_connection.register_script(RENEW_SCRIPT)
+        self._reap_script = self.redis_connection.register_script(REAP_SCRIPT)
+        self._check_script = self.redis_connection.register_script(CHECK_SCRIPT)
+        self._move_script = self.redis_connection.register_script(MOVE_SCRIPT)
+        self._set_granularity_script = self.redis_connection.register_script(SET_GRANULARITY_SCRIPT)
+        self.lease_ttl = lease_ttl
+        self._leased_users = set()
+        self._leases_lock = threading.Lock()
+        self._lease_renewer = None
+        if share_granularity is not None:
+            self.set_share_granularity(share_granularity)
+        else:
+            self.share_granularity = int(self.redis_connection.get(AtomicCPUScheduler.share_granularity_key) or 256)
+
+    @staticmethod
+    def _script_keys():
+        return [AtomicCPUScheduler.nodes_map, AtomicCPUScheduler.node_capacity_map,
+                AtomicCPUScheduler.node_free_map, AtomicCPUScheduler.user_node_map,
+                AtomicCPUScheduler.release_notify_list, AtomicCPUScheduler.waiting_queue,
+                AtomicCPUScheduler.waiting_since_map, AtomicCPUScheduler.waiting_heartbeat_map,
+                AtomicCPUScheduler.ticket_counter, AtomicCPUScheduler.node_memory_map,
+                AtomicCPUScheduler.node_free_memory_map, AtomicCPUScheduler.user_memory_map,
+                AtomicCPUScheduler.user_lease_map, AtomicCPUScheduler.user_since_map,
+                AtomicCPUScheduler.share_granularity_key]
+
+    def set_share_granularity(self, share_granularity):
+        """
+        Sets the granularity of shares of every scheduler using the database. Schedulers created before
+        keep validating shares with the old granularity until they are recreated, the scripts always use the new one.
+        Fails if a cpu has an available or held share which is not a multiple of the new granularity.
+        """
+        if share_granularity not in [1 << bits for bits in range(4, 11)]:
+            raise AssertionError("Share granularity must be a power of two between 16 and 1024")
+        self._set_granularity_script(keys=self._script_keys(), args=[share_granularity])
+        self.share_granularity = share_granularity
+
+    def is_valid_share(self, share):
+        return isinstance(share, int) and 0 <= share <= 1024 and share % self.share_granularity == 0
+
+    def remove_cpu_stats(self):
+        self._clear_script(keys=self._script_keys())
+        self.redis_connection.delete(AtomicCPUScheduler.node_topology_map)
+        self._topologies = {}
+
+    def add_cpu(self, cpu_number, share, node=None, docker_host=None):
+        """
+        :param node: Name of the node this cpu belongs to. Defaults to AtomicCPUScheduler.default_node.
+        :param docker_host: Docker daemon of the node (e.g. tcp://10.0.0.2:2375). None means the local daemon.
+        """
+        if not self.is_valid_share(share):
+            raise AssertionError("Invalid CPU share: %s" % share)
+        if node is None:
+            node = AtomicCPUScheduler.default_node
+        self._add_cpu_script(keys=self._script_keys(), args=[node, docker_host or "", cpu_number, share])
+
+    def add_ases_available_cpus(self, cpu_numbers, node=None, docker_host=None):
+        for cpu_number in cpu_numbers:
+            self.add_cpu(cpu_number, 1024, node, docker_host)
+
+    def set_memory(self, total_memory, node=None):
+        """
+        Sets the memory pool of a node. Until it is set, a node has unlimited memory.
+        :param total_memory: Memory (plus swap) in bytes that containers of the node may use in total.
+        """
+        if node is None:
+            node = AtomicCPUScheduler.default_node
+        self._set_memory_script(keys=self._script_keys(), args=[node, int(total_memory)])
+
+    def register_topology(self, node=None, topology=None):
+        """
+        Stores the cpu topology of a node, used by placement policies.
+        :param topology: A CPUTopology. Defaults to the topology of this host read from sysfs.
+        """
+        if node is None:
+            node = AtomicCPUScheduler.default_node
+        if topology is None:
+            topology = CPUTopology.from_sysfs()
+        self.redis_connection.hset(AtomicCPUScheduler.node_topology_map, node, topology.to_json())
+        self._topologies[node] = topology
+
+    def _get_topology(self, node):
+        if node not in self._topologies:
+            data = self.redis_connection.hget(AtomicCPUScheduler.node_topology_map, node)
+            self._topologies[node] = CPUTopology.from_json(data.decode('utf8')) if data else None
+        return self._topologies[node]
+
+    def _place(self, cpu_shares, memory):
+        """
+        Places cpu_shares using the placement policy on the least loaded node they (and memory) fit on.
+        :return: (node, list of cpu numbers) or None
+        """
+        nodes = []
+        for entry in self._availability_script(keys=self._script_keys()):
+            capacity, free = int(entry[1]), int(entry[2])
+            if capacity <= 0 or free < sum(cpu_shares) or (entry[3] and int(entry[3]) < memory):
+                continue
+            cores = {int(entry[i]): int(entry[i + 1]) for i in range(4, len(entry), 2)}
+            nodes.append(((capacity - free) / capacity, entry[0].decode('utf8'), cores))
+        for load, node, cores in sorted(nodes):
+            cpu_numbers = self.placement_policy.place(cores, list(cpu_shares), self._get_topology(node))
+            if cpu_numbers is not None:
+                return node, cpu_numbers
+        return None
+
+    def fits(self, cpu_shares, memory=0):
+        """
+        Whether cpu_shares and memory could be reserved right now on some node, ignoring the waiting queue.
+        """
+        for entry in self._availability_script(keys=self._script_keys()):
+            capacity, free = int(entry[1]), int(entry[2])
+            if capacity <= 0 or free < sum(cpu_shares) or (entry[3] and int(entry[3]) < memory):
+                continue
+            cores = {int(entry[i]): int(entry[i + 1]) for i in range(4, len(entry), 2)}
+            if PackPolicy().place(cores, list(cpu_shares)) is not None:
+                return True
+        return False
+
+    def fits_capacity(self, cpu_shares, memory=0):
+        """
+        Whether cpu_shares and memory could be reserved on some node if nothing was reserved there,
+        i.e. whether they may ever fit.
+        """
+        status, waiting = self.get_status()
+        for node in status.values():
+            if node['memory'] is not None and node['memory'] < memory:
+                continue
+            cores = {cpu_number: 1024 for cpu_number in node['cores']}
+            if PackPolicy().place(cores, list(cpu_shares)) is not None:
+                return True
+        return False
+
+    def get_availability(self):
+        """
+        Reads the available share of every cpu with a single redis call.
+        :return: dictionary mapping node names to dictionaries of cores count by available share.
+        """
+        availability = {}
+        for entry in self._availability_script(keys=self._script_keys()):
+            shares = availability[entry[0].decode('utf8')] = {}
+            for i in range(5, len(entry), 2):
+                shares[int(entry[i])] = shares.get(int(entry[i]), 0) + 1
+        return availability
+
+    def migrate_from_json_layout(self, remove_old_keys=True):
+        """
+        Copies the state stored by CPUScheduler (json blobs and share lists) to this scheduler's layout.
+        Every cpu is added to the default node. No scheduler should be running on the database during the migration.
+        :return: number of migrated cpus
+        """
+        node = AtomicCPUScheduler.default_node
+        cpu_statuses = self.redis_connection.hgetall(CPUScheduler.cpu_status_map)
+        pipeline = self.redis_connection.pipeline()
+        pipeline.hset(AtomicCPUScheduler.nodes_map, node, "")
+        for cpu_number, cpu_json in cpu_statuses.items():
+            cpu_number = int(cpu_number)
+            cpu_info = json.loads(cpu_json.decode('utf8'))
+            available = cpu_info['available']
+            capacity = available + sum([share for user, share in cpu_info['users']])
+            pipeline.hset(CORE_AVAILABLE_PREFIX + node, cpu_number, available)
+            pipeline.zadd("%s%s:%d" % (FREE_SET_PREFIX, node, available), cpu_number, cpu_number)
+            pipeline.hincrby(AtomicCPUScheduler.node_capacity_map, node, capacity)
+            pipeline.hincrby(AtomicCPUScheduler.node_free_map, node, available)
+            for user, share in cpu_info['users']:
+                pipeline.hincrby("%s%s:%d" % (CORE_USERS_PREFIX, node, cpu_number), user, share)
+                pipeline.hincrby(USER_CPUS_PREFIX + user, cpu_number, share)
+                pipeline.hset(AtomicCPUScheduler.user_node_map, user, node)
+        if remove_old_keys:
+            for cpu_list in CPUScheduler.cpu_list_names_map.values():
+                pipeline.delete(cpu_list)
+            pipeline.delete(CPUScheduler.cpu_status_map)
+            pipeline.delete(CPUScheduler.cpu_scheduler_users_map)
+        pipeline.execute()
+        return len(cpu_statuses)
+
+    def get_status(self):
+        """
+        Reads the whole state with a single redis call.
+        :return: (dictionary mapping node names to {'docker_host': docker host, 'memory': total memory,
+                  'free_memory': free memory, 'cores': cores}, number of requests waiting in the queue)
+                  cores maps cpu numbers to {'available': share, 'users': {user: share}}.
+                  Memory values are None for nodes with unlimited memory.
+        """
+        nodes, waiting = self._snapshot_script(keys=self._script_keys())
+        status = {}
+        for node, docker_host, memory, free_memory, cores in nodes:
+            node_cores = {}
+            for core in cores:
+                users = {}
+                for i in range(2, len(core), 2):
+                    users[core[i].decode('utf8')] = int(core[i + 1])
+                node_cores[int(core[0])] = {'available': int(core[1]), 'users': users}
+            status[node.decode('utf8')] = {
+                'docker_host': docker_host.decode('utf8') or None,
+                'memory': int(memory) if memory else None,
+                'free_memory': int(free_memory) if free_memory else None,
+                'cores': node_cores,
+            }
+        return status, waiting
+
+    def print_status(self):
+        status, waiting = self.get_status()
+
+        for node in sorted(status):
+            cores = status[node]['cores']
+            print("Node `{}` ({}):".format(node, status[node]['docker_host'] or "local docker daemon"))
+            if status[node]['memory'] is None:
+                print("Memory: unlimited")
+            else:
+                print("Memory: {} bytes free of {}".format(status[node]['free_memory'], status[node]['memory']))
+            print()
+
+            for share in range(0, 1025, self.share_granularity):
+                cpu_numbers = [cpu_number for cpu_number in sorted(cores) if cores[cpu_number]['available'] == share]
+                if not cpu_numbers and self.share_granularity < 256:
+                    continue
+                print("CPUs with {} available share:".format(share))
+                print(" ".join([str(cpu_number) for cpu_number in cpu_numbers]) + "\n")
+
+            print("Cores Status:")
+            users = {}
+            for cpu_number in sorted(cores):
+                print(str(cpu_number) + " : " + json.dumps(cores[cpu_number], sort_keys=True))
+                for user in cores[cpu_number]['users']:
+                    users.setdefault(user, []).append(cpu_number)
+            print()
+
+            print("Users:")
+            for user in sorted(users):
+                print(user + " : " + json.dumps(users[user]))
+            print()
+
+        print("Waiting requests: {}".format(waiting))
+        print()
+
+    def _try_acquire(self, user, cpu_shares, ticket="", priority=0, memory=0):
+        args = [user, ticket, priority, None, self.backfill_window, self.stale_ticket_timeout]
+        lease = self.lease_ttl if self.lease_ttl is not None else ""
+        result = None
+        if self.placement_policy is not None:
+            # The placement is computed from a snapshot, so it may be outdated by the time it is checked.
+            for attempt in range(AtomicCPUScheduler.placement_attempts):
+                placement = self._place(cpu_shares, memory)
+                if placement is None:
+                    break
+                node, cpu_numbers = placement
+                args[3] = repr(time.time())
+                result = self._acquire_script(
+                    keys=self._script_keys(),
+                    args=args + [node, memory, lease] + ["%d:%d" % (share, cpu_number)
+                                                         for share, cpu_number in zip(cpu_shares, cpu_numbers)])
+                if result is not None:
+                    break
+        if result is None:
+            # First fit placement. Also enters (or refreshes) the ticket in the waiting queue.
+            args[3] = repr(time.time())
+            result = self._acquire_script(keys=self._script_keys(), args=args + ["", memory, lease] + list(cpu_shares))
+        if result is None:
+            return None
+        if self.lease_ttl is not None:
+            self._keep_lease(user)
+        node, docker_host = result[0].decode('utf8'), result[1].decode('utf8')
+        return CPUReservation(self, user, list(cpu_shares), [int(cpu_number) for cpu_number in result[2:]],
+                              node, docker_host or None, memory)
+
+    def _cancel_ticket(self, ticket):
+        pipeline = self.redis_connection.pipeline()
+        pipeline.zrem(AtomicCPUScheduler.waiting_queue, ticket)
+        pipeline.hdel(AtomicCPUScheduler.waiting_since_map, ticket)
+        pipeline.hdel(AtomicCPUScheduler.waiting_heartbeat_map, ticket)
+        pipeline.execute()
+
+    def try_acquire_cpu(self, user, cpu_shares):
+        """
+        Reserves all of cpu_shares for user or nothing at all. Does not block nor enter the waiting queue.
+        :return: list of cpu numbers (the i-th number belongs to the i-th share) or None if they are not available.
+        """
+        reservation = self._try_acquire(user, cpu_shares)
+        if reservation is None:
+            return None
+        return reservation.cpu_numbers
+
+    def reserve(self, user, cpu_shares, timeout=None, priority=0, memory=0):
+        """
+        Waits until all of cpu_shares (and memory) can be reserved for user and reserves them at once.
+        :param timeout: Maximum seconds to wait. TimeoutError is raised afterwards. None means waiting forever.
+        :param priority: Requests with higher priority are served first.
+        :param memory: Memory (plus swap) in bytes to reserve on the same node as the shares.
+        :return: a CPUReservation
+        """
+        for share in cpu_shares:
+            if not self.is_valid_share(share):
+                raise AssertionError("Invalid CPU share: %s" % share)
+        deadline = None if timeout is None else time.time() + timeout
+        ticket = uuid.uuid4().hex
+        start = metrics.start()
+        try:
+            while True:
+                reservation = self._try_acquire(user, cpu_shares, ticket, priority, int(memory))
+                if reservation is not None:
+                    metrics.SCHEDULER_SECONDS.observe_since(start, scheduler="atomic", operation="acquire")
+                    return reservation
+                wait = self.poll_interval
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        metrics.TIMEOUTS.inc(kind="reserve")
+                        raise TimeoutError("Could not reserve cpu shares %s and %d bytes of memory for %s" %
+                                           (cpu_shares, memory, user))
+                    wait = min(wait, remaining)
+                if wait >= 1:
+                    # Wakes up as soon as some shares are released, or after poll_interval in any case.
+                    # Redis before 6 only takes whole seconds, rounding down never passes the deadline.
+                    self.redis_connection.blpop(AtomicCPUScheduler.release_notify_list, int(wait))
+                else:
+                    time.sleep(wait)
+        except BaseException:
+            self._cancel_ticket(ticket)
+            raise
+
+    def acquire_cpu(self, user, cpu_shares):
+        for share in cpu_shares:
+            if not self.is_valid_share(share):
+                return None
+        return self.reserve(user, cpu_shares).cpu_numbers
+
+    def release_cpu(self, user, cpu_number):
+        start = metrics.start()
+        self._release_script(keys=self._script_keys(), args=[user, cpu_number])
+        metrics.SCHEDULER_SECONDS.observe_since(start, scheduler="atomic", operation="release")
+
+    def release_all_cpus(self, user):
+        start = metrics.start()
+        with self._leases_lock:
+            self._leased_users.discard(user)
+        self._release_script(keys=self._script_keys(), args=[user])
+        metrics.SCHEDULER_SECONDS.observe_since(start, scheduler="atomic", operation="release")
+
+    def _keep_lease(self, user):
+        with self._leases_lock:
+            self._leased_users.add(user)
+            if self._lease_renewer is None:
+                self._lease_renewer = threading.Thread(target=self._renew_leases, daemon=True)
+                self._lease_renewer.start()
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease_ttl / 3.0)
+            with self._leases_lock:
+                users = list(self._leased_users)
+            if not users:
+                continue
+            try:
+                lost = self.renew_leases(users)
+            except Exception:
+                # Redis is unreachable, leases are renewed on the next round if it comes back in time.
+                continue
+            with self._leases_lock:
+                self._leased_users.difference_update(lost)
+
+    def renew_leases(self, users):
+        """
+        Extends the leases of users by lease_ttl seconds. Reservations granted by this scheduler are renewed
+        automatically until they are released.
+        :return: list of users which don't hold a reservation anymore (e.g. it has been reaped)
+        """
+        lost = self._renew_script(keys=self._script_keys(), args=[repr(time.time() + self.lease_ttl)] + list(users))
+        return [user.decode('utf8') for user in lost]
+
+    def get_leases(self):
+        """
+        :return: dictionary mapping each user holding a reservation to
+                 {'node': node, 'since': time it was granted, 'expires': time its lease expires or None}
+        """
+        pipeline = self.redis_connection.pipeline()
+        pipeline.hgetall(AtomicCPUScheduler.user_node_map)
+        pipeline.hgetall(AtomicCPUScheduler.user_lease_map)
+        pipeline.hgetall(AtomicCPUScheduler.user_since_map)
+        nodes, leases, since = pipeline.execute()
+        return {user.decode('utf8'): {
+            'node': node.decode('utf8'),
+            'since': float(since[user]) if user in since else None,
+            'expires': float(leases[user]) if user in leases else None,
+        } for user, node in nodes.items()}
+
+    def reap(self, user, grace, now=None):
+        """
+        Releases the reservation of user if its lease has expired, or if it has no lease and was granted
+        more than grace seconds ago. The check and the release are atomic.
+        :return: True if the reservation was released
+        """
+        now = time.time() if now is None else now
+        return bool(self._reap_script(keys=self._script_keys(), args=[user, repr(now), grace]))
+
+    def move_share(self, user, from_cpu, to_cpu):
+        """
+        Moves the share user holds on from_cpu to to_cpu of the same node, if it still fits there.
+        Only the accounting is changed: the caller must update the cpusets of the user's containers
+        (e.g. with DockerEngineClient.update_container(container_id, CpusetCpus=...)).
+        :return: the moved share, or None if nothing was moved
+        """
+        share = self._move_script(keys=self._script_keys(), args=[user, from_cpu, to_cpu])
+        return int(share) if share else None
+
+    def defragmentation_hints(self, cpu_shares=None, node=None):
+        """
+        Suggests moves of held shares which empty partly used cpus into other partly used cpus.
+        Cpus holding the least are emptied first, each share goes to the fullest cpu it fits on.
+        :param cpu_shares: A request which does not fit right now. Only moves which make it fit are suggested
+        (nothing on nodes where it fits already or where moves would not make it fit).
+        None suggests every move which frees a whole cpu.
+        :param node: Only consider this node. None means every node.
+        :return: list of {'node', 'user', 'share', 'from', 'to'} to apply in order with move_share
+        """
+        status, waiting = self.get_status()
+        pack = PackPolicy()
+        hints = []
+        for node_name in sorted(status):
+            if node is not None and node_name != node:
+                continue
+            cores = status[node_name]['cores']
+            available = {cpu: core['available'] for cpu, core in cores.items()}
+            users = {cpu: dict(core['users']) for cpu, core in cores.items()}
+            if cpu_shares is not None and pack.place(available, cpu_shares) is not None:
+                continue
+            moves = []
+            emptied = set()
+            sources = sorted([cpu for cpu in cores if users[cpu]],
+                             key=lambda cpu: (1024 - available[cpu], cpu))
+            for source in sources:
+                trial = dict(available)
+                source_moves = []
+                for user, share in sorted(users[source].items(), key=lambda item: (-item[1], item[0])):
+                    targets = [cpu for cpu in trial if cpu != source and cpu not in emptied and
+                               0 < 1024 - trial[cpu] and trial[cpu] >= share]
+                    if not targets:
+                        break
+                    target = min(targets, key=lambda cpu: (trial[cpu], cpu))
+                    trial[source] += share
+                    trial[target] -= share
+                    source_moves.append((user, share, target))
+                else:
+                    available = trial
+                    emptied.add(source)
+                    for user, share, target in source_moves:
+                        users[source].pop(user)
+                        users[target][user] = users[target].get(user, 0) + share
+                        moves.append({'node': node_name, 'user': user, 'share': share, 'from': source,
+                                      'to': target})
+                    if cpu_shares is not None and pack.place(available, cpu_shares) is not None:
+                        break
+            else:
+                if cpu_shares is not None:
+                    # Even emptying every cpu it could would not make the request fit.
+                    moves = []
+            hints.extend(moves)
+        return hints
+
+    def check_consistency(self, repair=False):
+        """
+        Checks the share lists, node totals, the users' cpu index and free memory against the core status hashes.
+        :param repair: Rebuild the inconsistent structures from the core status hashes.
+        :return: list of the problems found
+        """
+        problems = self._check_script(keys=self._script_keys(), args=["1" if repair else "0"])
+        return [problem.decode('utf8') for problem in problems]
@@ -0,0 +1,584 @@
+import http.client
+import json
+import os
+import re
+import shlex
+import socket
+import struct
+import threading
+from urllib.parse import urlencode, urlparse
+
+from . import metrics
+from .logs import LogCapture
+
+
+class DockerEngineError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__("Docker engine returned %d: %s" % (status, message))
+        self.status = status
+        self.message = message
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path):
+        super().__init__("localhost")
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerEngineClient(object):
+    """
+    A minimal client for the Docker Engine HTTP API.
+    Keeps idle keep-alive connections in a pool, so consecutive requests don't reconnect.
+    """
+
+    def __init__(self, base_url=None, api_version="1.25", max_idle_connections=8, timeout=60):
+        """
+        :param base_url: unix:///path/to/docker.sock or tcp://host:port. Defaults to $DOCKER_HOST or the local socket.
+        :param max_idle_connections: Maximum number of idle connections kept open.
+        :param timeout: Socket timeout of requests in seconds, except for requests which wait for containers.
+        """
+        self.base_url = base_url or os.environ.get("DOCKER_HOST", "unix:///var/run/docker.sock")
+        self.api_version = api_version
+        self.max_idle_connections = max_idle_connections
+        self.timeout = timeout
+        self._idle_connections = []
+        self._pool_lock = threading.Lock()
+
+    def _new_connection(self):
+        url = urlparse(self.base_url)
+        if url.scheme == "unix":
+            return _UnixHTTPConnection(url.path)
+        if url.scheme in ("tcp", "http"):
+            return http.client.HTTPConnection(url.hostname, url.port or 2375)
+        raise AssertionError("Unsupported docker host: %s" % self.base_url)
+
+    def _get_connection(self):
+        with self._pool_lock:
+            if self._idle_connections:
+                return self._idle_connections.pop(), True
+        return self._new_connection(), False
+
+    def _put_connection(self, connection):
+        with self._pool_lock:
+            if len(self._idle_connections) < self.max_idle_connections:
+                self._idle_connections.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._pool_lock:
+            connections, self._idle_connections = self._idle_connections, []
+        for connection in connections:
+            connection.close()
+
+    def request(self, method, path, params=None, body=None, timeout=-1, raw=False):
+        """
+        :param timeout: Socket timeout in seconds, None to wait forever. Defaults to the client's timeout.
+        :param raw: Return the response body as bytes instead of decoding it as json.
+        :return: Decoded response (None for empty responses)
+        """
+        url = "/v%s%s" % (self.api_version, path)
+        if params:
+            url += "?" + urlencode(params)
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode("utf8")
+            headers["Content-Type"] = "application/json"
+
+        while True:
+            connection, reused = self._get_connection()
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                connection.sock.settimeout(self.timeout if timeout == -1 else timeout)
+                connection.request(method, url, body=payload, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                connection.close()
+                if reused:
+                    # The daemon has closed an idle connection, retry on a new one.
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._put_connection(connection)
+            break
+
+        if response.status >= 400:
+            try:
+                message = json.loads(data.decode("utf8")).get("message", "")
+            except ValueError:
+                message = data.decode("utf8", "replace")
+            raise DockerEngineError(response.status, message)
+        if raw:
+            return data
+        if not data:
+            return None
+        return json.loads(data.decode("utf8"))
+
+    def create_network(self, name, labels=None):
+        return self.request("POST", "/networks/create", body={
+            "Name": name, "CheckDuplicate": True, "Labels": labels or {},
+        })["Id"]
+
+    def remove_network(self, network_id):
+        self.request("DELETE", "/networks/%s" % network_id)
+
+    def create_container(self, name, config):
+        """
+        :param name: Name of the container, None to let docker choose one.
+        """
+        params = {"name": name} if name is not None else None
+        return self.request("POST", "/containers/create", params=params, body=config)["Id"]
+
+    def start_container(self, container_id):
+        self.request("POST", "/containers/%s/start" % container_id)
+
+    def wait_container(self, container_id):
+        """
+        Waits until the container stops.
+        :return: exit code of the container
+        """
+        return self.request("POST", "/containers/%s/wait" % container_id, timeout=None)["StatusCode"]
+
+    def kill_container(self, container_id, signal="SIGKILL"):
+        self.request("POST", "/containers/%s/kill" % container_id, params={"signal": signal})
+
+    def remove_container(self, container_id, force=True, volumes=True):
+        self.request("DELETE", "/containers/%s" % container_id,
+                     params={"force": int(force), "v": int(volumes)})
+
+    def inspect_container(self, container_id):
+        return self.request("GET", "/containers/%s/json" % container_id)
+
+    def update_container(self, container_id, **resources):
+        self.request("POST", "/containers/%s/update" % container_id, body=resources)
+
+    def rename_container(self, container_id, name):
+        self.request("POST", "/containers/%s/rename" % container_id, params={"name": name})
+
+    def connect_network(self, network_id, container_id, endpoint_config=None):
+        self.request("POST", "/networks/%s/connect" % network_id, body={
+            "Container": container_id, "EndpointConfig": endpoint_config or {},
+        })
+
+    def disconnect_network(self, network_id, container_id, force=False):
+        self.request("POST", "/networks/%s/disconnect" % network_id, body={
+            "Container": container_id, "Force": force,
+        })
+
+    def list_containers(self, all=True, **filters):
+        """
+        :param filters: Docker list filters, e.g. label=["com.docker.compose.project=uid"]
+        """
+        params = {"all": int(all)}
+        if filters:
+            params["filters"] = json.dumps(filters)
+        return self.request("GET", "/containers/json", params=params)
+
+    def list_networks(self, **filters):
+        """
+        :param filters: Docker list filters, e.g. label=["com.docker.compose.project=uid"]
+        """
+        return self.request("GET", "/networks", params={"filters": json.dumps(filters)} if filters else None)
+
+    def container_logs(self, container_id, tty=False):
+        """
+        :param tty: Whether the container has a tty. Output of such containers is not multiplexed.
+        :return: list of (stream, bytes) where stream is 1 for stdout and 2 for stderr
+        """
+        data = self.request("GET", "/containers/%s/logs" % container_id,
+                            params={"stdout": 1, "stderr": 1}, raw=True)
+        if tty:
+            return [(1, data)]
+        return demultiplex(data)
+
+    def stream_logs(self, container_id, tty=False, follow=True):
+        """
+        Streams the output of a container on a connection of its own, until the container stops (or close is called).
+        :param tty: Whether the container has a tty. Output of such containers is not multiplexed.
+        :return: A LogStream
+        """
+        url = "/v%s/containers/%s/logs?%s" % (self.api_version, container_id, urlencode({
+            "stdout": 1, "stderr": 1, "follow": int(follow),
+        }))
+        connection = self._new_connection()
+        try:
+            connection.connect()
+            connection.sock.settimeout(None)
+            connection.request("GET", url)
+            response = connection.getresponse()
+            if response.status >= 400:
+                data = response.read()
+                try:
+                    message = json.loads(data.decode("utf8")).get("message", "")
+                except ValueError:
+                    message = data.decode("utf8", "replace")
+                raise DockerEngineError(response.status, message)
+        except BaseException:
+            connection.close()
+            raise
+        return LogStream(connection, response, tty)
+
+
+class LogStream(object):
+    """
+    Iterates over the output of a container as (stream, bytes) frames while it is produced.
+    close may be called from another thread to stop an iteration which is waiting for output.
+    """
+
+    def __init__(self, connection, response, tty=False):
+        self.connection = connection
+        self.response = response
+        self.tty = tty
+
+    def __iter__(self):
+        try:
+            while True:
+                if self.tty:
+                    data = self.response.read1(65536)
+                    if not data:
+                        return
+                    yield 1, data
+                    continue
+                header = self.response.read(8)
+                if len(header) < 8:
+                    return
+                stream, size = struct.unpack(">BxxxL", header)
+                data = self.response.read(size)
+                yield stream, data
+                if len(data) < size:
+                    return
+        except (OSError, ValueError, http.client.HTTPException):
+            # The connection is closed.
+            return
+        finally:
+            self.close()
+
+    def close(self):
+        if self.connection.sock is not None:
+            try:
+                self.connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.connection.close()
+
+
+def demultiplex(data):
+    """
+    Splits the multiplexed output of a container without a tty into (stream, bytes) frames.
+    Each frame is prefixed by an 8 bytes header: stream type, 3 zero bytes and the frame size (big endian).
+    """
+    frames = []
+    offset = 0
+    while offset + 8 <= len(data):
+        stream, size = struct.unpack(">BxxxL", data[offset:offset + 8])
+        frames.append((stream, data[offset + 8:offset + 8 + size]))
+        offset += 8 + size
+    return frames
+
+
+def compose_project_names(project_name):
+    """
+    The names a project may be labelled with: the name itself (EngineRunner), the name normalized by
+    docker-compose 1.21 and later (lowercase letters, digits, "-" and "_" are kept) and by older versions
+    (only lowercase letters and digits are kept).
+    """
+    lowered = project_name.lower()
+    return sorted(set([project_name, re.sub(r"[^-_a-z0-9]", "", lowered), re.sub(r"[^a-z0-9]", "", lowered)]))
+
+
+def project_containers(client, project_name):
+    """
+    Lists the containers (running or not) of a project run by docker-compose or EngineRunner, found by their project
+    label or, for containers taken from a warm pool which don't have the label, by their name.
+    :return: list of containers as returned by DockerEngineClient.list_containers
+    """
+    names = compose_project_names(project_name)
+    containers = {}
+    for name in names:
+        # Label filters must all match, so each name is a separate query.
+        for container in client.list_containers(label=["com.docker.compose.project=%s" % name]):
+            containers[container["Id"]] = container
+    for container in client.list_containers(name=["^/%s_" % re.escape(name) for name in names]):
+        # The name filter also matches projects whose name starts with <name>_, only <name>_<service>_1 is ours.
+        service = (container.get("Labels") or {}).get("com.docker.compose.service")
+        if service is not None and set(container.get("Names") or []) & \
+                set(["/%s_%s_1" % (name, service) for name in names]):
+            containers[container["Id"]] = container
+    return list(containers.values())
+
+
+def project_networks(client, project_name):
+    """
+    Lists the networks of a project run by docker-compose or EngineRunner, found by their project label.
+    :return: list of networks as returned by DockerEngineClient.list_networks
+    """
+    networks = {}
+    for name in compose_project_names(project_name):
+        for network in client.list_networks(label=["com.docker.compose.project=%s" % name]):
+            networks[network["Id"]] = network
+    return list(networks.values())
+
+
+def _key_value_list(value, separator="="):
+    if isinstance(value, dict):
+        return ["%s%s%s" % (key, separator, "" if item is None else item) for key, item in value.items()]
+    return list(value)
+
+
+def _command(value):
+    if isinstance(value, str):
+        return shlex.split(value)
+    return list(value)
+
+
+def _ulimits(value):
+    ulimits = []
+    for name, limit in value.items():
+        if isinstance(limit, dict):
+            ulimits.append({"Name": name, "Soft": limit.get("soft"), "Hard": limit.get("hard")})
+        else:
+            ulimits.append({"Name": name, "Soft": limit, "Hard": limit})
+    return ulimits
+
+
+def _ports(value):
+    exposed, bindings = {}, {}
+    for port in value:
+        parts = str(port).split(":")
+        container_port = parts[-1] if "/" in parts[-1] else parts[-1] + "/tcp"
+        exposed[container_port] = {}
+        if len(parts) > 1:
+            host_ip = parts[0] if len(parts) == 3 else ""
+            bindings.setdefault(container_port, []).append({"HostIp": host_ip, "HostPort": parts[-2]})
+    return exposed, bindings
+
+
+# Compose keys which map one to one to a key of the container config or of its host config.
+_CONFIG_KEYS = {
+    "image": "Image", "working_dir": "WorkingDir", "user": "User", "hostname": "Hostname",
+    "tty": "Tty", "stdin_open": "OpenStdin", "labels": "Labels", "stop_signal": "StopSignal",
+}
+_HOST_CONFIG_KEYS = {
+    "privileged": "Privileged", "mem_limit": "Memory", "memswap_limit": "MemorySwap", "cpuset": "CpusetCpus",
+    "cpu_shares": "CpuShares", "cap_add": "CapAdd", "cap_drop": "CapDrop", "read_only": "ReadonlyRootfs",
+    "network_mode": "NetworkMode", "pids_limit": "PidsLimit", "shm_size": "ShmSize", "dns": "Dns",
+    "tmpfs": "Tmpfs", "security_opt": "SecurityOpt",
+}
+
+
+def container_config(project_name, service_name, service, network_name):
+    """
+    Translates a docker-compose (version 1 format) service to a Docker Engine API container config.
+    :return: (container name, config)
+    """
+    config = {
+        "Labels": {},
+        "HostConfig": {},
+        "NetworkingConfig": {"EndpointsConfig": {network_name: {"Aliases": [service_name]}}},
+    }
+    host_config = config["HostConfig"]
+    endpoint_config = config["NetworkingConfig"]["EndpointsConfig"][network_name]
+    unsupported = []
+    for key, value in service.items():
+        if key in _CONFIG_KEYS:
+            config[_CONFIG_KEYS[key]] = dict(value) if key == "labels" else value
+        elif key in _HOST_CONFIG_KEYS:
+            host_config[_HOST_CONFIG_KEYS[key]] = value
+        elif key == "command":
+            config["Cmd"] = _command(value)
+        elif key == "entrypoint":
+            config["Entrypoint"] = _command(value)
+        elif key == "environment":
+            config["Env"] = _key_value_list(value)
+        elif key == "volumes":
+            host_config["Binds"] = list(value)
+        elif key == "ulimits":
+            host_config["Ulimits"] = _ulimits(value)
+        elif key == "restart":
+            host_config["RestartPolicy"] = {"Name": value}
+        elif key == "extra_hosts":
+            host_config["ExtraHosts"] = _key_value_list(value, ":")
+        elif key == "ports":
+            config["ExposedPorts"], host_config["PortBindings"] = _ports(value)
+        elif key == "links":
+            # Every service is reachable by its name on the project network, links add aliases of the linked
+            # container which only this container resolves.
+            links = []
+            for link in value:
+                linked_service, _, alias = link.partition(":")
+                links.append("%s_%s_1:%s" % (project_name, linked_service, alias or linked_service))
+            endpoint_config["Links"] = links
+        elif key == "depends_on":
+            pass
+        else:
+            unsupported.append(key)
+    if unsupported:
+        raise AssertionError("Keys %s of service %s are not supported by the engine runner" %
+                             (", ".join(sorted(unsupported)), service_name))
+    if host_config.get("NetworkMode") not in (None, "bridge", network_name):
+        config.pop("NetworkingConfig")
+    else:
+        host_config["NetworkMode"] = network_name
+    config["Labels"]["com.docker.compose.project"] = project_name
+    config["Labels"]["com.docker.compose.service"] = service_name
+    return "%s_%s_1" % (project_name, service_name), config
+
+
+class EngineRunner(object):
+    """
+    Runs the services of a compose dictionary straight through the Docker Engine API, without docker-compose.
+    Behaves like run_compose_with_file: waits until manager containers stop (or timeout), streams their logs,
+    and kills every container afterwards. Containers and the project network are removed in the background.
+    """
+
+    # Seconds to wait for the rest of the managers' output after they stop.
+    log_drain_timeout = 5
+
+    def __init__(self, api_version="1.25", max_idle_connections=8, pool=None, teardown=None):
+        """
+        :param pool: A pool.ContainerPool to take warm containers from, or None to create every container.
+        :param teardown: A teardown.Teardown which kills and removes the containers. Defaults to a shared one.
+        """
+        if teardown is None:
+            # teardown imports this module.
+            from .teardown import default_teardown as teardown
+        self.api_version = api_version
+        self.max_idle_connections = max_idle_connections
+        self.pool = pool
+        self.teardown = teardown
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+    def get_client(self, docker_host=None):
+        with self._clients_lock:
+            if docker_host not in self._clients:
+                self._clients[docker_host] = DockerEngineClient(docker_host, self.api_version,
+                                                                self.max_idle_connections)
+            return self._clients[docker_host]
+
+    def warm(self, compose_data, count=None, docker_host=None):
+        """
+        Creates warm containers in the pool for every service of compose_data.
+        :param count: Number of warm containers to keep for each service. Defaults to the pool's size.
+        """
+        if self.pool is None:
+            raise AssertionError("The runner has no container pool")
+        client = self.get_client(docker_host)
+        for service_name, service in compose_data.items():
+            name, config = container_config("warm", service_name, service, "warm_default")
+            self.pool.warm(client, config, count)
+
+    def _create_container(self, client, name, config):
+        if self.pool is not None:
+            container_id = self.pool.claim(client, name, config)
+            if container_id is not None:
+                return container_id
+        try:
+            return client.create_container(name, config)
+        except DockerEngineError as e:
+            if e.status != 409:
+                raise
+            # A container of a previous run with the same name is left, remove it.
+            client.remove_container(name)
+            return client.create_container(name, config)
+
+    def run(self, project_name, compose_data, manager_services, timeout, docker_host=None, logs=None):
+        """
+        :param project_name: A name used to identify containers of this project
+        :param compose_data: docker-compose (version 1 format) dictionary, mapping service names to services.
+        :param manager_services: list of services which are supposed to act as managers.
+        :param timeout: Seconds to wait for managers before killing every container and raising TimeoutError.
+        :param docker_host: Docker daemon to run the containers on. None means the local daemon.
+        :param logs: A logs.LogCapture which receives the managers' output. Defaults to printing it.
+        """
+        if logs is None:
+            logs = LogCapture(echo=True)
+        client = self.get_client(docker_host)
+        if not manager_services:
+            manager_services = list(compose_data.keys())
+        labels = {"com.docker.compose.project": project_name}
+
+        network_name = "%s_default" % project_name
+        try:
+            network_id = client.create_network(network_name, labels)
+        except DockerEngineError as e:
+            if e.status != 409:
+                raise
+            client.remove_network(network_name)
+            network_id = client.create_network(network_name, labels)
+
+        killer = _ContainerKiller(client, network_id, self.teardown)
+        timer = None
+        try:
+            start = metrics.start()
+            containers = {}
+            for service_name, service in compose_data.items():
+                name, config = container_config(project_name, service_name, service, network_name)
+                containers[service_name] = self._create_container(client, name, config)
+                killer.container_ids.append(containers[service_name])
+            for container_id in containers.values():
+                client.start_container(container_id)
+            metrics.START_SECONDS.observe_since(start, runner="engine")
+
+            if timeout:
+                timer = threading.Timer(timeout, killer.kill, kwargs={"exception_on_kill": TimeoutError()})
+                timer.start()
+            try:
+                for service_name in manager_services:
+                    logs.attach(client, service_name, containers[service_name],
+                                compose_data[service_name].get("tty", False))
+                for service_name in manager_services:
+                    client.wait_container(containers[service_name])
+                logs.close(self.log_drain_timeout)
+            except DockerEngineError:
+                # Containers removed by the killer can not be waited for.
+                if not killer.has_been_killed:
+                    raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            killer.kill()
+            logs.close(self.log_drain_timeout)
+        if killer.exception_on_kill is not None:
+            raise killer.exception_on_kill
+
+
+class _ContainerKiller(object):
+
+    def __init__(self, client, network_id, teardown):
+        self.client = client
+        self.network_id = network_id
+        self.teardown = teardown
+        self.container_ids = []
+        self.has_been_killed = False
+        self.kill_lock = threading.Lock()
+        self.exception_on_kill = None
+
+    def kill(self, exception_on_kill=None):
+        # Other callers wait until the containers are dead.
+        with self.kill_lock:
+            if self.has_been_killed:
+                return
+            self.has_been_killed = True
+            self.exception_on_kill = exception_on_kill
+            try:
+                self.teardown.kill(self.client, self.container_ids)
+            except (IOError, OSError, DockerEngineError):
+                # Forced removal stops them anyway.
+                pass
+            self.teardown.remove_later(self.client, self.container_ids, [self.network_id])
@@ -0,0 +1,187 @@
+import gzip
+import queue
+import sys
+import threading
+
+
+class LogCapture(object):
+    """
+    Collects the output of containers while they run.
+
+    A reader thread per attached container streams its demultiplexed output into a bounded queue. Output is handed to
+    the sinks (callback, file, standard output) by a consumer thread, or to whoever iterates over chunks if there is no
+    sink. When the consumer falls behind, readers wait for room in the queue and docker keeps the rest of the output,
+    so supervision of the match, which runs in other threads, is never blocked by logs.
+
+    Output of a container beyond max_bytes is dropped: a truncation marker is emitted on stream 2 instead and the
+    container is not read anymore.
+    """
+
+    def __init__(self, callback=None, path=None, compress=True, echo=False, max_bytes=None, queue_size=256):
+        """
+        :param callback: Called with (service, stream, bytes) for each chunk of output. stream is 1 for stdout
+        and 2 for stderr.
+        :param path: File to write output lines to, prefixed by service names.
+        :param compress: Whether to gzip the file on the fly.
+        :param echo: Whether to write output lines, prefixed by service names, to the standard output.
+        :param max_bytes: Maximum bytes of output kept for each container. None means no limit.
+        :param queue_size: Maximum number of chunks waiting for the consumer.
+        """
+        self.callback = callback
+        self.path = path
+        self.compress = compress
+        self.echo = echo
+        self.max_bytes = max_bytes
+        self._queue = queue.Queue(queue_size)
+        self._readers = []
+        self._streams = []
+        self._counts = {}  # service -> [bytes, truncated]
+        self._partial_lines = {}
+        self._lock = threading.Lock()
+        self._consumer = None
+        self._iterating = 0
+        self._closed = False
+        self._file = None
+        if callback is not None or path is not None or echo:
+            if path is not None:
+                self._file = gzip.open(path, "wb") if compress else open(path, "wb")
+            self._consumer = threading.Thread(target=self._consume, daemon=True)
+            self._consumer.start()
+
+    def attach(self, client, service, container_id, tty=False):
+        """
+        Starts streaming the output of a container.
+        :param client: An engine.DockerEngineClient of the container's docker daemon.
+        """
+        log_stream = client.stream_logs(container_id, tty)
+        reader = threading.Thread(target=self._read, args=(service, log_stream), daemon=True)
+        with self._lock:
+            self._counts.setdefault(service, [0, False])
+            self._readers.append(reader)
+            self._streams.append(log_stream)
+        reader.start()
+
+    def _read(self, service, log_stream):
+        for stream, data in log_stream:
+            if not self.feed(service, stream, data):
+                log_stream.close()
+                return
+
+    def feed(self, service, stream, data):
+        """
+        Adds a chunk of output of a service. Waits while the queue is full, unless the capture is closed and
+        nothing consumes the queue anymore; the chunk is dropped then.
+        :return: False if the output of service has been truncated or dropped, so the rest of it is not needed.
+        """
+        with self._lock:
+            counts = self._counts.setdefault(service, [0, False])
+            if counts[1]:
+                return False
+            if self.max_bytes is not None and counts[0] + len(data) > self.max_bytes:
+                data = data[:self.max_bytes - counts[0]]
+                counts[1] = True
+            counts[0] += len(data)
+            truncated = counts[1]
+        if data and not self._put((service, stream, data)):
+            return False
+        if truncated:
+            self._put((service, 2, ("\n[output of %s truncated after %d bytes]\n" %
+                                    (service, self.max_bytes)).encode("utf8")))
+            return False
+        return True
+
+    def _put(self, item):
+        """
+        Waits for room in the queue, unless the capture is closed and nothing consumes the queue.
+        :return: False if item has been dropped
+        """
+        while True:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if self._closed and self._consumer is None and not self._iterating:
+                    return False
+
+    def chunks(self):
+        """
+        Yields (service, stream, bytes) chunks until close is called and every chunk is consumed.
+        Must not be used if the capture has a sink.
+        """
+        with self._lock:
+            self._iterating += 1
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                yield item
+        finally:
+            with self._lock:
+                self._iterating -= 1
+
+    def _write_lines(self, service, data):
+        lines = (self._partial_lines.pop(service, b"") + data).split(b"\n")
+        if lines[-1]:
+            self._partial_lines[service] = lines[-1]
+        self._write_prefixed(service, lines[:-1])
+
+    def _write_prefixed(self, service, lines):
+        if not lines:
+            return
+        text = b"".join([service.encode("utf8") + b" | " + line + b"\n" for line in lines])
+        if self._file is not None:
+            self._file.write(text)
+        if self.echo:
+            sys.stdout.write(text.decode("utf8", "replace"))
+
+    def _consume(self):
+        for service, stream, data in self.chunks():
+            if self.callback is not None:
+                try:
+                    self.callback(service, stream, data)
+                except:
+                    pass
+            if self._file is not None or self.echo:
+                self._write_lines(service, data)
+        for service, line in list(self._partial_lines.items()):
+            self._write_prefixed(service, [line])
+        self._partial_lines = {}
+
+    def close(self, timeout=None):
+        """
+        Waits up to timeout seconds for the attached containers to stop writing, stops reading them afterwards,
+        and waits for the consumer to handle what is left.
+        :return: dictionary mapping each service to (bytes of its output kept, whether it was truncated)
+        """
+        with self._lock:
+            closed, self._closed = self._closed, True
+            readers, streams = list(self._readers), list(self._streams)
+        if closed:
+            return self.stats()
+        for reader in readers:
+            reader.join(timeout)
+        for log_stream in streams:
+            log_stream.close()
+        for reader in readers:
+            # A reader waiting for room in the queue still has to put its chunk.
+            while reader.is_alive():
+                if self._consumer is None:
+                    break
+                reader.join(0.1)
+        while not self._put(None):
+            # Nothing consumes the queue: the oldest chunk makes room for the end marker.
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+        if self._consumer is not None:
+            self._consumer.join()
+        if self._file is not None:
+            self._file.close()
+        return self.stats()
+
+    def stats(self):
+        with self._lock:
+            return {service: (counts[0], counts[1]) for service, counts in self._counts.items()}
+
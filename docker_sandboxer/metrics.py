@@ -0,0 +1,289 @@
+"""
+Counters and histograms of the scheduler, Parser and runners, exposed in the Prometheus text format.
+Metrics are disabled (and cost a function call per instrumented operation) until enable or serve is called.
+Serve the metrics of this process with metrics.serve(9100), or the cpu availability of a scheduler database with:
+
+    python -m docker_sandboxer.metrics --host localhost --port 6379 --db 10 --listen-port 9100
+"""
+import argparse
+import bisect
+import http.server
+import threading
+import time
+from collections import OrderedDict
+
+enabled = False
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def start():
+    """
+    :return: A start time for Histogram.observe_since, or None if metrics are disabled.
+    """
+    return time.perf_counter() if enabled else None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(["%s=\"%s\"" % (name, _escape(value)) for name, value in labels])
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # tuple of label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple([labels.get(name, "") for name in self.labelnames])
+
+    def _header(self):
+        return ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.type)]
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append("%s_total%s %s" % (self.name, _format_labels(zip(self.labelnames, key)),
+                                            _format_value(value)))
+        return lines
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        if not enabled:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                # Count of each bucket (the last one is +Inf), sum, count
+                values = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            values[0][index] += 1
+            values[1] += value
+            values[2] += 1
+
+    def observe_since(self, start, **labels):
+        """
+        Observes the seconds elapsed since start, a value returned by metrics.start.
+        """
+        if start is not None:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            values = self._values.get(self._key(labels))
+            return values[2] if values is not None else 0
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            values = sorted([(key, (list(counts), total, count)) for key, (counts, total, count)
+                             in self._values.items()])
+        for key, (counts, total, count) in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append("%s_bucket%s %d" % (self.name, _format_labels(labels + [("le", _format_value(bound))]),
+                                                 cumulative))
+            lines.append("%s_sum%s %s" % (self.name, _format_labels(labels), repr(total)))
+            lines.append("%s_count%s %d" % (self.name, _format_labels(labels), count))
+        return lines
+
+
+class Registry(object):
+    """
+    Holds metrics, and collectors which compute gauges when metrics are rendered.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        :param collector: A function returning a list of (name, help, list of (labels dictionary, value)) gauges.
+        """
+        self.collectors.append(collector)
+
+    def render(self):
+        """
+        :return: Every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        # Gauges of the same name reported by several collectors are merged in one family.
+        gauges = OrderedDict()
+        for collector in self.collectors:
+            try:
+                collected = collector()
+            except Exception as e:
+                lines.append("# collector %s failed: %s" % (getattr(collector, "__name__", "?"),
+                                                            _escape(e).replace("\n", " ")))
+                continue
+            for name, help, samples in collected:
+                gauges.setdefault(name, (help, []))[1].extend(samples)
+        for name, (help, samples) in gauges.items():
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s gauge" % name)
+            for labels, value in samples:
+                lines.append("%s%s %s" % (name, _format_labels(sorted(labels.items())), _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+SCHEDULER_SECONDS = registry.histogram(
+    "docker_sandboxer_scheduler_seconds",
+    "Duration of scheduler operations, including semaphore and queue waits.", ("scheduler", "operation"))
+SEMAPHORE_WAIT_SECONDS = registry.histogram(
+    "docker_sandboxer_semaphore_wait_seconds", "Time CPUScheduler waited for its redis semaphores.", ("semaphore",))
+TIMEOUTS = registry.counter(
+    "docker_sandboxer_timeouts", "Reservations and runs which timed out.", ("kind",))
+TEMPLATE_SECONDS = registry.histogram(
+    "docker_sandboxer_template_seconds", "Time Parser spent rendering and parsing templates.", ("phase",))
+TEMPLATE_CACHE = registry.counter(
+    "docker_sandboxer_template_cache", "Lookups of Parser's compiled template cache.", ("result",))
+START_SECONDS = registry.histogram(
+    "docker_sandboxer_start_seconds", "Time to create and start the containers of a run.", ("runner",))
+RUN_SECONDS = registry.histogram(
+    "docker_sandboxer_run_seconds", "Duration of Parser runs, from starting the containers until they stop.", ("result",))
+KILL_SECONDS = registry.histogram(
+    "docker_sandboxer_kill_seconds", "Time from a kill request until every container of a run stopped.",
+    ("method",))
+CLEANUP_SECONDS = registry.histogram(
+    "docker_sandboxer_cleanup_seconds",
+    "Time to remove the containers and networks of a run (in the background, but for AsyncEngineRunner).")
+
+
+def watch_scheduler(scheduler):
+    """
+    Reports the cores of every node of scheduler by available share, read when metrics are rendered.
+    """
+    def scheduler_cores():
+        samples = []
+        for node, shares in sorted(scheduler.get_availability().items()):
+            for share, count in sorted(shares.items()):
+                samples.append(({"node": node, "share": share}, count))
+        return [("docker_sandboxer_cores", "Cores by available share.", samples)]
+    registry.add_collector(scheduler_cores)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port=9100, host="127.0.0.1"):
+    """
+    Enables metrics and serves them over http at /metrics from a background thread.
+    :return: The http.server.HTTPServer, call its shutdown method to stop serving.
+    """
+    enable()
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    from .atomic_scheduler import AtomicCPUScheduler
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--db", type=int, default=10)
+    parser.add_argument("--listen-host", default="127.0.0.1")
+    parser.add_argument("--listen-port", type=int, default=9100)
+    args = parser.parse_args()
+
+    watch_scheduler(AtomicCPUScheduler(args.host, args.port, args.db))
+    server = serve(args.listen_port, args.listen_host)
+    print("Serving metrics on http://{}:{}/metrics".format(args.listen_host, args.listen_port))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""
+Moves the state stored by CPUScheduler to the layout used by AtomicCPUScheduler.
+Stop every worker using the database before running it:
+
+    python -m docker_sandboxer.migrate --host localhost --port 6379 --db 10
+"""
+import argparse
+
+from .atomic_scheduler import AtomicCPUScheduler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--db", type=int, default=10)
+    parser.add_argument("--keep-old-keys", action="store_true", help="Do not remove the json layout keys")
+    args = parser.parse_args()
+
+    cpu_scheduler = AtomicCPUScheduler(args.host, args.port, args.db)
+    migrated = cpu_scheduler.migrate_from_json_layout(remove_old_keys=not args.keep_old_keys)
+    print("Migrated {} cpus".format(migrated))
+    cpu_scheduler.print_status()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+class PlacementPolicy(object):
+    """
+    Decides which cpus of a node the shares of a reservation are placed on.
+    Subclasses implement place.
+    """
+
+    name = None
+
+    def place(self, cores, cpu_shares, topology=None):
+        """
+        :param cores: dictionary mapping each cpu number of the node to its available share.
+        :param cpu_shares: list of requested shares.
+        :param topology: CPUTopology of the node, or None if unknown.
+        :return: list of cpu numbers (the i-th number is assigned to the i-th share) or None if the shares don't fit.
+        """
+        raise NotImplementedError()
+
+
+class _GreedyPolicy(PlacementPolicy):
+    """
+    Places the largest shares first, each one on the cpu with the smallest _key among those it fits on.
+    """
+
+    @staticmethod
+    def _key(cpu, available):
+        raise NotImplementedError()
+
+    def place(self, cores, cpu_shares, topology=None):
+        available = dict(cores)
+        placement = [None] * len(cpu_shares)
+        for index in sorted(range(len(cpu_shares)), key=lambda i: -cpu_shares[i]):
+            share = cpu_shares[index]
+            candidates = [cpu for cpu in available if available[cpu] >= share]
+            if not candidates:
+                return None
+            cpu = min(candidates, key=lambda c: self._key(c, available[c]))
+            available[cpu] -= share
+            placement[index] = cpu
+        return placement
+
+
+class PackPolicy(_GreedyPolicy):
+    """
+    Puts each share on the fullest cpu it fits on, keeping as many cpus as possible entirely free.
+    """
+
+    name = "pack"
+
+    @staticmethod
+    def _key(cpu, available):
+        return available, cpu
+
+
+class SpreadPolicy(_GreedyPolicy):
+    """
+    Puts each share on the emptiest cpu, spreading the load over all cpus.
+    """
+
+    name = "spread"
+
+    @staticmethod
+    def _key(cpu, available):
+        return -available, cpu
+
+
+class TopologyAwarePolicy(PlacementPolicy):
+    """
+    Places all shares of a reservation in the smallest topology domain (physical core, last level cache,
+    NUMA node, package) that fits them. Among domains of the same level the fullest one which fits is chosen.
+    Inside the chosen domain shares are placed by the inner policy.
+    """
+
+    name = "topology"
+
+    def __init__(self, inner_policy=None):
+        self.inner_policy = inner_policy or PackPolicy()
+
+    def place(self, cores, cpu_shares, topology=None):
+        if topology is not None:
+            for level in topology.levels:
+                best = None
+                for domain_cpus in topology.domains(level).values():
+                    domain_cores = {cpu: cores[cpu] for cpu in domain_cpus if cpu in cores}
+                    free = sum(domain_cores.values())
+                    if free < sum(cpu_shares) or (best is not None and free >= best[0]):
+                        continue
+                    placement = self.inner_policy.place(domain_cores, cpu_shares, topology)
+                    if placement is not None:
+                        best = (free, placement)
+                if best is not None:
+                    return best[1]
+        return self.inner_policy.place(cores, cpu_shares, topology)
+
+
+policies = {policy.name: policy for policy in (PackPolicy, SpreadPolicy, TopologyAwarePolicy)}
+
+
+def get_policy(policy):
+    """
+    :param policy: A PlacementPolicy instance or name of one of the builtin policies: pack, spread or topology.
+    """
+    if isinstance(policy, PlacementPolicy):
+        return policy
+    if policy not in policies:
+        raise AssertionError("Placement policy must be one of the followings: " + ",".join(sorted(policies)))
+    return policies[policy]()
@@ -0,0 +1,271 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .engine import DockerEngineError
+
+
+def _pool_key(config):
+    """
+    The part of a container config which can not be changed after the container is created.
+    Containers whose configs have the same key are interchangeable: their name, cpuset and network
+    are set when they are claimed.
+    """
+    config = copy.deepcopy(config)
+    networking_config = config.pop("NetworkingConfig", None)
+    config["HostConfig"].pop("CpusetCpus", None)
+    if networking_config is not None:
+        config["HostConfig"].pop("NetworkMode", None)
+    config["Labels"].pop("com.docker.compose.project", None)
+    return json.dumps(config, sort_keys=True)
+
+
+class _PoolEntry(object):
+
+    def __init__(self, client, key):
+        self.client = client
+        self.key = key
+        self.containers = []  # ids of warm containers
+        self.creating = 0  # number of containers being created
+        self.last_used = time.time()
+        self.size = None  # None means the pool's size
+
+
+class ContainerPool(object):
+    """
+    Keeps created (never started) containers ready for every (docker host, image, limits) key in use,
+    so EngineRunner only has to rename, update the cpuset of, connect and start a container to run a service.
+
+    A key is learned on its first miss (or by warm) and refilled in the background up to size containers.
+    Containers are not reused after they have run, since their file system is changed by the previous match,
+    EngineRunner removes them as usual and the pool creates fresh ones.
+    Keys which have not been claimed for idle_timeout seconds, and the least recently used keys when the pool
+    holds more than max_containers, are evicted: their warm containers are removed.
+    """
+
+    label = "docker-sandboxer.pool"
+    # Warm containers are named with this prefix until they are claimed and renamed. Labels can not be removed,
+    # so claimed containers keep the pool label.
+    name_prefix = "docker-sandboxer-pool-"
+
+    def __init__(self, size=2, max_containers=64, idle_timeout=600, refill_interval=1, create_workers=4):
+        """
+        :param size: Number of warm containers kept for each key.
+        :param max_containers: Maximum number of warm containers of all keys.
+        :param idle_timeout: Seconds after which a key that has not been claimed is evicted.
+        :param refill_interval: Maximum seconds between two refills of the background thread.
+        :param create_workers: Number of containers created concurrently.
+        """
+        self.size = size
+        self.max_containers = max_containers
+        self.idle_timeout = idle_timeout
+        self.refill_interval = refill_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = {}  # (docker host, key) -> _PoolEntry
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(create_workers)
+        self._refill_event = threading.Event()
+        self._refill_thread = None
+        self._stopped = False
+
+    def _get_entry(self, client, config):
+        """
+        Must be called with self._lock held.
+        """
+        key = _pool_key(config)
+        entry = self._entries.get((client.base_url, key))
+        if entry is None:
+            entry = _PoolEntry(client, key)
+            self._entries[(client.base_url, key)] = entry
+        return entry
+
+    def warm(self, client, config, count=None):
+        """
+        Registers the key of config and creates its warm containers right away.
+        :param config: A container config, as returned by engine.container_config.
+        :param count: Number of warm containers to keep for this key. Defaults to the pool's size.
+        """
+        with self._lock:
+            entry = self._get_entry(client, config)
+            entry.last_used = time.time()
+            if count is not None:
+                entry.size = count
+        for future in self._fill(entry):
+            future.result()
+
+    def claim(self, client, name, config):
+        """
+        Takes a warm container matching config and prepares it to run as name.
+        :return: Container id, or None if there is no warm container for this config.
+        """
+        with self._lock:
+            entry = self._get_entry(client, config)
+            entry.last_used = time.time()
+            container_id = entry.containers.pop() if entry.containers else None
+            if container_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._refill_event.set()
+        if container_id is None:
+            return None
+
+        try:
+            try:
+                client.rename_container(container_id, name)
+            except DockerEngineError as e:
+                if e.status != 409:
+                    raise
+                # A container of a previous run with the same name is left, remove it.
+                client.remove_container(name)
+                client.rename_container(container_id, name)
+            if "CpusetCpus" in config["HostConfig"]:
+                client.update_container(container_id, CpusetCpus=config["HostConfig"]["CpusetCpus"])
+            if "NetworkingConfig" in config:
+                client.disconnect_network("bridge", container_id)
+                for network_name, endpoint_config in config["NetworkingConfig"]["EndpointsConfig"].items():
+                    client.connect_network(network_name, container_id, endpoint_config)
+        except DockerEngineError:
+            try:
+                client.remove_container(container_id)
+            except DockerEngineError:
+                pass
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+        return container_id
+
+    def _create(self, entry):
+        config = json.loads(entry.key)
+        config["Labels"][ContainerPool.label] = hashlib.sha1(entry.key.encode("utf8")).hexdigest()
+        if "NetworkMode" not in config["HostConfig"]:
+            config["HostConfig"]["NetworkMode"] = "bridge"
+        return entry.client.create_container(ContainerPool.name_prefix + uuid.uuid4().hex, config)
+
+    def _fill(self, entry):
+        """
+        Starts creating the containers entry lacks in the executor.
+        :return: list of futures
+        """
+        with self._lock:
+            size = self.size if entry.size is None else entry.size
+            total = sum([len(e.containers) + e.creating for e in self._entries.values()])
+            evicted = self._entries.get((entry.client.base_url, entry.key)) is not entry
+            if self._stopped or evicted:
+                return []
+            missing = min(size - len(entry.containers) - entry.creating, self.max_containers - total)
+            if missing <= 0:
+                return []
+            entry.creating += missing
+        return [self._executor.submit(self._create_one, entry) for i in range(missing)]
+
+    def _create_one(self, entry):
+        container_id = None
+        try:
+            container_id = self._create(entry)
+        finally:
+            with self._lock:
+                entry.creating -= 1
+                evicted = self._stopped or self._entries.get((entry.client.base_url, entry.key)) is not entry
+                if container_id is not None and not evicted:
+                    entry.containers.append(container_id)
+        if container_id is not None and evicted:
+            self._remove(entry, [container_id])
+
+    def _remove(self, entry, container_ids):
+        for container_id in container_ids:
+            try:
+                entry.client.remove_container(container_id)
+            except (DockerEngineError, OSError):
+                pass
+
+    def refill(self):
+        """
+        Evicts idle keys and the least recently used keys beyond max_containers, then fills the remaining keys.
+        """
+        now = time.time()
+        evicted = []
+        with self._lock:
+            budget = self.max_containers
+            for pool_key, entry in sorted(self._entries.items(), key=lambda item: -item[1].last_used):
+                size = self.size if entry.size is None else entry.size
+                if now - entry.last_used > self.idle_timeout:
+                    size = 0
+                    self._entries.pop(pool_key)
+                size = min(size, budget)
+                budget -= size
+                if len(entry.containers) > size:
+                    evicted.append((entry, entry.containers[size:]))
+                    self.evictions += len(entry.containers) - size
+                    entry.containers = entry.containers[:size]
+            entries = sorted(self._entries.values(), key=lambda e: -e.last_used)
+        for entry, container_ids in evicted:
+            self._remove(entry, container_ids)
+        for entry in entries:
+            self._fill(entry)
+
+    def _refill_loop(self):
+        while not self._stopped:
+            self._refill_event.wait(self.refill_interval)
+            self._refill_event.clear()
+            if not self._stopped:
+                self.refill()
+
+    def start(self):
+        """
+        Starts refilling the pool in a background thread.
+        """
+        if self._refill_thread is None:
+            self._refill_thread = threading.Thread(target=self._refill_loop, daemon=True)
+            self._refill_thread.start()
+
+    def close(self):
+        """
+        Stops the background thread and removes every warm container.
+        """
+        self._stopped = True
+        self._refill_event.set()
+        if self._refill_thread is not None:
+            self._refill_thread.join()
+            self._refill_thread = None
+        self._executor.shutdown()
+        with self._lock:
+            entries, self._entries = list(self._entries.values()), {}
+        for entry in entries:
+            self._remove(entry, entry.containers)
+            entry.containers = []
+
+    @staticmethod
+    def remove_leftovers(client):
+        """
+        Removes warm containers left on a docker host by pools of processes which did not close them.
+        Claimed containers (renamed, and maybe running a match) are left alone.
+        """
+        for container in client.list_containers(label=[ContainerPool.label], status=["created"],
+                                                 name=["^/%s" % ContainerPool.name_prefix]):
+            try:
+                client.remove_container(container["Id"])
+            except DockerEngineError:
+                pass
+
+    def stats(self):
+        """
+        :return: dictionary of size (warm containers), keys, hits, misses, hit_rate and evictions.
+        """
+        with self._lock:
+            claims = self.hits + self.misses
+            return {
+                "size": sum([len(entry.containers) for entry in self._entries.values()]),
+                "keys": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / claims if claims else 0.0,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,131 @@
+"""
+Reclaims reservations of an AtomicCPUScheduler left by workers which died without releasing them, and checks
+(optionally repairs) the consistency of the scheduler's redis state. Run one next to the workers:
+
+    python -m docker_sandboxer.reaper --host localhost --port 6379 --db 10 --interval 30
+"""
+import argparse
+import time
+
+from .atomic_scheduler import AtomicCPUScheduler
+from .engine import DockerEngineClient, DockerEngineError, project_containers
+
+
+class Reaper(object):
+    """
+    A reservation is reaped when its lease has expired, or, for reservations granted without a lease,
+    when it is older than grace seconds and its match has no running container.
+    Reservations are named after the project of their match (the uid given to Parser), so containers of the
+    project are looked up on the reservation's node to tell a dead worker from a slow one.
+    """
+
+    def __init__(self, scheduler, grace=600, check_containers=True, remove_orphans=True):
+        """
+        :param scheduler: An AtomicCPUScheduler.
+        :param grace: Seconds after which a reservation without a lease may be reaped.
+        :param check_containers: Whether to look for containers of the reservation's project before reaping it.
+        :param remove_orphans: Whether to remove containers left by a reservation whose lease has expired.
+        """
+        if not hasattr(scheduler, "reap"):
+            raise AssertionError("Reaper needs an AtomicCPUScheduler")
+        self.scheduler = scheduler
+        self.grace = grace
+        self.check_containers = check_containers
+        self.remove_orphans = remove_orphans
+        self._clients = {}
+
+    def _get_client(self, docker_host):
+        if docker_host not in self._clients:
+            self._clients[docker_host] = DockerEngineClient(docker_host or None)
+        return self._clients[docker_host]
+
+    def _containers(self, user, node):
+        docker_host = self.scheduler.redis_connection.hget(AtomicCPUScheduler.nodes_map, node)
+        client = self._get_client(docker_host.decode('utf8') if docker_host else None)
+        return client, project_containers(client, user)
+
+    def reap_once(self, now=None):
+        """
+        :return: list of (user, reason) of the reservations released
+        """
+        now = time.time() if now is None else now
+        reaped = []
+        for user, lease in sorted(self.scheduler.get_leases().items()):
+            if lease['expires'] is not None:
+                if lease['expires'] >= now:
+                    continue
+                reason = "lease expired %.0f seconds ago" % (now - lease['expires'])
+            elif lease['since'] is None or lease['since'] + self.grace < now:
+                reason = "no lease, granted more than %d seconds ago" % self.grace
+            else:
+                continue
+
+            if self.check_containers:
+                try:
+                    client, containers = self._containers(user, lease['node'])
+                except (IOError, OSError, DockerEngineError):
+                    # The node can not be checked, try again on the next round.
+                    continue
+                if lease['expires'] is None and [c for c in containers if c.get("State") == "running"]:
+                    continue
+
+            # The worker may have renewed its lease since get_leases, reap checks it again atomically.
+            if not self.scheduler.reap(user, self.grace, now):
+                continue
+            if self.check_containers and lease['expires'] is not None and self.remove_orphans:
+                for container in containers:
+                    try:
+                        client.remove_container(container["Id"])
+                    except (IOError, OSError, DockerEngineError):
+                        pass
+                if containers:
+                    reason += ", removed %d containers" % len(containers)
+            reaped.append((user, reason))
+        return reaped
+
+    def run(self, interval=30, repair=False):
+        """
+        Reaps every interval seconds, forever.
+        :param repair: Also check the consistency of the scheduler's state and repair it.
+        """
+        while True:
+            for user, reason in self.reap_once():
+                print("Released the reservation of {}: {}".format(user, reason))
+            if repair:
+                for problem in self.scheduler.check_consistency(repair=True):
+                    print("Repaired: {}".format(problem))
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--db", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=30, help="Seconds between two rounds")
+    parser.add_argument("--grace", type=float, default=600, help="Age after which reservations without a lease "
+                                                                 "and without running containers are released")
+    parser.add_argument("--no-containers", action="store_true", help="Do not look for containers before reaping")
+    parser.add_argument("--repair", action="store_true", help="Also repair inconsistencies of the state")
+    parser.add_argument("--check", action="store_true", help="Only report inconsistencies of the state and exit")
+    parser.add_argument("--once", action="store_true", help="Run a single round and exit")
+    args = parser.parse_args()
+
+    cpu_scheduler = AtomicCPUScheduler(args.host, args.port, args.db)
+    if args.check:
+        for problem in cpu_scheduler.check_consistency(repair=args.repair):
+            print(problem)
+        return
+    reaper = Reaper(cpu_scheduler, args.grace, check_containers=not args.no_containers)
+    if args.once:
+        for user, reason in reaper.reap_once():
+            print("Released the reservation of {}: {}".format(user, reason))
+        if args.repair:
+            for problem in cpu_scheduler.check_consistency(repair=True):
+                print("Repaired: {}".format(problem))
+        return
+    reaper.run(args.interval, args.repair)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,40 @@
-from .scheduler import CPUScheduler
+from . import metrics
 from .utils import run_compose_with_file
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
+import time
+from types import MappingProxyType
 import yaml
 from jinja2 import Environment, FileSystemLoader
 
+# libyaml based loader and dumper are much faster, if PyYAML is built with them.
+_yaml_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_yaml_dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 
 class Sandbox(object):
+    """
+    Limits applied on a container. Validated limits are kept in the limits dictionary, which must only be
+    changed through update_limits since the docker limits derived from it are cached.
+    """
 
-    @property
-    def _limit_validator(self):
-        return {
-            "cpu": Sandbox._validate_cpu,
-            "memory": Sandbox._validate_int,
-            "swap": Sandbox._validate_int,
-        }
+    __slots__ = ("limits", "_docker_limits")
 
     @staticmethod
     def _validate_cpu(cpu_limits):
         if isinstance(cpu_limits, int):
             cpu_limits = [cpu_limits, ]
+        if isinstance(cpu_limits, tuple):
+            cpu_limits = list(cpu_limits)
         if not isinstance(cpu_limits, list):
             raise AssertionError("CPU limit should be either an int or a list of ints")
         for limit in cpu_limits:
-            if limit not in CPUScheduler.cpu_list_names_map:
-                raise AssertionError("Invalid CPU limit. CPU limit must be one of the followings: " +
-                                     ",".join([key for key in CPUScheduler.cpu_list_names_map.keys()]))
+            # Which shares are valid depends on the scheduler's granularity, the scheduler checks them.
+            if not isinstance(limit, int) or not 0 <= limit <= 1024:
+                raise AssertionError("Invalid CPU limit. CPU limit must be a share between 0 and 1024")
         return cpu_limits
 
     @staticmethod
@@ -33,29 +44,36 @@ class Sandbox(object):
         return limit
 
     def __init__(self, **limits):
-        self.limits = {}
-        self.update_limits(
-            privileged=False,
-            restart="no",
-            memory=1024 * 1024 * 1024,
-            swap=0,
-            cpu=[1024, ],
-            open_files_hard_limit=20000,
-            open_files_soft_limit=20000,
-            processes_limit=20000,
-        ) # Default limits
-        self.update_limits(**limits)
+        self.limits = dict(_default_limits)
+        self.limits["cpu"] = list(self.limits["cpu"])
+        self._docker_limits = None
+        self._update_limits(limits)
+
+    @classmethod
+    def _from_validated(cls, limits):
+        """
+        Creates a sandbox from limits which are already validated, without copying them.
+        """
+        sandbox = cls.__new__(cls)
+        sandbox.limits = limits
+        sandbox._docker_limits = None
+        return sandbox
 
     def update_limits(self, **limits):
+        self._update_limits(limits)
+
+    def _update_limits(self, limits):
         for limit_name, limit_value in limits.items():
             self._update_limit(limit_name, limit_value)
+        self._docker_limits = None
 
     def _update_limit(self, limit_name, limit_desc):
         if not isinstance(limit_name, str):
             raise AssertionError("Limit name must be a string")
         if limit_desc is None:
             self.limits.pop(limit_name, None)
-        validator = self._limit_validator.get(limit_name, None)
+            return
+        validator = _limit_validators.get(limit_name, None)
         if validator is not None:
             self.limits[limit_name] = validator(limit_desc)
         else:
@@ -67,7 +85,7 @@ class Sandbox(object):
     def get_all_limits(self):
         return self.limits
 
-    def get_docker_limits(self):
+    def _translate_limits(self):
         limits = self.limits.copy()
 
         limits.pop("cpu", None)
@@ -78,14 +96,12 @@ class Sandbox(object):
             limits["mem_limit"] = memory
             limits["memswap_limit"] = memory + swap
 
-
+        if "processes_limit" in limits or "open_files_soft_limit" in limits or "open_files_hard_limit" in limits:
+            # A ulimits limit given by the user is copied, not changed.
+            limits["ulimits"] = dict(limits.get("ulimits") or {})
         if "processes_limit" in limits:
-            if "ulimits" not in limits:
-                limits["ulimits"] = {}
             limits["ulimits"]["nproc"] = limits.pop("processes_limit")
         if "open_files_soft_limit" in limits or "open_files_hard_limit" in limits:
-            if "ulimits" not in limits:
-                limits["ulimits"] = {}
             limits["ulimits"]["nofile"] = {}
             if "open_files_soft_limit" in limits:
                 limits["ulimits"]["nofile"]["soft"] = limits.pop("open_files_soft_limit")
@@ -93,18 +109,380 @@ class Sandbox(object):
                 limits["ulimits"]["nofile"]["hard"] = limits.pop("open_files_hard_limit")
         return limits
 
+    def get_docker_limits(self):
+        """
+        :return: The limits as docker-compose keys. Computed once per change of the limits, each call returns
+        a copy (including the ulimits dictionary) which the caller may change.
+        """
+        if self._docker_limits is None:
+            self._docker_limits = self._translate_limits()
+        limits = self._docker_limits.copy()
+        if "ulimits" in limits:
+            limits["ulimits"] = {name: dict(value) if isinstance(value, dict) else value
+                                 for name, value in limits["ulimits"].items()}
+        return limits
+
+    def with_limits(self, **limits):
+        """
+        :return: A sandbox of the same class with limits changed. Only the changed limits are validated.
+        """
+        sandbox = type(self)._from_validated(_copy_data(self.limits))
+        Sandbox._update_limits(sandbox, limits)
+        return sandbox
 
     def copy(self):
-        return Sandbox(**self.limits)
+        return Sandbox._from_validated(_copy_data(self.limits))
+
+    def freeze(self):
+        """
+        :return: A FrozenSandbox with the same limits.
+        """
+        return FrozenSandbox._from_validated(self.limits)
+
+
+class FrozenSandbox(Sandbox):
+    """
+    A Sandbox whose limits can not be changed. Derive sandboxes with other limits with with_limits.
+    Its limits are a read-only mapping (lists such as the cpu shares become tuples, dictionaries become read-only
+    mappings too) and its docker limits are computed when it is created.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **limits):
+        self._freeze(Sandbox(**limits).limits)
+
+    def _freeze(self, limits):
+        """
+        :param limits: Validated limits, as a dictionary. They are copied.
+        """
+        object.__setattr__(self, "limits", _freeze_data(limits))
+        object.__setattr__(self, "_docker_limits", _thaw_data(Sandbox._from_validated(limits)._translate_limits()))
+
+    @classmethod
+    def _from_validated(cls, limits):
+        sandbox = cls.__new__(cls)
+        sandbox._freeze(limits)
+        return sandbox
+
+    def __setattr__(self, name, value):
+        raise AssertionError("A FrozenSandbox can not be changed, use with_limits")
+
+    def __delattr__(self, name):
+        raise AssertionError("A FrozenSandbox can not be changed, use with_limits")
+
+    def __reduce__(self):
+        return FrozenSandbox._from_validated, (_thaw_data(self.limits),)
+
+    def update_limits(self, **limits):
+        raise AssertionError("Limits of a FrozenSandbox can not be changed, use with_limits")
+
+    def with_limits(self, **limits):
+        sandbox = Sandbox._from_validated(_thaw_data(self.limits))
+        sandbox._update_limits(limits)
+        return FrozenSandbox._from_validated(sandbox.limits)
+
+    def get_all_limits(self):
+        return _thaw_data(self.limits)
+
+    def copy(self):
+        return self
+
+    def freeze(self):
+        return self
+
+
+_limit_validators = {
+    "cpu": Sandbox._validate_cpu,
+    "memory": Sandbox._validate_int,
+    "swap": Sandbox._validate_int,
+}
+
+_default_limits = {
+    "privileged": False,
+    "restart": "no",
+    "memory": 1024 * 1024 * 1024,
+    "swap": 0,
+    "cpu": [1024, ],
+    "open_files_hard_limit": 20000,
+    "open_files_soft_limit": 20000,
+    "processes_limit": 20000,
+}
+
+
+def _copy_data(data):
+    if isinstance(data, dict):
+        return {key: _copy_data(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_copy_data(value) for value in data]
+    return data
+
+
+# Types of limit values which are copied as they are.
+_scalars = frozenset([int, float, str, bool, type(None)])
+
+
+def _thaw_data(data):
+    """
+    Copies limits of a FrozenSandbox back to dictionaries and lists.
+    """
+    if isinstance(data, (dict, MappingProxyType)):
+        return {key: value if type(value) in _scalars else _thaw_data(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [value if type(value) in _scalars else _thaw_data(value) for value in data]
+    return data
+
+
+def _freeze_data(data):
+    if isinstance(data, (dict, MappingProxyType)):
+        return MappingProxyType({key: value if type(value) in _scalars else _freeze_data(value)
+                                 for key, value in data.items()})
+    if isinstance(data, (list, tuple)):
+        return tuple([value if type(value) in _scalars else _freeze_data(value) for value in data])
+    return data
+
+
+class _CompiledTemplate(object):
+    """
+    A rendered and parsed template whose manager keys are removed and whose sandbox placeholders are indexed.
+    """
+
+    def __init__(self, compose_data, sandbox_ids):
+        self.compose_data = compose_data
+        self.managers = []
+        for container_name, data in compose_data.items():
+            if "manager" in data:
+                self.managers.append(container_name)
+                data.pop("manager")
+
+        # (path of a dictionary in compose_data, id of a sandbox whose placeholder is a key of that dictionary)
+        self.slots = []
+        self._index_slots(compose_data, (), sandbox_ids)
+
+    def _index_slots(self, data, path, sandbox_ids):
+        if isinstance(data, list):
+            for idx in range(len(data)):
+                if isinstance(data[idx], dict) or isinstance(data[idx], list):
+                    self._index_slots(data[idx], path + (idx,), sandbox_ids)
+        elif isinstance(data, dict):
+            for key, value in data.items():
+                if isinstance(value, dict) or isinstance(value, list):
+                    self._index_slots(value, path + (key,), sandbox_ids)
+            for sandbox_id in sandbox_ids:
+                if sandbox_id in data:
+                    self.slots.append((path, sandbox_id))
+
+    def instantiate(self, copy=True):
+        """
+        :param copy: Whether to copy compose_data, so this template can be instantiated again.
+        :return: (compose data, list of (dictionary, sandbox id) which are the slots inside the returned data)
+        """
+        compose_data = _copy_data(self.compose_data) if copy else self.compose_data
+        slots = []
+        for path, sandbox_id in self.slots:
+            data = compose_data
+            for key in path:
+                data = data[key]
+            slots.append((data, sandbox_id))
+        return compose_data, slots
+
+
+class BatchResult(object):
+    """
+    Outcome of a job of Parser.run_batch.
+    telemetry is what create_yml_and_run returned, error the exception it raised (None if it succeeded).
+    submitted, reserved and finished are times (time.time()) the job was read from the jobs, got its
+    reservation (None if it failed before) and finished.
+    """
+
+    def __init__(self, uid, telemetry=None, error=None, submitted=None, reserved=None, finished=None):
+        self.uid = uid
+        self.telemetry = telemetry
+        self.error = error
+        self.submitted = submitted
+        self.reserved = reserved
+        self.finished = finished
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def waited(self):
+        """
+        Seconds between submission and reservation.
+        """
+        return (self.reserved or self.finished) - self.submitted
+
+    @property
+    def duration(self):
+        """
+        Seconds the job ran once its resources were reserved.
+        """
+        return self.finished - self.reserved if self.reserved is not None else 0.0
+
+
+class _BatchJob(object):
+
+    def __init__(self, uid, parsed, timeout):
+        self.uid = uid
+        self.parsed = parsed  # what Parser._parse returned
+        self.timeout = timeout
+        self.cpu_limits = parsed[4]
+        self.memory = parsed[6]
+        self.submitted = time.time()
+        self.reserved = None
+
+
+class _Batch(object):
+    """
+    State of a Parser.run_batch call. A dispatcher thread admits jobs and hands them to a thread pool,
+    results are put in a queue read by the run_batch generator.
+    """
+
+    def __init__(self, parser, jobs, max_workers, lookahead, backfill_window, poll_interval, telemetry_callback,
+                 logs):
+        self.parser = parser
+        self.jobs = iter(jobs)
+        self.max_workers = max_workers
+        self.lookahead = lookahead
+        self.backfill_window = backfill_window
+        self.poll_interval = poll_interval
+        self.telemetry_callback = telemetry_callback
+        self.logs = logs
+        self.results = queue.Queue()
+        self.stopped = False
+        self._running = 0
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers)
+
+    def _read_jobs(self, pending):
+        """
+        Reads jobs until lookahead + 1 of them are pending.
+        :return: False once jobs are exhausted
+        """
+        while len(pending) <= self.lookahead:
+            try:
+                job = tuple(next(self.jobs))
+            except StopIteration:
+                return False
+            uid, yml_template_name, context, timeout = (job + (None,))[:4]
+            try:
+                parsed = self.parser._parse(yml_template_name, context)
+            except Exception as e:
+                now = time.time()
+                self.results.put(BatchResult(uid, error=e, submitted=now, finished=now))
+                continue
+            cpu_limits, memory = parsed[4], parsed[6]
+            if not self.parser.cpu_scheduler.fits_capacity(cpu_limits, memory):
+                # It would wait forever, and block every job behind it once backfill_window has passed.
+                now = time.time()
+                error = AssertionError("cpu shares %s and %d bytes of memory of %s do not fit any node" %
+                                       (cpu_limits, memory, uid))
+                self.results.put(BatchResult(uid, error=error, submitted=now, finished=now))
+                continue
+            pending.append(_BatchJob(uid, parsed, timeout))
+        return True
+
+    def _admissible(self, pending):
+        """
+        :return: The oldest pending job which fits the scheduler's free capacity right now, or None.
+        Jobs behind the oldest one are only considered while it has waited less than backfill_window seconds.
+        """
+        candidates = pending
+        if time.time() - pending[0].submitted >= self.backfill_window:
+            candidates = pending[:1]
+        for job in candidates:
+            if self.parser.cpu_scheduler.fits(job.cpu_limits, job.memory):
+                return job
+        return None
+
+    def dispatch(self):
+        pending = []
+        more = True
+        try:
+            while not self.stopped:
+                if more:
+                    more = self._read_jobs(pending)
+                if not pending:
+                    if not more:
+                        break
+                    continue
+                with self._condition:
+                    while self._running >= self.max_workers and not self.stopped:
+                        self._condition.wait()
+                job = self._admissible(pending)
+                if job is None:
+                    with self._condition:
+                        self._condition.wait(self.poll_interval)
+                    continue
+                pending.remove(job)
+                reserved = threading.Event()
+                with self._condition:
+                    self._running += 1
+                self._executor.submit(self._run, job, reserved)
+                # The next job is admitted once this one holds its reservation, so the free capacity is up to date.
+                while not reserved.wait(self.poll_interval) and not self.stopped:
+                    pass
+            self._executor.shutdown()
+        except BaseException as e:
+            self.results.put(e)
+            self._executor.shutdown(wait=False)
+        self.results.put(None)
+
+    def _run(self, job, reserved):
+        def before_run():
+            job.reserved = time.time()
+            reserved.set()
+
+        result = BatchResult(job.uid, submitted=job.submitted)
+        try:
+            result.telemetry = self.parser._run_parsed(
+                job.uid, job.parsed, job.timeout, callback_before_run=before_run,
+                telemetry_callback=self.telemetry_callback,
+                logs=self.logs(job.uid) if self.logs is not None else None)
+        except Exception as e:
+            result.error = e
+        finally:
+            reserved.set()
+            result.reserved = job.reserved
+            result.finished = time.time()
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
+        self.results.put(result)
+
+    def stop(self):
+        with self._condition:
+            self.stopped = True
+            self._condition.notify_all()
 
 
 class Parser(object):
 
-    def __init__(self, cpu_scheduler, yml_template_base, yaml_storage_folder):
+    def __init__(self, cpu_scheduler, yml_template_base, yaml_storage_folder, runner=None, template_cache_size=128,
+                 sampler=None):
+        """
+        :param yaml_storage_folder: Folder where parsed templates are stored. May be None if a runner is given.
+        :param runner: An object with the same run method as engine.EngineRunner, used instead of docker-compose.
+        :param template_cache_size: Maximum number of differently rendered versions of each template which are kept
+        parsed. Only byte-identical renderings hit the cache, so a template using per-match context values never
+        does. Entries of a template are dropped when its file is modified. 0 disables the cache.
+        :param sampler: A telemetry.CgroupSampler to record resource usage of containers while they run, or None.
+        """
         self.cpu_scheduler = cpu_scheduler
+        self.sampler = sampler
         self.jinja_environment = Environment(loader=FileSystemLoader(yml_template_base, followlinks=True))
-
-        import os
+        self.runner = runner
+        self.template_cache_size = template_cache_size
+        self._template_cache = {}  # template name -> (mtime, OrderedDict mapping cache keys to _CompiledTemplate)
+        self._template_cache_lock = threading.Lock()
+
+        if yaml_storage_folder is None:
+            if runner is None:
+                raise AssertionError("yaml_storage_folder is needed to run docker-compose")
+            self.yaml_storage_folder = None
+            return
         self.yaml_storage_folder = os.path.abspath(yaml_storage_folder)
         try:
             os.makedirs(self.yaml_storage_folder)
@@ -129,38 +507,51 @@ class Parser(object):
                     sandboxes.update(Parser._find_sandboxes_and_put_placeholders(value, prefix + "%s." % str(key)))
         return sandboxes
 
-    @staticmethod
-    def _find_and_replace_sandbox_ids(context, sandbox_data):
-        if isinstance(context, list):
-            for value in context:
-                if isinstance(value, dict) or isinstance(value, list):
-                    Parser._find_and_replace_sandbox_ids(value, sandbox_data)
-        elif isinstance(context, dict):
-            for key, value in context.items():
-                if isinstance(value, dict) or isinstance(value, list):
-                    Parser._find_and_replace_sandbox_ids(value, sandbox_data)
-
-            for sandbox_id, sandbox_dict in sandbox_data.items():
-                if sandbox_id in context:
-                    context.pop(sandbox_id)
-                    context.update(sandbox_dict)
-
-    def create_yml_and_run(self, uid, yml_template_name, context, timeout=None, callback_before_run=None):
+    def _compile(self, yml_template_name, context, sandboxes):
         """
-        :param uid: a unique id
-        :param yml_template_name: YAML template name
-        :param context: context used to parse the template.
-        :param timeout: Time to wait for the containers to stop. The containers will be killed
-
-        Compiles yml_template and runs docker-compose with it.
-        You can add another key in some of your services called manager,
-        This key is removed from the file which docker-compose will run with.
-        However services that set this key's value as true will be knows as managers.
-        All containers will be killed when all managers are stopped.
-        If no manager is specified every container becomes a manager
+        Renders the template and parses it, unless the very same text (with the same sandbox names) is cached.
+        :return: (compose_data, slots, managers), see _CompiledTemplate.instantiate
+        """
+        start = metrics.start()
+        template = self.jinja_environment.get_template(yml_template_name)
+        template_string = template.render(context)
+        metrics.TEMPLATE_SECONDS.observe_since(start, phase="render")
+        if not self.template_cache_size:
+            start = metrics.start()
+            compiled = _CompiledTemplate(yaml.load(template_string, Loader=_yaml_loader), list(sandboxes))
+            metrics.TEMPLATE_SECONDS.observe_since(start, phase="parse")
+            return compiled.instantiate(copy=False) + (compiled.managers,)
+
+        mtime = os.path.getmtime(template.filename) if template.filename else None
+        key = (template_string, tuple(sandboxes))
+        with self._template_cache_lock:
+            cached_mtime, entries = self._template_cache.get(yml_template_name, (None, None))
+            if entries is None or cached_mtime != mtime:
+                entries = OrderedDict()
+                self._template_cache[yml_template_name] = (mtime, entries)
+            compiled = entries.get(key)
+            if compiled is not None:
+                entries.move_to_end(key)
+        metrics.TEMPLATE_CACHE.inc(result="miss" if compiled is None else "hit")
+        if compiled is None:
+            start = metrics.start()
+            compiled = _CompiledTemplate(yaml.load(template_string, Loader=_yaml_loader), list(sandboxes))
+            metrics.TEMPLATE_SECONDS.observe_since(start, phase="parse")
+            with self._template_cache_lock:
+                entries[key] = compiled
+                while len(entries) > self.template_cache_size:
+                    entries.popitem(last=False)
+        return compiled.instantiate() + (list(compiled.managers),)
+
+    def _parse(self, yml_template_name, context):
+        """
+        Renders the template and collects the resources requested by its sandboxes.
+        :return: (compose_data, slots, managers, sandboxes, cpu_limits, cpu_limits_ids, memory)
         """
 
-        context = context.copy()  # Making a copy from original dictionary since it's going to be modified below.
+        # Making a copy from original dictionary (and the dictionaries and lists inside it)
+        # since it's going to be modified below.
+        context = _copy_data(context)
 
         make_manager_keyword = "make_manager"
 
@@ -170,18 +561,7 @@ class Parser(object):
 
         sandboxes = self._find_sandboxes_and_put_placeholders(context)
 
-        template_string = self.jinja_environment.get_template(yml_template_name).render(context)
-        compose_data = yaml.load(template_string)
-
-        managers = []
-        for container_name, data in compose_data.items():
-            if "manager" in data:
-                managers.append(container_name)
-                data.pop("manager")
-
-        # Each sandbox will be converted to a dictionary.
-        # This variable holds a mapping from sandboxes ids to their corresponding dictionary.
-        sandbox_data = {}
+        compose_data, slots, managers = self._compile(yml_template_name, context, sandboxes)
 
         # CPU shares should be reserved all at the same time.
         # Since order of cpu shares for a specific id doesn't matter,
@@ -191,44 +571,212 @@ class Parser(object):
         cpu_limits_ids = []
         cpu_limits = []
 
+        # Memory and swap of all sandboxes are reserved along with the CPU shares.
+        memory = 0
+
         for sandbox_id, sandbox in sandboxes.items():
             sandbox_cpu_limit = sandbox.get_limit("cpu")
             if sandbox_cpu_limit is not None:
                 for i in range(len(sandbox_cpu_limit)):
                     cpu_limits_ids.append(sandbox_id)
                 cpu_limits += sandbox_cpu_limit
+            memory += (sandbox.get_limit("memory") or 0) + (sandbox.get_limit("swap") or 0)
+        return compose_data, slots, managers, sandboxes, cpu_limits, cpu_limits_ids, memory
+
+    @staticmethod
+    def _substitute(slots, sandboxes, cpu_limits_ids, cpu_shares):
+        """
+        Replaces sandbox placeholders with their limits and the given cpus.
+        """
+        # Each sandbox will be converted to a dictionary.
+        # This variable holds a mapping from sandboxes ids to their corresponding dictionary.
+        sandbox_data = {}
+
+        id_shares = {}  # Each id is mapped to a list containing shares assigned to that id
+        for cpu_limits_id in cpu_limits_ids:
+            id_shares[cpu_limits_id] = []
+
+        for i in range(len(cpu_limits_ids)):
+            id_shares[cpu_limits_ids[i]].append(cpu_shares[i])
+        for sandbox_id, sandbox in sandboxes.items():
+            sandbox_data[sandbox_id] = sandbox.get_docker_limits()
+
+            if sandbox_id in id_shares:
+                sandbox_data[sandbox_id]["cpuset"] = ",".join([str(share_id) for share_id in id_shares[sandbox_id]])
+
+        for data, sandbox_id in slots:
+            data.pop(sandbox_id)
+            data.update(sandbox_data[sandbox_id])
+
+    def _apply_reservation(self, uid, compose_data, slots, sandboxes, cpu_limits_ids, reservation):
+        """
+        Replaces sandbox placeholders of compose_data with their limits and reserved cpus,
+        and stores the result in yaml_storage_folder.
+        :return: Path of the stored file, or None if yaml_storage_folder is None.
+        """
+        self._substitute(slots, sandboxes, cpu_limits_ids, reservation.cpu_numbers)
+
+        if self.yaml_storage_folder is None:
+            return None
+        yml_file_name = os.path.abspath("%s/%s.yml" % (self.yaml_storage_folder, uid))
+        with open(yml_file_name, 'w') as yml_file:
+            yml_file.write(yaml.dump(compose_data, Dumper=_yaml_dumper, default_flow_style=False))
+        return yml_file_name
+
+    def prewarm(self, yml_template_name, context, count=None, docker_host=None):
+        """
+        Creates warm containers for the services of a template in the container pool of the runner,
+        so matches of this template start without creating containers.
+        :param count: Number of warm containers to keep for each service. Defaults to the pool's size.
+        :param docker_host: Docker daemon to create the containers on. None means the local daemon.
+        """
+        if getattr(self.runner, "pool", None) is None:
+            raise AssertionError("Prewarming needs a runner with a container pool")
+        compose_data, slots, managers, sandboxes, cpu_limits, cpu_limits_ids, memory = \
+            self._parse(yml_template_name, context)
+        # Cpus are set when a warm container is claimed.
+        self._substitute(slots, sandboxes, cpu_limits_ids, [0] * len(cpu_limits_ids))
+        self.runner.warm(compose_data, count, docker_host)
+
+    def _start_recording(self, uid, docker_host):
+        if self.sampler is None:
+            return None
+        return self.sampler.start(uid, docker_host)
+
+    @staticmethod
+    def _stop_recording(uid, recording, telemetry_callback):
+        if recording is None:
+            return None
+        telemetry = recording.stop()
+        if telemetry_callback is not None:
+            try:
+                telemetry_callback(uid, telemetry)
+            except:
+                pass
+        return telemetry
+
+    def create_yml_and_run(self, uid, yml_template_name, context, timeout=None, callback_before_run=None,
+                           telemetry_callback=None, logs=None):
+        """
+        :param uid: a unique id
+        :param yml_template_name: YAML template name
+        :param context: context used to parse the template.
+        :param timeout: Time to wait for the containers to stop. The containers will be killed
+        :param telemetry_callback: Called with uid and the telemetry of the run, if the parser has a sampler.
+        :param logs: A logs.LogCapture which receives the output of managers. None means printing it.
+        :return: Telemetry of the run (see telemetry.Recording.stop), or None if the parser has no sampler.
+
+        Compiles yml_template and runs docker-compose with it.
+        You can add another key in some of your services called manager,
+        This key is removed from the file which docker-compose will run with.
+        However services that set this key's value as true will be knows as managers.
+        All containers will be killed when all managers are stopped.
+        If no manager is specified every container becomes a manager
+        """
+        return self._run_parsed(uid, self._parse(yml_template_name, context), timeout, callback_before_run,
+                                telemetry_callback, logs)
+
+    def _run_parsed(self, uid, parsed, timeout=None, callback_before_run=None, telemetry_callback=None, logs=None):
+        """
+        Reserves the resources of a template parsed by _parse and runs it, see create_yml_and_run.
+        """
+        compose_data, slots, managers, sandboxes, cpu_limits, cpu_limits_ids, memory = parsed
         try:
-            cpu_shares = self.cpu_scheduler.acquire_cpu(uid, cpu_limits)
-
-            id_shares = {}  # Each id is mapped to a list containing shares assigned to that id
-            for cpu_limits_id in cpu_limits_ids:
-                id_shares[cpu_limits_id] = []
-
-            for i in range(len(cpu_limits)):
-                id_shares[cpu_limits_ids[i]].append(cpu_shares[i])
-            for sandbox_id, sandbox in sandboxes.items():
-                sandbox_data[sandbox_id] = sandbox.get_docker_limits()
-
-                if sandbox_id in id_shares:
-                    sandbox_data[sandbox_id]["cpuset"] = ",".join([str(share_id) for share_id in id_shares[sandbox_id]])
-
-            self._find_and_replace_sandbox_ids(compose_data, sandbox_data)
-
-            # TODO: Memory should probably use the same approach as the CPU
-            # TODO: i.e. we should wait until total requested memory is available and then divide it among the containers.
-            import os
-            yml_file_name = os.path.abspath("%s/%s.yml" % (self.yaml_storage_folder, uid))
-            with open(yml_file_name, 'w') as yml_file:
-                yml_file.write(yaml.dump(compose_data, default_flow_style=False))
-                yml_file.close()
-                if callback_before_run is not None:
-                    try:
-                        callback_before_run()
-                    except:
-                        pass
-                run_compose_with_file(uid, yml_file_name, managers, timeout)
+            reservation = self.cpu_scheduler.reserve(uid, cpu_limits, memory=memory)
+            yml_file_name = self._apply_reservation(uid, compose_data, slots, sandboxes, cpu_limits_ids, reservation)
+            if callback_before_run is not None:
+                try:
+                    callback_before_run()
+                except:
+                    pass
+            recording = self._start_recording(uid, reservation.docker_host)
+            start, result = metrics.start(), "error"
+            try:
+                run_options = {"logs": logs} if logs is not None else {}
+                if self.runner is not None:
+                    self.runner.run(uid, compose_data, managers, timeout, docker_host=reservation.docker_host,
+                                    **run_options)
+                else:
+                    run_compose_with_file(uid, yml_file_name, managers, timeout, docker_host=reservation.docker_host,
+                                          **run_options)
+                result = "ok"
+            except TimeoutError:
+                result = "timeout"
+                metrics.TIMEOUTS.inc(kind="run")
+                raise
+            finally:
+                metrics.RUN_SECONDS.observe_since(start, result=result)
+                telemetry = self._stop_recording(uid, recording, telemetry_callback)
 
         finally:
             self.cpu_scheduler.release_all_cpus(uid)
+        return telemetry
 
+    async def async_create_yml_and_run(self, uid, yml_template_name, context, timeout=None,
+                                       callback_before_run=None, telemetry_callback=None, logs=None):
+        """
+        Coroutine version of create_yml_and_run.
+        The parser must have been created with an aio.AsyncCPUScheduler and an aio.AsyncEngineRunner.
+        """
+        compose_data, slots, managers, sandboxes, cpu_limits, cpu_limits_ids, memory = \
+            self._parse(yml_template_name, context)
+        try:
+            reservation = await self.cpu_scheduler.reserve(uid, cpu_limits, memory=memory)
+            self._apply_reservation(uid, compose_data, slots, sandboxes, cpu_limits_ids, reservation)
+            if callback_before_run is not None:
+                try:
+                    callback_before_run()
+                except:
+                    pass
+            recording = self._start_recording(uid, reservation.docker_host)
+            start, result = metrics.start(), "error"
+            try:
+                run_options = {"logs": logs} if logs is not None else {}
+                await self.runner.run(uid, compose_data, managers, timeout, docker_host=reservation.docker_host,
+                                      **run_options)
+                result = "ok"
+            except TimeoutError:
+                result = "timeout"
+                metrics.TIMEOUTS.inc(kind="run")
+                raise
+            finally:
+                metrics.RUN_SECONDS.observe_since(start, result=result)
+                telemetry = self._stop_recording(uid, recording, telemetry_callback)
+
+        finally:
+            await self.cpu_scheduler.release_all_cpus(uid)
+        return telemetry
 
+    def run_batch(self, jobs, max_workers=4, lookahead=8, backfill_window=30, poll_interval=0.5,
+                  telemetry_callback=None, logs=None):
+        """
+        Runs many matches concurrently, admitting each one only when the scheduler has room for its resources,
+        so no worker waits for cpus while another match could run.
+        :param jobs: An iterable of (uid, yml_template_name, context) or (uid, yml_template_name, context, timeout).
+        It is read lazily, while jobs run.
+        :param max_workers: Maximum number of matches running at the same time.
+        :param lookahead: Number of jobs behind the oldest pending one which may be admitted before it
+        (smaller jobs backfill the capacity the oldest one can not use yet).
+        :param backfill_window: Seconds after which the oldest pending job stops being overtaken.
+        :param poll_interval: Seconds between two checks of the free capacity while no pending job fits.
+        :param telemetry_callback: Passed to create_yml_and_run.
+        :param logs: A function returning the logs.LogCapture of a uid, or None to print output of managers.
+        :return: A generator of BatchResult, in the order jobs finish. Jobs are only started once it is iterated.
+        Jobs which could not fit any node even if nothing else was running fail right away with an AssertionError.
+        Leaving the generator early stops admitting new jobs, running ones finish in the background.
+        """
+        if not hasattr(self.cpu_scheduler, "fits_capacity"):
+            raise AssertionError("run_batch needs a CPUScheduler or an AtomicCPUScheduler")
+        batch = _Batch(self, jobs, max_workers, lookahead, backfill_window, poll_interval, telemetry_callback, logs)
+        dispatcher = threading.Thread(target=batch.dispatch, daemon=True)
+        dispatcher.start()
+        try:
+            while True:
+                result = batch.results.get()
+                if result is None:
+                    return
+                if isinstance(result, BaseException):
+                    raise result
+                yield result
+        finally:
+            batch.stop()
@@ -3,9 +3,18 @@ import redis
 
 from functools import partial
 
+from . import metrics
+from .placement import PackPolicy
+
+# Operation label of the scheduler metrics of each transaction.
+_metric_operations = {"acquire_cpu": "acquire", "release_cpu": "release", "release_all_cpus": "release"}
+
 
 def __cpu_transaction(function, semaphore_name):
+    operation = _metric_operations.get(function.__name__, function.__name__)
+
     def wrapper(*args, **kwargs):
+        start = metrics.start()
         args[0].wait(semaphore_name)
         try:
             result = function(*args, **kwargs)
@@ -13,6 +22,7 @@ def __cpu_transaction(function, semaphore_name):
             raise e
         finally:
             args[0].notify(semaphore_name)
+            metrics.SCHEDULER_SECONDS.observe_since(start, scheduler="semaphore", operation=operation)
         return result
     return wrapper
 
@@ -20,6 +30,39 @@ cpu_acquire_transaction = partial(__cpu_transaction, semaphore_name="cpu-schedul
 cpu_transaction = partial(__cpu_transaction, semaphore_name="cpu-scheduler-admin-semaphore")
 
 
+class CPUReservation(object):
+    """
+    Handle of the cpu shares reserved for a user by CPUScheduler.reserve.
+    May be used as a context manager, shares are released on exit.
+    """
+
+    def __init__(self, scheduler, user, cpu_shares, cpu_numbers, node=None, docker_host=None, memory=0):
+        """
+        :param node: Name of the node which cpu_numbers belong to.
+        :param docker_host: Docker daemon of that node. None means the local daemon.
+        :param memory: Reserved memory in bytes.
+        """
+        self.scheduler = scheduler
+        self.user = user
+        self.cpu_shares = cpu_shares
+        self.cpu_numbers = cpu_numbers
+        self.node = node
+        self.docker_host = docker_host
+        self.memory = memory
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.scheduler.release_all_cpus(self.user)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
 class CPUScheduler:
 
     cpu_list_names_map = {
@@ -50,7 +93,9 @@ class CPUScheduler:
             self.redis_connection.rpush(semaphore_name, 1)
 
     def wait(self, semaphore_name):
+        start = metrics.start()
         self.redis_connection.blpop(semaphore_name, 0)
+        metrics.SEMAPHORE_WAIT_SECONDS.observe_since(start, semaphore=semaphore_name)
 
     def notify(self, semaphore_name):
         self.redis_connection.rpush(semaphore_name, 1)
@@ -74,13 +119,44 @@ class CPUScheduler:
         for cpu_number in cpu_numbers:
             self.add_cpu(cpu_number, 1024)
 
+    def is_valid_share(self, share):
+        return share in CPUScheduler.cpu_list_names_map
+
+    def fits(self, cpu_shares, memory=0):
+        """
+        Whether cpu_shares could be reserved right now. Memory is not accounted by this scheduler.
+        """
+        cores = {int(cpu_number): json.loads(cpu_info.decode('utf8'))['available'] for cpu_number, cpu_info
+                 in self.redis_connection.hgetall(CPUScheduler.cpu_status_map).items()}
+        return PackPolicy().place(cores, list(cpu_shares)) is not None
+
+    def fits_capacity(self, cpu_shares, memory=0):
+        """
+        Whether cpu_shares could be reserved if nothing was reserved, i.e. whether they may ever fit.
+        """
+        cores = {int(cpu_number): 1024 for cpu_number in self.redis_connection.hkeys(CPUScheduler.cpu_status_map)}
+        return PackPolicy().place(cores, list(cpu_shares)) is not None
+
+    def get_availability(self):
+        """
+        :return: dictionary mapping the node (always "local") to a dictionary of cores count by available share.
+        """
+        availability = {}
+        for cpu_info in self.redis_connection.hvals(CPUScheduler.cpu_status_map):
+            available = json.loads(cpu_info.decode('utf8'))['available']
+            availability[available] = availability.get(available, 0) + 1
+        return {"local": availability}
+
     @cpu_acquire_transaction
     def acquire_cpu(self, user, cpu_shares):
         for share in cpu_shares:
             if share not in CPUScheduler.cpu_list_names_map:
                 return None
-        cpu_numbers = []
-        for share in cpu_shares:
+        # Largest shares first, each one from the list with the smallest available share it fits in,
+        # so smaller shares fill the gaps left on partly used cpus instead of splitting whole ones.
+        cpu_numbers = [None] * len(cpu_shares)
+        for index in sorted(range(len(cpu_shares)), key=lambda i: -cpu_shares[i]):
+            share = cpu_shares[index]
             useful_share_names = [CPUScheduler.cpu_list_names_map[list_share] for list_share
                                   in sorted(CPUScheduler.cpu_list_names_map.keys())
                                   if list_share >= share]
@@ -99,9 +175,22 @@ class CPUScheduler:
                 user_current_cpus = json.loads(user_current_cpus.decode('utf8'))
                 user_current_cpus.append(cpu_number)
             self.redis_connection.hset(CPUScheduler.cpu_scheduler_users_map, user, json.dumps(user_current_cpus))
-            cpu_numbers.append(cpu_number)
+            cpu_numbers[index] = cpu_number
         return cpu_numbers
 
+    def reserve(self, user, cpu_shares, timeout=None, priority=0, memory=0):
+        """
+        Same as acquire_cpu but returns a CPUReservation.
+        Timeouts and priorities are not supported by this scheduler and memory is not accounted,
+        see AtomicCPUScheduler.
+        """
+        if timeout is not None or priority:
+            raise AssertionError("CPUScheduler supports neither timeouts nor priorities")
+        cpu_numbers = self.acquire_cpu(user, cpu_shares)
+        if cpu_numbers is None:
+            raise AssertionError("Invalid CPU shares: %s" % cpu_shares)
+        return CPUReservation(self, user, list(cpu_shares), cpu_numbers)
+
     @cpu_transaction
     def release_cpu(self, user, cpu_number):
         cpu_info = json.loads(self.redis_connection.hget(CPUScheduler.cpu_status_map, cpu_number).decode('utf8'))
@@ -159,16 +248,14 @@ class CPUScheduler:
                             self.redis_connection.lrange(cpu_list, 0, -1)]) + "\n")
 
         print("Cores Status:")
-        core_names = sorted(self.redis_connection.hgetall(CPUScheduler.cpu_status_map))
-        for core_name in core_names:
-            print(str(int(core_name)) + " : " +
-                  self.redis_connection.hget(CPUScheduler.cpu_status_map, core_name).decode('utf8'))
+        cores = self.redis_connection.hgetall(CPUScheduler.cpu_status_map)
+        for core_name in sorted(cores, key=int):
+            print(str(int(core_name)) + " : " + cores[core_name].decode('utf8'))
         print()
 
         print("Users:")
-        users = sorted(self.redis_connection.hgetall(CPUScheduler.cpu_scheduler_users_map))
-        for user in users:
-            print(str(user.decode('utf8')) + " : " +
-                  self.redis_connection.hget(CPUScheduler.cpu_scheduler_users_map, user).decode('utf8'))
+        users = self.redis_connection.hgetall(CPUScheduler.cpu_scheduler_users_map)
+        for user in sorted(users):
+            print(str(user.decode('utf8')) + " : " + users[user].decode('utf8'))
         print()
 
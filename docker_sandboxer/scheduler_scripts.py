@@ -0,0 +1,686 @@
+# Lua scripts used by AtomicCPUScheduler.
+# Every script runs atomically inside redis, so no semaphore is needed around them.
+#
+# Storage layout (no json, every operation touches only the cores and users involved):
+#   cpu-scheduler-core-available:<node>         hash: cpu number -> available share of that cpu
+#   cpu-scheduler-free:<node>:<share>           sorted set of cpus whose available share is <share>,
+#                                               scored by cpu number
+#   cpu-scheduler-core-users:<node>:<cpu>       hash: user -> share the user holds on that cpu
+#   cpu-scheduler-user-cpus:<user>              hash: cpu number -> share the user holds on that cpu
+#
+# Common KEYS layout:
+#   KEYS[1]     node -> docker host of that node ('' for the local docker daemon)
+#   KEYS[2]     node -> total shares of the node
+#   KEYS[3]     node -> free shares of the node
+#   KEYS[4]     user -> node the user holds shares on
+#   KEYS[5]     release notification list
+#   KEYS[6]     waiting queue (sorted set of tickets)
+#   KEYS[7]     ticket -> time it entered the queue
+#   KEYS[8]     ticket -> time of its last acquire attempt
+#   KEYS[9]     ticket sequence counter
+#   KEYS[10]    node -> total memory (and swap) of the node in bytes, nodes without it have unlimited memory
+#   KEYS[11]    node -> free memory of the node in bytes
+#   KEYS[12]    user -> memory the user holds in bytes
+#   KEYS[13]    user -> time its lease expires, users without a lease never expire
+#   KEYS[14]    user -> time its reservation was granted
+#   KEYS[15]    share granularity: available shares are multiples of it (256 if not set)
+
+CORE_AVAILABLE_PREFIX = "cpu-scheduler-core-available:"
+FREE_SET_PREFIX = "cpu-scheduler-free:"
+CORE_USERS_PREFIX = "cpu-scheduler-core-users:"
+USER_CPUS_PREFIX = "cpu-scheduler-user-cpus:"
+
+_COMMON = """
+local granularity = tonumber(redis.call('GET', KEYS[15]) or 256)
+local buckets = {}
+for bucket = 0, 1024, granularity do
+    table.insert(buckets, bucket)
+end
+
+local function core_available(node)
+    return '%(core_available)s' .. node
+end
+
+local function free_set(node, share)
+    return '%(free)s' .. node .. ':' .. string.format('%%d', share)
+end
+
+local function core_users(node, cpu)
+    return '%(core_users)s' .. node .. ':' .. cpu
+end
+
+local function user_cpus(user)
+    return '%(user_cpus)s' .. user
+end
+
+local function set_available(node, cpu, old_available, new_available)
+    redis.call('ZREM', free_set(node, old_available), cpu)
+    redis.call('ZADD', free_set(node, new_available), cpu, cpu)
+    redis.call('HSET', core_available(node), cpu, new_available)
+    redis.call('HINCRBY', KEYS[3], node, new_available - old_available)
+end
+
+-- Releases every share and the memory of a user (or only its shares on only_cpu).
+-- Returns the number of released cpus and the released memory.
+local function release_user(user, only_cpu)
+    local node = redis.call('HGET', KEYS[4], user)
+    if not node then
+        return 0, 0
+    end
+
+    local released = 0
+    local entries = redis.call('HGETALL', user_cpus(user))
+    for i = 1, #entries, 2 do
+        local cpu = entries[i]
+        if only_cpu == nil or cpu == only_cpu then
+            local available = tonumber(redis.call('HGET', core_available(node), cpu))
+            set_available(node, cpu, available, available + tonumber(entries[i + 1]))
+            redis.call('HDEL', core_users(node, cpu), user)
+            redis.call('HDEL', user_cpus(user), cpu)
+            released = released + 1
+        end
+    end
+    local released_memory = 0
+    if only_cpu == nil then
+        released_memory = tonumber(redis.call('HGET', KEYS[12], user) or 0)
+        if released_memory > 0 and redis.call('HEXISTS', KEYS[11], node) == 1 then
+            redis.call('HINCRBY', KEYS[11], node, released_memory)
+        end
+        redis.call('HDEL', KEYS[12], user)
+    end
+    if redis.call('EXISTS', user_cpus(user)) == 0 and redis.call('HEXISTS', KEYS[12], user) == 0 then
+        redis.call('HDEL', KEYS[4], user)
+        redis.call('HDEL', KEYS[13], user)
+        redis.call('HDEL', KEYS[14], user)
+    end
+    return released, released_memory
+end
+
+local function notify_waiters()
+    -- Wake up every waiter (up to 64), each of them retries its own request.
+    local waiting = math.min(math.max(redis.call('ZCARD', KEYS[6]), 1), 64)
+    for i = 1, waiting do
+        redis.call('RPUSH', KEYS[5], 1)
+    end
+    redis.call('LTRIM', KEYS[5], -64, -1)
+end
+""" % {"core_available": CORE_AVAILABLE_PREFIX, "free": FREE_SET_PREFIX, "core_users": CORE_USERS_PREFIX,
+       "user_cpus": USER_CPUS_PREFIX}
+
+# ARGV[1] user, ARGV[2] ticket ('' to not wait in the queue), ARGV[3] priority, ARGV[4] current time,
+# ARGV[5] backfill window, ARGV[6] stale ticket timeout, ARGV[7] node ('' to choose one automatically),
+# ARGV[8] requested memory in bytes, ARGV[9] lease ttl in seconds ('' for no lease), ARGV[10..] requested shares.
+# Either reserves every requested share and the requested memory on a single node or nothing at all.
+# If no node is given, the least loaded node which can fit the whole request is chosen and shares are placed
+# on its cpus by best fit decreasing: largest share first, each on the fullest cpu it fits on. Otherwise each requested share must be given as <share>:<cpu>, and the request
+# is granted only if every share still fits on its cpu of the given node.
+# A user which already holds shares is always placed on the same node.
+# Only the head of the waiting queue may be granted, unless the head has been waiting for less than
+# the backfill window; in that case any request that fits can be granted (backfilled).
+ACQUIRE_SCRIPT = _COMMON + """
+local user = ARGV[1]
+local ticket = ARGV[2]
+local now = tonumber(ARGV[4])
+local backfill_window = tonumber(ARGV[5])
+local stale_timeout = tonumber(ARGV[6])
+local placement_node = ARGV[7]
+local memory = tonumber(ARGV[8])
+local lease_ttl = tonumber(ARGV[9])
+
+local valid_share = {}
+for _, bucket in ipairs(buckets) do
+    valid_share[bucket] = true
+end
+local shares = {}
+local placement_cpus = {}
+local total_share = 0
+for a = 10, #ARGV do
+    local share, cpu = string.match(ARGV[a], '^(%d+):?(%d*)$')
+    share = tonumber(share)
+    if share == nil or not valid_share[share] or (placement_node ~= '' and cpu == '') then
+        return redis.error_reply('invalid cpu share ' .. ARGV[a])
+    end
+    table.insert(shares, share)
+    table.insert(placement_cpus, cpu)
+    total_share = total_share + share
+end
+
+if ticket ~= '' then
+    if not redis.call('ZSCORE', KEYS[6], ticket) then
+        -- Higher priorities come first, tickets with equal priority are served in FIFO order.
+        local sequence = redis.call('INCR', KEYS[9])
+        redis.call('ZADD', KEYS[6], string.format('%.0f', sequence - tonumber(ARGV[3]) * 1e12), ticket)
+        redis.call('HSET', KEYS[7], ticket, now)
+    end
+    redis.call('HSET', KEYS[8], ticket, now)
+end
+
+-- Drop tickets of waiters which have stopped trying (e.g. their process died).
+local head
+while true do
+    head = redis.call('ZRANGE', KEYS[6], 0, 0)[1]
+    if head == nil then
+        break
+    end
+    local last_attempt = tonumber(redis.call('HGET', KEYS[8], head) or 0)
+    if now - last_attempt <= stale_timeout then
+        break
+    end
+    redis.call('ZREM', KEYS[6], head)
+    redis.call('HDEL', KEYS[7], head)
+    redis.call('HDEL', KEYS[8], head)
+end
+
+if head ~= nil and head ~= ticket then
+    local waiting_since = tonumber(redis.call('HGET', KEYS[7], head) or now)
+    if now - waiting_since >= backfill_window then
+        return false
+    end
+end
+
+-- Plans the whole reservation on a node (largest share first, each on the cpu with the smallest sufficient
+-- available share, lowest cpu number first), so whole cpus are only split when no partly used cpu fits.
+-- Returns the planned cpus and a table mapping each touched cpu to {available before, available after}.
+local function plan(node)
+    local planned = {}
+    local planned_count = 0
+    local moved_in = {}
+    for _, bucket in ipairs(buckets) do
+        moved_in[bucket] = {}
+    end
+
+    local function take(bucket)
+        -- At most planned_count members of the set have already been planned away from it.
+        for _, cpu in ipairs(redis.call('ZRANGE', free_set(node, bucket), 0, planned_count)) do
+            if planned[cpu] == nil then
+                return cpu
+            end
+        end
+        for _, cpu in ipairs(moved_in[bucket]) do
+            if planned[cpu] ~= nil and planned[cpu][2] == bucket then
+                return cpu
+            end
+        end
+        return nil
+    end
+
+    local order = {}
+    for i = 1, #shares do
+        order[i] = i
+    end
+    table.sort(order, function(a, b)
+        if shares[a] ~= shares[b] then
+            return shares[a] > shares[b]
+        end
+        return a < b
+    end)
+
+    local cpus = {}
+    for _, i in ipairs(order) do
+        local share = shares[i]
+        local found = false
+        for _, bucket in ipairs(buckets) do
+            if bucket >= share then
+                local cpu = take(bucket)
+                if cpu ~= nil then
+                    if planned[cpu] == nil then
+                        planned_count = planned_count + 1
+                        planned[cpu] = {bucket, bucket}
+                    end
+                    planned[cpu][2] = bucket - share
+                    table.insert(moved_in[bucket - share], cpu)
+                    cpus[i] = cpu
+                    found = true
+                    break
+                end
+            end
+        end
+        if not found then
+            return nil, nil
+        end
+    end
+    return cpus, planned
+end
+
+-- Checks the given placement on a node, returns the same values as plan.
+local function check_placement(node)
+    local planned = {}
+    for i, share in ipairs(shares) do
+        local cpu = placement_cpus[i]
+        if planned[cpu] == nil then
+            local available = redis.call('HGET', core_available(node), cpu)
+            if not available then
+                return nil, nil
+            end
+            planned[cpu] = {tonumber(available), tonumber(available)}
+        end
+        if planned[cpu][2] < share then
+            return nil, nil
+        end
+        planned[cpu][2] = planned[cpu][2] - share
+    end
+    return placement_cpus, planned
+end
+
+-- Candidate nodes ordered by load (used shares / total shares), least loaded first.
+local candidates = {}
+local current_node = redis.call('HGET', KEYS[4], user)
+local capacities = redis.call('HGETALL', KEYS[2])
+for i = 1, #capacities, 2 do
+    local node = capacities[i]
+    local capacity = tonumber(capacities[i + 1])
+    local free = tonumber(redis.call('HGET', KEYS[3], node) or 0)
+    local free_memory = redis.call('HGET', KEYS[11], node)
+    local memory_fits = (not free_memory) or tonumber(free_memory) >= memory
+    if (not current_node or current_node == node) and (placement_node == '' or placement_node == node) and
+            free >= total_share and capacity > 0 and memory_fits then
+        table.insert(candidates, {node, (capacity - free) / capacity})
+    end
+end
+table.sort(candidates, function(a, b)
+    if a[2] ~= b[2] then
+        return a[2] < b[2]
+    end
+    return a[1] < b[1]
+end)
+
+local node, cpus, planned
+for _, candidate in ipairs(candidates) do
+    if placement_node == '' then
+        cpus, planned = plan(candidate[1])
+    else
+        cpus, planned = check_placement(candidate[1])
+    end
+    if cpus ~= nil then
+        node = candidate[1]
+        break
+    end
+end
+if node == nil then
+    return false
+end
+
+if ticket ~= '' then
+    redis.call('ZREM', KEYS[6], ticket)
+    redis.call('HDEL', KEYS[7], ticket)
+    redis.call('HDEL', KEYS[8], ticket)
+end
+
+for cpu, change in pairs(planned) do
+    set_available(node, cpu, change[1], change[2])
+end
+for i, cpu in ipairs(cpus) do
+    local share = shares[i]
+    redis.call('HINCRBY', core_users(node, cpu), user, share)
+    redis.call('HINCRBY', user_cpus(user), cpu, share)
+end
+if memory > 0 then
+    if redis.call('HEXISTS', KEYS[11], node) == 1 then
+        redis.call('HINCRBY', KEYS[11], node, -memory)
+    end
+    redis.call('HINCRBY', KEYS[12], user, memory)
+end
+if #cpus > 0 or memory > 0 then
+    if not current_node then
+        redis.call('HSET', KEYS[14], user, ARGV[4])
+    end
+    redis.call('HSET', KEYS[4], user, node)
+    if lease_ttl then
+        redis.call('HSET', KEYS[13], user, string.format('%.3f', now + lease_ttl))
+    end
+end
+table.insert(cpus, 1, redis.call('HGET', KEYS[1], node))
+table.insert(cpus, 1, node)
+return cpus
+"""
+
+# ARGV[1] user, ARGV[2] (optional) a single cpu number to release.
+# Releases every share and the memory of the user (or only the shares on the given cpu).
+# Returns the number of cpus released.
+RELEASE_SCRIPT = _COMMON + """
+local released, released_memory = release_user(ARGV[1], ARGV[2])
+if released > 0 or released_memory > 0 then
+    notify_waiters()
+end
+return released
+"""
+
+# ARGV[1] time the leases expire, ARGV[2..] users.
+# Extends the leases of the given users. Returns the users which do not hold a reservation anymore.
+RENEW_SCRIPT = _COMMON + """
+local lost = {}
+for a = 2, #ARGV do
+    if redis.call('HEXISTS', KEYS[4], ARGV[a]) == 1 then
+        redis.call('HSET', KEYS[13], ARGV[a], ARGV[1])
+    else
+        table.insert(lost, ARGV[a])
+    end
+end
+return lost
+"""
+
+# ARGV[1] user, ARGV[2] current time, ARGV[3] grace period in seconds.
+# Releases the reservation of a user if its lease has expired, or if it has no lease and was granted
+# more than the grace period ago. Returns 1 if the reservation was released.
+REAP_SCRIPT = _COMMON + """
+local user = ARGV[1]
+local now = tonumber(ARGV[2])
+if redis.call('HEXISTS', KEYS[4], user) == 0 then
+    return 0
+end
+local expires = redis.call('HGET', KEYS[13], user)
+if expires then
+    if tonumber(expires) >= now then
+        return 0
+    end
+elseif tonumber(redis.call('HGET', KEYS[14], user) or 0) + tonumber(ARGV[3]) >= now then
+    return 0
+end
+release_user(user, nil)
+redis.call('HDEL', KEYS[4], user)
+redis.call('HDEL', KEYS[13], user)
+redis.call('HDEL', KEYS[14], user)
+notify_waiters()
+return 1
+"""
+
+# ARGV[1] node, ARGV[2] docker host of the node, ARGV[3] cpu number, ARGV[4] available share.
+# Adds a cpu to a node (or resets an existing one which no user holds shares on).
+ADD_CPU_SCRIPT = _COMMON + """
+local node = ARGV[1]
+local cpu = ARGV[3]
+local share = tonumber(ARGV[4])
+local old_available = tonumber(redis.call('HGET', core_available(node), cpu) or 0)
+if redis.call('HEXISTS', core_available(node), cpu) == 1 then
+    if redis.call('EXISTS', core_users(node, cpu)) == 1 then
+        return redis.error_reply('cpu ' .. cpu .. ' of node ' .. node .. ' is in use')
+    end
+    redis.call('ZREM', free_set(node, old_available), cpu)
+end
+redis.call('HSET', KEYS[1], node, ARGV[2])
+redis.call('ZADD', free_set(node, share), cpu, cpu)
+redis.call('HSET', core_available(node), cpu, share)
+redis.call('HINCRBY', KEYS[2], node, share - old_available)
+redis.call('HINCRBY', KEYS[3], node, share - old_available)
+notify_waiters()
+return 1
+"""
+
+# ARGV[1] node, ARGV[2] total memory (and swap) of the node in bytes.
+# Sets the memory pool of a node. Memory currently held by users stays reserved.
+SET_MEMORY_SCRIPT = _COMMON + """
+local node = ARGV[1]
+local total = tonumber(ARGV[2])
+local old_total = redis.call('HGET', KEYS[10], node)
+if old_total then
+    redis.call('HINCRBY', KEYS[11], node, total - tonumber(old_total))
+else
+    -- Until now the node had unlimited memory, so count what its users already hold.
+    local held = 0
+    for _, user in ipairs(redis.call('HKEYS', KEYS[4])) do
+        if redis.call('HGET', KEYS[4], user) == node then
+            held = held + tonumber(redis.call('HGET', KEYS[12], user) or 0)
+        end
+    end
+    redis.call('HSET', KEYS[11], node, total - held)
+end
+redis.call('HSET', KEYS[10], node, total)
+notify_waiters()
+return 1
+"""
+
+# ARGV[1] user, ARGV[2] cpu to move the user's share from, ARGV[3] cpu to move it to.
+# Moves the whole share a user holds on a cpu to another cpu of the same node, if it fits there.
+# Returns the moved share, or false if nothing was moved.
+MOVE_SCRIPT = _COMMON + """
+local user = ARGV[1]
+local from = ARGV[2]
+local to = ARGV[3]
+local node = redis.call('HGET', KEYS[4], user)
+if not node or from == to then
+    return false
+end
+local share = tonumber(redis.call('HGET', user_cpus(user), from) or 0)
+local to_available = redis.call('HGET', core_available(node), to)
+if share == 0 or not to_available or tonumber(to_available) < share then
+    return false
+end
+local from_available = tonumber(redis.call('HGET', core_available(node), from))
+set_available(node, from, from_available, from_available + share)
+set_available(node, to, tonumber(to_available), tonumber(to_available) - share)
+redis.call('HDEL', core_users(node, from), user)
+redis.call('HINCRBY', core_users(node, to), user, share)
+redis.call('HDEL', user_cpus(user), from)
+redis.call('HINCRBY', user_cpus(user), to, share)
+notify_waiters()
+return share
+"""
+
+# ARGV[1] share granularity.
+# Sets the granularity of shares. Fails if an available or held share of some cpu is not a multiple of it.
+SET_GRANULARITY_SCRIPT = _COMMON + """
+local new_granularity = tonumber(ARGV[1])
+for _, node in ipairs(redis.call('HKEYS', KEYS[1])) do
+    local entries = redis.call('HGETALL', core_available(node))
+    for i = 1, #entries, 2 do
+        local held = redis.call('HVALS', core_users(node, entries[i]))
+        table.insert(held, entries[i + 1])
+        for _, share in ipairs(held) do
+            if tonumber(share) % new_granularity ~= 0 then
+                return redis.error_reply('cpu ' .. entries[i] .. ' of node ' .. node .. ' has a share of ' ..
+                                         share .. ' which is not a multiple of ' .. new_granularity)
+            end
+        end
+    end
+end
+redis.call('SET', KEYS[15], new_granularity)
+return 1
+"""
+
+# ARGV[1] '1' to repair the problems found, '0' to only report them.
+# Checks every structure derived from the core status hashes (available share of each cpu) and the users of each
+# cpu: the share lists (free sets), free and total shares of nodes, the user -> cpus index, the user -> node map
+# and free memory of nodes. Repairing rebuilds them from the core status hashes and the users of the cpus.
+# Returns the list of problems found.
+CHECK_SCRIPT = _COMMON + """
+local repair = ARGV[1] == '1'
+local problems = {}
+local function problem(text)
+    table.insert(problems, text)
+end
+
+local function check_value(key, field, expected, description)
+    local value = tonumber(redis.call('HGET', key, field) or 0)
+    if value ~= expected then
+        problem(string.format('%s is %d instead of %d', description, value, expected))
+        if repair then
+            redis.call('HSET', key, field, expected)
+        end
+    end
+end
+
+local valid_share = {}
+for _, bucket in ipairs(buckets) do
+    valid_share[bucket] = true
+end
+
+local user_shares = {}  -- user -> {cpu -> share}
+local user_node = {}
+for _, node in ipairs(redis.call('HKEYS', KEYS[1])) do
+    local available_of = {}
+    local free, capacity = 0, 0
+    local entries = redis.call('HGETALL', core_available(node))
+    for i = 1, #entries, 2 do
+        local cpu, available = entries[i], tonumber(entries[i + 1])
+        available_of[cpu] = available
+        local held = 0
+        local users = redis.call('HGETALL', core_users(node, cpu))
+        for j = 1, #users, 2 do
+            local user, share = users[j], tonumber(users[j + 1])
+            held = held + share
+            user_shares[user] = user_shares[user] or {}
+            user_shares[user][cpu] = share
+            if user_node[user] ~= nil and user_node[user] ~= node then
+                problem('user ' .. user .. ' holds shares on nodes ' .. user_node[user] .. ' and ' .. node)
+            end
+            user_node[user] = node
+        end
+        if not valid_share[available] or available + held > 1024 then
+            problem(string.format('cpu %s of node %s has %d available share and %d held share',
+                                  cpu, node, available, held))
+        end
+        free = free + available
+        capacity = capacity + available + held
+    end
+
+    for _, bucket in ipairs(buckets) do
+        for _, cpu in ipairs(redis.call('ZRANGE', free_set(node, bucket), 0, -1)) do
+            if available_of[cpu] ~= bucket then
+                problem('cpu ' .. cpu .. ' of node ' .. node .. ' is in the list of ' .. bucket .. ' available share')
+                if repair then
+                    redis.call('ZREM', free_set(node, bucket), cpu)
+                end
+            end
+        end
+    end
+    for cpu, available in pairs(available_of) do
+        if not redis.call('ZSCORE', free_set(node, available), cpu) then
+            problem('cpu ' .. cpu .. ' of node ' .. node .. ' is missing from the list of ' .. available ..
+                    ' available share')
+            if repair then
+                redis.call('ZADD', free_set(node, available), cpu, cpu)
+            end
+        end
+    end
+    check_value(KEYS[3], node, free, 'free share of node ' .. node)
+    check_value(KEYS[2], node, capacity, 'total share of node ' .. node)
+end
+
+for user, shares in pairs(user_shares) do
+    local indexed = {}
+    local entries = redis.call('HGETALL', user_cpus(user))
+    for i = 1, #entries, 2 do
+        indexed[entries[i]] = tonumber(entries[i + 1])
+    end
+    local consistent = true
+    for cpu, share in pairs(shares) do
+        if indexed[cpu] ~= share then
+            consistent = false
+        end
+    end
+    for cpu, share in pairs(indexed) do
+        if shares[cpu] ~= share then
+            consistent = false
+        end
+    end
+    if not consistent then
+        problem('cpus of user ' .. user .. ' do not match the users of the cpus')
+        if repair then
+            redis.call('DEL', user_cpus(user))
+            for cpu, share in pairs(shares) do
+                redis.call('HSET', user_cpus(user), cpu, share)
+            end
+        end
+    end
+    if redis.call('HGET', KEYS[4], user) ~= user_node[user] then
+        problem('node of user ' .. user .. ' is not ' .. user_node[user])
+        if repair then
+            redis.call('HSET', KEYS[4], user, user_node[user])
+        end
+    end
+end
+
+local held_memory = {}
+for _, user in ipairs(redis.call('HKEYS', KEYS[4])) do
+    local memory = tonumber(redis.call('HGET', KEYS[12], user) or 0)
+    if user_shares[user] == nil and memory == 0 then
+        problem('user ' .. user .. ' holds nothing but is mapped to a node')
+        if repair then
+            redis.call('DEL', user_cpus(user))
+            redis.call('HDEL', KEYS[4], user)
+            redis.call('HDEL', KEYS[13], user)
+            redis.call('HDEL', KEYS[14], user)
+        end
+    else
+        local node = redis.call('HGET', KEYS[4], user)
+        if repair and user_node[user] ~= nil then
+            node = user_node[user]
+        end
+        held_memory[node] = (held_memory[node] or 0) + memory
+    end
+end
+local totals = redis.call('HGETALL', KEYS[10])
+for i = 1, #totals, 2 do
+    local node = totals[i]
+    check_value(KEYS[11], node, tonumber(totals[i + 1]) - (held_memory[node] or 0), 'free memory of node ' .. node)
+end
+
+if repair and #problems > 0 then
+    notify_waiters()
+end
+return problems
+"""
+
+# Returns the available share of every cpu in one call:
+#   {{node, total shares, free shares, free memory ('' if unlimited), cpu, available, cpu, available, ...}, ...}
+AVAILABILITY_SCRIPT = _COMMON + """
+local nodes = {}
+local capacities = redis.call('HGETALL', KEYS[2])
+for i = 1, #capacities, 2 do
+    local node = {capacities[i], capacities[i + 1], redis.call('HGET', KEYS[3], capacities[i]) or '0',
+                  redis.call('HGET', KEYS[11], capacities[i]) or ''}
+    local entries = redis.call('HGETALL', core_available(capacities[i]))
+    for j = 1, #entries do
+        table.insert(node, entries[j])
+    end
+    table.insert(nodes, node)
+end
+return nodes
+"""
+
+# Returns the whole state in one call:
+#   {{node, docker host, total memory ('' if unlimited), free memory,
+#     {{cpu, available, user, share, user, share, ...}, ...}}, ...}, number of waiting tickets
+SNAPSHOT_SCRIPT = _COMMON + """
+local nodes = {}
+local node_entries = redis.call('HGETALL', KEYS[1])
+for n = 1, #node_entries, 2 do
+    local node = node_entries[n]
+    local cores = {}
+    local entries = redis.call('HGETALL', core_available(node))
+    for i = 1, #entries, 2 do
+        local core = {entries[i], entries[i + 1]}
+        local users = redis.call('HGETALL', core_users(node, entries[i]))
+        for j = 1, #users do
+            table.insert(core, users[j])
+        end
+        table.insert(cores, core)
+    end
+    table.insert(nodes, {node, node_entries[n + 1], redis.call('HGET', KEYS[10], node) or '',
+                         redis.call('HGET', KEYS[11], node) or '', cores})
+end
+return {nodes, redis.call('ZCARD', KEYS[6])}
+"""
+
+# Removes every key of the layout, except the share granularity.
+CLEAR_SCRIPT = _COMMON + """
+local cpu_count = 0
+for _, node in ipairs(redis.call('HKEYS', KEYS[1])) do
+    local cores = redis.call('HKEYS', core_available(node))
+    for _, cpu in ipairs(cores) do
+        redis.call('DEL', core_users(node, cpu))
+    end
+    for _, bucket in ipairs(buckets) do
+        redis.call('DEL', free_set(node, bucket))
+    end
+    redis.call('DEL', core_available(node))
+    cpu_count = cpu_count + #cores
+end
+for _, user in ipairs(redis.call('HKEYS', KEYS[4])) do
+    redis.call('DEL', user_cpus(user))
+end
+for i = 1, 14 do
+    redis.call('DEL', KEYS[i])
+end
+return cpu_count
+"""
@@ -0,0 +1,145 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .engine import DockerEngineError
+
+
+class Teardown(object):
+    """
+    Ends runs quickly: containers of a project are killed in parallel, and their removal (along with anonymous
+    volumes and the project networks) is left to background cleaner threads. Once kill returns the processes are
+    dead, so the run's cpu shares can be released without waiting for docker to delete anything.
+
+    Pending removals are finished (for up to exit_timeout seconds) when the process exits.
+    """
+
+    def __init__(self, cleaner_threads=2, exit_timeout=30):
+        """
+        :param cleaner_threads: Number of threads removing containers and networks.
+        :param exit_timeout: Seconds to wait for pending removals when the process exits.
+        """
+        self.cleaner_threads = cleaner_threads
+        self.exit_timeout = exit_timeout
+        self.kills = 0
+        self.kill_seconds_total = 0.0
+        self.kill_seconds_max = 0.0
+        self.kill_seconds_last = None
+        self.removed = 0
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._cleaners = []
+        atexit.register(self.wait, self.exit_timeout)
+
+    @staticmethod
+    def _kill_one(client, container_id):
+        try:
+            client.kill_container(container_id)
+        except DockerEngineError as e:
+            # 409: the container is not running anymore.
+            if e.status not in (404, 409):
+                raise
+        try:
+            client.wait_container(container_id)
+        except DockerEngineError as e:
+            if e.status != 404:
+                raise
+
+    def kill(self, client, container_ids):
+        """
+        Sends SIGKILL to every container at once and waits until all of them have stopped.
+        :return: Seconds it took.
+        """
+        start = time.time()
+        if container_ids:
+            with ThreadPoolExecutor(len(container_ids)) as executor:
+                for future in [executor.submit(self._kill_one, client, container_id)
+                               for container_id in container_ids]:
+                    future.result()
+        elapsed = time.time() - start
+        with self._lock:
+            self.kills += 1
+            self.kill_seconds_total += elapsed
+            self.kill_seconds_max = max(self.kill_seconds_max, elapsed)
+            self.kill_seconds_last = elapsed
+        metrics.KILL_SECONDS.observe(elapsed, method="engine")
+        return elapsed
+
+    def remove_later(self, client, container_ids, network_ids=()):
+        """
+        Queues removal of stopped containers (with their anonymous volumes), then of networks.
+        """
+        with self._lock:
+            self._cleaners = [cleaner for cleaner in self._cleaners if cleaner.is_alive()]
+            while len(self._cleaners) < self.cleaner_threads:
+                cleaner = threading.Thread(target=self._clean, daemon=True)
+                cleaner.start()
+                self._cleaners.append(cleaner)
+        self._queue.put((client, list(container_ids), list(network_ids)))
+
+    def _clean(self):
+        while True:
+            client, container_ids, network_ids = self._queue.get()
+            start = metrics.start()
+            try:
+                for container_id in container_ids:
+                    self._remove(client.remove_container, container_id)
+                for network_id in network_ids:
+                    self._remove(client.remove_network, network_id)
+                metrics.CLEANUP_SECONDS.observe_since(start)
+            finally:
+                self._queue.task_done()
+
+    def _remove(self, remove, object_id):
+        try:
+            remove(object_id)
+            removed = True
+        except DockerEngineError as e:
+            # Already removed by someone else.
+            removed = e.status == 404
+        except Exception:
+            # Any other failure (connection, protocol, malformed response) must not end the cleaner thread.
+            removed = False
+        with self._lock:
+            if removed:
+                self.removed += 1
+            else:
+                self.failed += 1
+
+    def wait(self, timeout=None):
+        """
+        Waits until every queued removal is done.
+        :return: False if some are still pending after timeout seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stats(self):
+        """
+        :return: dictionary of kills, kill_mean, kill_max and kill_last (seconds from the kill request until every
+        container stopped), pending (queued removals), removed and failed (containers and networks).
+        """
+        with self._lock:
+            return {
+                "kills": self.kills,
+                "kill_mean": self.kill_seconds_total / self.kills if self.kills else None,
+                "kill_max": self.kill_seconds_max,
+                "kill_last": self.kill_seconds_last,
+                "pending": self._queue.unfinished_tasks,
+                "removed": self.removed,
+                "failed": self.failed,
+            }
+
+
+# Shared by run_compose_with_file and EngineRunner unless they are given their own.
+default_teardown = Teardown()
@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+
+from .engine import DockerEngineClient, compose_project_names, project_containers
+
+
+def _read_int(path):
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _read_keyed(path):
+    """
+    Reads a flat keyed file such as cpu.stat ("key value" lines).
+    """
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2:
+                    values[parts[0]] = int(parts[1])
+    except (IOError, OSError, ValueError):
+        return None
+    return values
+
+
+def _read_io_stat(path):
+    """
+    Sums read and written bytes of all devices in io.stat ("major:minor rbytes=.. wbytes=.. ..." lines).
+    """
+    read_bytes, write_bytes = 0, 0
+    try:
+        with open(path) as f:
+            for line in f:
+                for field in line.split()[1:]:
+                    key, _, value = field.partition("=")
+                    if key == "rbytes":
+                        read_bytes += int(value)
+                    elif key == "wbytes":
+                        write_bytes += int(value)
+    except (IOError, OSError, ValueError):
+        return None, None
+    return read_bytes, write_bytes
+
+
+class CgroupSampler(object):
+    """
+    Samples cgroup v2 statistics (cpu.stat, memory.current, memory.peak and io.stat) of the containers of a project
+    at a fixed interval. Only containers of the local docker daemon can be sampled.
+    """
+
+    # Where docker puts a container's cgroup, for the systemd and the cgroupfs cgroup drivers.
+    cgroup_patterns = ("system.slice/docker-%s.scope", "docker/%s")
+
+    # Fields of a sample, in the order they are stored in time series.
+    fields = ("cpu_usec", "throttled_usec", "memory", "io_read", "io_write")
+
+    def __init__(self, interval=1, cgroup_root="/sys/fs/cgroup", discovery_interval=5, find_containers=None):
+        """
+        :param interval: Seconds between two samples.
+        :param cgroup_root: Mount point of the cgroup v2 hierarchy.
+        :param discovery_interval: Seconds between two lookups of the project's containers.
+        :param find_containers: A function (project_name, docker_host) returning a dictionary which maps service names
+        to container ids. Defaults to asking the docker daemon for containers named like the project's containers.
+        """
+        self.interval = interval
+        self.cgroup_root = cgroup_root
+        self.discovery_interval = discovery_interval
+        if find_containers is not None:
+            self.find_containers = find_containers
+
+    def find_containers(self, project_name, docker_host=None):
+        names = compose_project_names(project_name)
+        client = DockerEngineClient(docker_host, max_idle_connections=0)
+        containers = {}
+        for container in project_containers(client, project_name):
+            service = (container.get("Labels") or {}).get("com.docker.compose.service")
+            if service is None:
+                container_name = (container.get("Names") or ["/"])[0].lstrip("/")
+                prefixes = [name for name in names if container_name.startswith(name + "_")]
+                if not prefixes:
+                    # Not named like a container of the project, its service is unknown.
+                    continue
+                service = container_name[len(max(prefixes, key=len)) + 1:].rsplit("_", 1)[0]
+            containers[service] = container["Id"]
+        return containers
+
+    def cgroup_path(self, container_id):
+        """
+        :return: cgroup directory of the container, or None if it does not exist.
+        """
+        for pattern in CgroupSampler.cgroup_patterns:
+            path = os.path.join(self.cgroup_root, pattern % container_id)
+            if os.path.isdir(path):
+                return path
+        return None
+
+    def read(self, cgroup_path):
+        """
+        :return: dictionary of the sample fields plus memory_peak (None if the kernel does not provide it),
+        or None if the cgroup is gone.
+        """
+        cpu_stat = _read_keyed(os.path.join(cgroup_path, "cpu.stat"))
+        if cpu_stat is None:
+            return None
+        io_read, io_write = _read_io_stat(os.path.join(cgroup_path, "io.stat"))
+        return {
+            "cpu_usec": cpu_stat.get("usage_usec", 0),
+            "throttled_usec": cpu_stat.get("throttled_usec", 0),
+            "memory": _read_int(os.path.join(cgroup_path, "memory.current")) or 0,
+            "memory_peak": _read_int(os.path.join(cgroup_path, "memory.peak")),
+            "io_read": io_read or 0,
+            "io_write": io_write or 0,
+        }
+
+    def start(self, project_name, docker_host=None):
+        """
+        Starts sampling the containers of a project in a background thread.
+        :return: A Recording, or None if docker_host is not the local daemon.
+        """
+        if docker_host and not docker_host.startswith("unix://"):
+            return None
+        recording = Recording(self, project_name, docker_host)
+        recording.start()
+        return recording
+
+
+class Recording(object):
+    """
+    Time series of the containers of one project, sampled by a CgroupSampler.
+    series maps each service name to a dictionary with a list per field of CgroupSampler.fields, and a "t" list
+    of milliseconds since the recording started.
+    """
+
+    def __init__(self, sampler, project_name, docker_host=None):
+        self.sampler = sampler
+        self.project_name = project_name
+        self.docker_host = docker_host
+        self.series = {}
+        self.memory_peaks = {}
+        self.started_at = None
+        self.duration = None
+        self._cgroup_paths = {}
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread.start()
+
+    def _discover(self):
+        try:
+            containers = self.sampler.find_containers(self.project_name, self.docker_host)
+        except Exception:
+            # Discovery is retried later, a failure must not end the sampling thread.
+            return
+        for service, container_id in containers.items():
+            if service not in self._cgroup_paths:
+                path = self.sampler.cgroup_path(container_id)
+                if path is not None:
+                    self._cgroup_paths[service] = path
+
+    def sample(self):
+        """
+        Takes one sample of every known container.
+        """
+        elapsed = int((time.time() - self.started_at) * 1000)
+        for service, path in self._cgroup_paths.items():
+            values = self.sampler.read(path)
+            if values is None:
+                continue
+            if service not in self.series:
+                self.series[service] = {field: [] for field in ("t",) + CgroupSampler.fields}
+            series = self.series[service]
+            series["t"].append(elapsed)
+            for field in CgroupSampler.fields:
+                series[field].append(values[field])
+            if values["memory_peak"] is not None:
+                self.memory_peaks[service] = values["memory_peak"]
+
+    def _run(self):
+        next_discovery = 0
+        while True:
+            # Containers are looked up until some are found, then every discovery_interval seconds.
+            if not self._cgroup_paths or time.time() >= next_discovery:
+                self._discover()
+                next_discovery = time.time() + self.sampler.discovery_interval
+            self.sample()
+            if self._stop_event.wait(self.sampler.interval):
+                return
+
+    def stop(self):
+        """
+        Stops sampling.
+        :return: dictionary with the duration of the recording in seconds, the summary of every service
+        (see summary) and the time series.
+        """
+        self._stop_event.set()
+        self._thread.join()
+        self.duration = time.time() - self.started_at
+        return {
+            "duration": self.duration,
+            "summary": self.summary(),
+            "series": self.series,
+        }
+
+    def summary(self):
+        """
+        :return: dictionary mapping each service to its samples count, cpu_seconds, cpu_mean and cpu_max
+        (in cores, over sampling intervals), throttled_seconds, memory_mean and memory_peak (in bytes),
+        io_read and io_write (in bytes).
+        """
+        summary = {}
+        for service, series in self.series.items():
+            times, cpu = series["t"], series["cpu_usec"]
+            rates = [(cpu[i] - cpu[i - 1]) / 1000.0 / (times[i] - times[i - 1])
+                     for i in range(1, len(times)) if times[i] > times[i - 1]]
+            span = (times[-1] - times[0]) / 1000.0
+            summary[service] = {
+                "samples": len(times),
+                "cpu_seconds": cpu[-1] / 1000000.0,
+                "cpu_mean": (cpu[-1] - cpu[0]) / 1000000.0 / span if span > 0 else 0.0,
+                "cpu_max": max(rates) if rates else 0.0,
+                "throttled_seconds": series["throttled_usec"][-1] / 1000000.0,
+                "memory_mean": sum(series["memory"]) // len(times),
+                "memory_peak": max(self.memory_peaks.get(service, 0), max(series["memory"])),
+                "io_read": series["io_read"][-1],
+                "io_write": series["io_write"][-1],
+            }
+        return summary
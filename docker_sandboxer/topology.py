@@ -0,0 +1,121 @@
+import json
+import os
+import re
+
+
+def parse_cpu_list(cpu_list):
+    """
+    Parses a cpu list in the kernel's format (e.g. "0-3,8,10-11") to a list of cpu numbers.
+    """
+    cpus = []
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus += range(int(first), int(last) + 1)
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _read(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return default
+
+
+class CPUTopology(object):
+    """
+    Describes which cpus of a host share a physical core, a last level cache, a NUMA node and a package.
+    Each of these levels divides the cpus into domains. A domain is identified by its smallest cpu number.
+    """
+
+    levels = ("core", "llc", "numa_node", "package")
+
+    def __init__(self, cpus):
+        """
+        :param cpus: dictionary mapping each cpu number to a dictionary which maps each level to a domain id.
+        """
+        self.cpus = cpus
+        self._domains = {}
+
+    @staticmethod
+    def flat(cpu_numbers):
+        """
+        A topology in which every cpu is a separate core and all of them share everything else.
+        """
+        return CPUTopology({cpu: {"core": cpu, "llc": 0, "numa_node": 0, "package": 0} for cpu in cpu_numbers})
+
+    @staticmethod
+    def from_sysfs(root="/sys/devices/system/cpu"):
+        """
+        Reads the topology of the online cpus of this host from sysfs.
+        :param root: Directory which contains the cpuN directories.
+        """
+        cpus = {}
+        for entry in os.listdir(root):
+            match = re.match(r"^cpu(\d+)$", entry)
+            if not match:
+                continue
+            cpu = int(match.group(1))
+            cpu_dir = os.path.join(root, entry)
+            if _read(os.path.join(cpu_dir, "online"), "1") == "0":
+                continue
+
+            siblings = _read(os.path.join(cpu_dir, "topology", "core_cpus_list")) or \
+                _read(os.path.join(cpu_dir, "topology", "thread_siblings_list"))
+            package = int(_read(os.path.join(cpu_dir, "topology", "physical_package_id"), "0"))
+
+            # The highest level data (or unified) cache is the last level cache.
+            llc, llc_level = None, -1
+            cache_dir = os.path.join(cpu_dir, "cache")
+            if os.path.isdir(cache_dir):
+                for index in os.listdir(cache_dir):
+                    index_dir = os.path.join(cache_dir, index)
+                    if not index.startswith("index") or _read(os.path.join(index_dir, "type")) == "Instruction":
+                        continue
+                    level = int(_read(os.path.join(index_dir, "level"), "0"))
+                    shared = _read(os.path.join(index_dir, "shared_cpu_list"))
+                    if shared and level > llc_level:
+                        llc, llc_level = min(parse_cpu_list(shared)), level
+
+            numa_node = None
+            for node_entry in os.listdir(cpu_dir):
+                node_match = re.match(r"^node(\d+)$", node_entry)
+                if node_match:
+                    numa_node = int(node_match.group(1))
+
+            cpus[cpu] = {
+                "core": min(parse_cpu_list(siblings)) if siblings else cpu,
+                "package": package,
+            }
+            cpus[cpu]["llc"] = llc if llc is not None else "package-%d" % package
+            cpus[cpu]["numa_node"] = numa_node if numa_node is not None else package
+        return CPUTopology(cpus)
+
+    def domains(self, level):
+        """
+        :return: dictionary mapping domain ids of the given level to the sorted list of their cpus.
+        """
+        if level not in self._domains:
+            domains = {}
+            for cpu in sorted(self.cpus):
+                domains.setdefault(self.cpus[cpu][level], []).append(cpu)
+            self._domains[level] = domains
+        return self._domains[level]
+
+    def domain_count(self, level, cpu_numbers):
+        """
+        :return: number of distinct domains of the given level which cpu_numbers span.
+        """
+        return len(set([self.cpus[cpu][level] for cpu in cpu_numbers if cpu in self.cpus]))
+
+    def to_json(self):
+        return json.dumps({str(cpu): info for cpu, info in self.cpus.items()}, sort_keys=True)
+
+    @staticmethod
+    def from_json(data):
+        return CPUTopology({int(cpu): info for cpu, info in json.loads(data).items()})
@@ -1,8 +1,32 @@
 from compose.cli.main import TopLevelCommand
+from . import metrics
+from .engine import DockerEngineClient, DockerEngineError, project_containers, project_networks
+from .teardown import default_teardown
 import threading
 
+# Seconds to wait for the rest of the managers' output after they stop.
+LOG_DRAIN_TIMEOUT = 5
 
-def run_compose_with_file(project_name, yml_file, manager_services, timeout):
+
+def _find_containers(client, project_name, services):
+    """
+    :return: dictionary mapping services (all of them if services is empty) of a compose project to container ids
+    :raise DockerEngineError: If a service (or the project when services is empty) has no container.
+    """
+    containers = {}
+    for container in project_containers(client, project_name):
+        service = (container.get("Labels") or {}).get("com.docker.compose.service")
+        if not services or service in services:
+            containers[service] = container["Id"]
+    missing = [service for service in services if service not in containers]
+    if missing or not containers:
+        raise DockerEngineError(404, "No container of %s in project %s" % (", ".join(missing) or "any service",
+                                                                          project_name))
+    return containers
+
+
+def run_compose_with_file(project_name, yml_file, manager_services, timeout, docker_host=None, logs=None,
+                          teardown=None):
 
     class ContainerKiller(object):
 
@@ -13,31 +37,53 @@ def run_compose_with_file(project_name, yml_file, manager_services, timeout):
             self.exception_on_kill = None
 
         def kill(self, exception_on_kill=None):
-            self.kill_lock.acquire()
-            if self.has_been_killed:
-                return None
-            self.has_been_killed = True
-            self.exception_on_kill = exception_on_kill
-            # Kill all running containers
-            command.dispatch(self.project_description + ["kill"], None)
-            # Remove containers(Cleaning up)
-            command.dispatch(self.project_description + ["rm", "--force"], None)
-            self.kill_lock.release()
+            # Other callers wait until the containers are dead.
+            with self.kill_lock:
+                if self.has_been_killed:
+                    return None
+                self.has_been_killed = True
+                self.exception_on_kill = exception_on_kill
+                try:
+                    client = DockerEngineClient(docker_host, max_idle_connections=0)
+                    container_ids = [container["Id"] for container in project_containers(client, project_name)]
+                    if container_ids:
+                        teardown.kill(client, container_ids)
+                        networks = project_networks(client, project_name)
+                        teardown.remove_later(client, container_ids, [network["Id"] for network in networks])
+                        return None
+                except (IOError, OSError, AssertionError, DockerEngineError):
+                    # The engine API can not reach the daemon the way docker-compose does (e.g. over ssh).
+                    pass
+                # docker-compose finds its containers even when they are labelled in a way we don't know of.
+                start = metrics.start()
+                command.dispatch(self.project_description + ["kill"], None)
+                command.dispatch(self.project_description + ["rm", "--force"], None)
+                metrics.KILL_SECONDS.observe_since(start, method="compose")
 
     """
         :param project_name: A name used to identify containers of this project
         :param yml_file; Path of YAML file which docker-compose is going to be run with.
         :param manager_services: list of services which are supposed to act as managers.
+        :param docker_host: Docker daemon to run the containers on. None means the local daemon.
+        :param logs: A logs.LogCapture which receives the managers' output. None means printing it.
+        :param teardown: A teardown.Teardown which kills and removes the containers. Defaults to a shared one.
         Runs docker-compose and waits until manager containers stop. Kills all the container afterwards.
-        Streams managers' logs to the output.
+        Streams managers' logs to the output (or to logs).
+        Returns as soon as the containers are dead, they are removed in the background.
     """
+    if teardown is None:
+        teardown = default_teardown
     if not manager_services:
         manager_services = []
 
     command = TopLevelCommand()
     project_description = ["-f", [yml_file], "-p", project_name]
+    if docker_host:
+        project_description = ["-H", docker_host] + project_description
     # Start docker-compose as a daemon
+    start = metrics.start()
     command.dispatch(project_description + ["up", "-d"], None)
+    metrics.START_SECONDS.observe_since(start, runner="compose")
     # Attach to manager container(s)' logs. Waits for manager container to stop.
     # if no service is mentioned as manager(i.e. manager_services is an empty list)
     # automatically attaches to all containers logs
@@ -49,11 +95,28 @@ def run_compose_with_file(project_name, yml_file, manager_services, timeout):
     try:
         if timeout:
             timer.start()
-        command.dispatch(project_description + ["logs"] + manager_services, None)
+        if logs is None:
+            command.dispatch(project_description + ["logs"] + manager_services, None)
+        else:
+            client = DockerEngineClient(docker_host, max_idle_connections=1)
+            try:
+                containers = _find_containers(client, project_name, manager_services)
+                for service, container_id in containers.items():
+                    tty = client.inspect_container(container_id)["Config"].get("Tty", False)
+                    logs.attach(client, service, container_id, tty)
+                for container_id in containers.values():
+                    client.wait_container(container_id)
+                logs.close(LOG_DRAIN_TIMEOUT)
+            except DockerEngineError:
+                # Containers removed by the killer can not be waited for.
+                if not container_killer.has_been_killed:
+                    raise
     finally:
-        container_killer.kill()
         if timeout:
             timer.cancel()
+        container_killer.kill()
+        if logs is not None:
+            logs.close(LOG_DRAIN_TIMEOUT)
     if container_killer.exception_on_kill is not None:
         raise container_killer.exception_on_kill
 
@@ -0,0 +1,160 @@
+import re
+import threading
+import time
+
+import pytest
+import redis
+
+from docker_sandboxer.engine import DockerEngineError
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    """
+    Makes schedulers connect to an in-memory redis server, shared by every connection of the test.
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    server = fakeredis.FakeServer()
+
+    def connect(host="localhost", port=6379, db=0, **kwargs):
+        return fakeredis.FakeStrictRedis(server=server, db=db)
+
+    monkeypatch.setattr(redis, "StrictRedis", connect)
+    return server
+
+
+class FakeLogStream(object):
+
+    def __init__(self, frames):
+        self.frames = frames
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def close(self):
+        pass
+
+
+class FakeDockerClient(object):
+    """
+    Containers and networks of a docker daemon, listed with the filters of the engine API.
+    """
+
+    def __init__(self, run_time=0):
+        """
+        :param run_time: Seconds a started container runs unless it is killed.
+        """
+        self.run_time = run_time
+        self.base_url = "unix:///var/run/docker.sock"
+        self.containers = []
+        self.networks = []
+        self.configs = {}  # container id -> config it was created with
+        self.output = {}  # service name -> list of (stream, bytes) it writes
+        self.killed = []
+        self.removed = []
+        self.removed_networks = []
+        self._lock = threading.Lock()
+
+    def add_container(self, name, labels=None, state="running"):
+        container = {"Id": "id-%s" % name, "Names": ["/" + name], "Labels": dict(labels or {}), "State": state}
+        self.containers.append(container)
+        return container["Id"]
+
+    def add_compose_container(self, project, service, state="running"):
+        return self.add_container("%s_%s_1" % (project, service), {
+            "com.docker.compose.project": project, "com.docker.compose.service": service}, state)
+
+    def add_network(self, name, project):
+        self.networks.append({"Id": "net-%s" % name, "Name": name,
+                              "Labels": {"com.docker.compose.project": project}})
+
+    @staticmethod
+    def _matches(item, filters):
+        labels = item.get("Labels") or {}
+        for label in filters.get("label", []):
+            key, _, value = label.partition("=")
+            if key not in labels or (value and labels[key] != value):
+                return False
+        if "name" in filters:
+            if not any(re.search(pattern, name) for pattern in filters["name"] for name in item["Names"]):
+                return False
+        if "status" in filters and item["State"] not in filters["status"]:
+            return False
+        return True
+
+    def list_containers(self, all=True, **filters):
+        return [dict(container) for container in self.containers if self._matches(container, filters) and
+                (all or container["State"] == "running")]
+
+    def list_networks(self, **filters):
+        return [dict(network) for network in self.networks if self._matches(dict(network, Names=[]), filters)]
+
+    def _get(self, container_id):
+        for container in self.containers:
+            if container_id in (container["Id"], container["Names"][0][1:]):
+                return container
+        raise DockerEngineError(404, "No such container: %s" % container_id)
+
+    def create_network(self, name, labels=None):
+        self.networks.append({"Id": "net-%s" % name, "Name": name, "Labels": dict(labels or {})})
+        return "net-%s" % name
+
+    def create_container(self, name, config):
+        with self._lock:
+            if [container for container in self.containers if container["Names"] == ["/" + name]]:
+                raise DockerEngineError(409, "Conflict")
+            container_id = self.add_container(name, config.get("Labels"), state="created")
+            self.configs[container_id] = config
+        return container_id
+
+    def start_container(self, container_id):
+        self._get(container_id)["State"] = "running"
+
+    def rename_container(self, container_id, name):
+        with self._lock:
+            if [container for container in self.containers if container["Names"] == ["/" + name]]:
+                raise DockerEngineError(409, "Conflict")
+            self._get(container_id)["Names"] = ["/" + name]
+
+    def update_container(self, container_id, **resources):
+        self.configs[container_id]["HostConfig"].update(resources)
+
+    def connect_network(self, network_id, container_id, endpoint_config=None):
+        self._get(container_id).setdefault("Networks", {})[network_id] = endpoint_config
+
+    def disconnect_network(self, network_id, container_id, force=False):
+        self._get(container_id).setdefault("Networks", {}).pop(network_id, None)
+
+    def stream_logs(self, container_id, tty=False, follow=True):
+        service = self._get(container_id)["Labels"].get("com.docker.compose.service")
+        return FakeLogStream(self.output.get(service, []))
+
+    def kill_container(self, container_id, signal="SIGKILL"):
+        self.killed.append(container_id)
+        for container in self.containers:
+            if container["Id"] == container_id:
+                container["State"] = "exited"
+
+    def wait_container(self, container_id):
+        container = self._get(container_id)
+        deadline = time.time() + self.run_time
+        while container["State"] == "running" and time.time() < deadline:
+            time.sleep(0.005)
+        if container["State"] == "running":
+            container["State"] = "exited"
+        return 137 if container_id in self.killed else 0
+
+    def remove_container(self, container_id, force=True, volumes=True):
+        container_id = self._get(container_id)["Id"]
+        self.removed.append(container_id)
+        self.containers = [container for container in self.containers if container["Id"] != container_id]
+
+    def remove_network(self, network_id):
+        self.removed_networks.append(network_id)
+        self.networks = [network for network in self.networks if network["Id"] != network_id]
+
+
+@pytest.fixture
+def docker_client():
+    return FakeDockerClient()
@@ -0,0 +1,141 @@
+import asyncio
+import struct
+
+import pytest
+
+from docker_sandboxer import metrics
+from docker_sandboxer.aio import AsyncEngineRunner, AsyncLogStream
+from docker_sandboxer.logs import LogCapture
+
+
+class FakeWriter(object):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def frame(stream, data):
+    return struct.pack(">BxxxL", stream, len(data)) + data
+
+
+async def read_frames(body, headers, tty=False):
+    reader = asyncio.StreamReader()
+    reader.feed_data(body)
+    reader.feed_eof()
+    writer = FakeWriter()
+    frames = [item async for item in AsyncLogStream(reader, writer, headers, tty)]
+    assert writer.closed
+    return frames
+
+
+def test_log_stream_chunked():
+    data = frame(1, b"hello\n") + frame(2, b"oops\n")
+    # Frames split across chunks.
+    body = b"".join(b"%x\r\n%s\r\n" % (len(part), part) for part in (data[:3], data[3:17], data[17:])) + b"0\r\n\r\n"
+    frames = asyncio.run(read_frames(body, {"transfer-encoding": "chunked"}))
+    assert frames == [(1, b"hello\n"), (2, b"oops\n")]
+
+
+def test_log_stream_content_length_and_tty():
+    data = frame(1, b"a") + frame(1, b"b")
+    assert asyncio.run(read_frames(data + b"garbage", {"content-length": str(len(data))})) == [(1, b"a"), (1, b"b")]
+    assert asyncio.run(read_frames(b"raw output", {}, tty=True)) == [(1, b"raw output")]
+
+
+class FakeLogStream(object):
+
+    def __init__(self, client, container_id):
+        self.client = client
+        self.container_id = container_id
+        self.read = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # Writes a chunk every millisecond until the container stops.
+        await asyncio.sleep(0.001)
+        if self.container_id in self.client.stopped:
+            raise StopAsyncIteration
+        self.read += 1
+        return 1, b"line %d\n" % self.read
+
+    def close(self):
+        pass
+
+
+class FakeAsyncClient(object):
+
+    def __init__(self, run_time):
+        self.run_time = run_time
+        self.stopped = set()
+        self.streams = []
+        self.removed = []
+
+    async def create_network(self, name, labels=None):
+        return "net"
+
+    async def create_container(self, name, config):
+        return name
+
+    async def start_container(self, container_id):
+        pass
+
+    async def wait_container(self, container_id):
+        await asyncio.sleep(self.run_time)
+        self.stopped.add(container_id)
+        return 0
+
+    async def stream_logs(self, container_id, tty=False, follow=True):
+        self.streams.append(FakeLogStream(self, container_id))
+        return self.streams[-1]
+
+    async def remove_container(self, container_id, force=True, volumes=True):
+        self.removed.append(container_id)
+
+    async def remove_network(self, network_id):
+        pass
+
+
+def run(client, timeout, logs):
+    runner = AsyncEngineRunner()
+    runner.get_client = lambda docker_host=None: client
+    compose_data = {"server": {"image": "server"}, "client": {"image": "client"}}
+    return asyncio.run(runner.run("match", compose_data, ["server"], timeout, logs=logs))
+
+
+def test_logs_are_streamed_while_managers_run():
+    chunks = []
+    client = FakeAsyncClient(0.1)
+    run(client, None, LogCapture(callback=lambda service, stream, data: chunks.append((service, data))))
+    assert len(client.streams) == 1
+    assert len(chunks) == client.streams[0].read > 10
+    assert chunks[0] == ("server", b"line 1\n")
+    assert sorted(client.removed) == ["match_client_1", "match_server_1"]
+
+
+def test_timed_out_runs_keep_their_logs():
+    logs = LogCapture(callback=lambda service, stream, data: None)
+    client = FakeAsyncClient(60)
+    with pytest.raises(TimeoutError):
+        run(client, 0.1, logs)
+    assert logs.stats()["server"][0] > 0
+    assert sorted(client.removed) == ["match_client_1", "match_server_1"]
+
+
+def test_output_beyond_max_bytes_is_not_read():
+    client = FakeAsyncClient(0.2)
+    logs = LogCapture(callback=lambda service, stream, data: None, max_bytes=30)
+    run(client, None, logs)
+    assert logs.stats() == {"server": (30, True)}
+    # 7 bytes a line: the 5th one is truncated, no line is read after it.
+    assert client.streams[0].read == 5
+
+
+def test_removal_is_not_reported_as_kill_latency(monkeypatch):
+    monkeypatch.setattr(metrics, "enabled", True)
+    cleanups = metrics.CLEANUP_SECONDS.count()
+    run(FakeAsyncClient(0.01), None, LogCapture(callback=lambda service, stream, data: None))
+    assert metrics.CLEANUP_SECONDS.count() == cleanups + 1
+    assert metrics.KILL_SECONDS.count(method="aio") == 0
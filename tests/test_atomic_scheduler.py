@@ -0,0 +1,149 @@
+import pytest
+
+from docker_sandboxer.atomic_scheduler import AtomicCPUScheduler
+
+
+def make_scheduler(cpus=2, **kwargs):
+    kwargs.setdefault("lease_ttl", None)
+    scheduler = AtomicCPUScheduler(**kwargs)
+    scheduler.remove_cpu_stats()
+    scheduler.add_ases_available_cpus(range(cpus))
+    return scheduler
+
+
+def available(scheduler, node="local"):
+    status, waiting = scheduler.get_status()
+    return {cpu: core["available"] for cpu, core in status[node]["cores"].items()}
+
+
+def test_acquire_is_all_or_nothing(redis_server):
+    scheduler = make_scheduler()
+    assert scheduler.try_acquire_cpu("a", [1024, 1024, 1024]) is None
+    assert available(scheduler) == {0: 1024, 1: 1024}
+    assert scheduler.get_leases() == {}
+
+    cpus = scheduler.try_acquire_cpu("b", [1024, 512])
+    assert sorted(cpus) == [0, 1]
+    assert scheduler.try_acquire_cpu("c", [1024]) is None
+    assert sorted(available(scheduler).values()) == [0, 512]
+    assert scheduler.check_consistency() == []
+
+
+def test_shares_are_packed_on_the_fullest_cpu(redis_server):
+    scheduler = make_scheduler()
+    first = scheduler.try_acquire_cpu("a", [512])
+    second = scheduler.try_acquire_cpu("b", [256])
+    assert first == second
+
+
+def test_release_returns_every_share(redis_server):
+    scheduler = make_scheduler()
+    scheduler.try_acquire_cpu("a", [1024, 256])
+    scheduler.try_acquire_cpu("b", [512])
+    scheduler.release_all_cpus("a")
+    assert sorted(available(scheduler).values()) == [512, 1024]
+    assert list(scheduler.get_leases()) == ["b"]
+    scheduler.release_all_cpus("b")
+    assert available(scheduler) == {0: 1024, 1: 1024}
+    assert scheduler.check_consistency() == []
+
+
+def test_memory_is_reserved_with_the_shares(redis_server):
+    scheduler = make_scheduler()
+    scheduler.set_memory(1000)
+    assert scheduler._try_acquire("a", [256], memory=2000) is None
+    reservation = scheduler._try_acquire("a", [256], memory=600)
+    assert reservation is not None
+    assert scheduler.get_status()[0]["local"]["free_memory"] == 400
+    assert scheduler._try_acquire("b", [256], memory=600) is None
+    scheduler.release_all_cpus("a")
+    assert scheduler.get_status()[0]["local"]["free_memory"] == 1000
+
+
+def test_requests_are_backfilled_within_the_window(redis_server):
+    scheduler = make_scheduler(backfill_window=30)
+    scheduler.try_acquire_cpu("a", [1024])
+    # The head of the queue needs both cpus, smaller requests may still run until its window is over.
+    assert scheduler._try_acquire("big", [1024, 1024], ticket="head") is None
+    assert scheduler.get_status()[1] == 1
+    assert scheduler.try_acquire_cpu("small", [512]) is not None
+
+
+def test_head_of_the_queue_blocks_others_after_the_window(redis_server):
+    scheduler = make_scheduler(backfill_window=0)
+    scheduler.try_acquire_cpu("a", [1024])
+    assert scheduler._try_acquire("big", [1024, 1024], ticket="head") is None
+    assert scheduler.try_acquire_cpu("small", [512]) is None
+
+    scheduler.release_all_cpus("a")
+    assert sorted(scheduler._try_acquire("big", [1024, 1024], ticket="head").cpu_numbers) == [0, 1]
+    assert scheduler.get_status()[1] == 0
+
+
+def test_reserve_waits_for_a_release(redis_server):
+    scheduler = make_scheduler(cpus=1, poll_interval=0.05)
+    scheduler.try_acquire_cpu("a", [1024])
+    with pytest.raises(TimeoutError):
+        scheduler.reserve("b", [1024], timeout=0.2)
+    # The ticket of a request which timed out does not block the queue.
+    assert scheduler.get_status()[1] == 0
+    scheduler.release_all_cpus("a")
+    assert scheduler.reserve("b", [1024], timeout=1).cpu_numbers == [0]
+
+
+def test_reserve_rejects_invalid_shares(redis_server):
+    scheduler = make_scheduler(share_granularity=256)
+    with pytest.raises(AssertionError):
+        scheduler.reserve("a", [100])
+
+
+def test_reap_releases_expired_leases(redis_server):
+    scheduler = make_scheduler(lease_ttl=60)
+    scheduler.try_acquire_cpu("a", [1024])
+    expires = scheduler.get_leases()["a"]["expires"]
+    assert expires is not None
+    assert not scheduler.reap("a", grace=0, now=expires - 1)
+    assert scheduler.reap("a", grace=0, now=expires + 1)
+    assert scheduler.get_leases() == {}
+    assert available(scheduler) == {0: 1024, 1: 1024}
+    assert not scheduler.reap("a", grace=0, now=expires + 1)
+
+
+def test_reap_without_lease_uses_the_grace_period(redis_server):
+    scheduler = make_scheduler()
+    scheduler.try_acquire_cpu("a", [512])
+    since = scheduler.get_leases()["a"]["since"]
+    assert scheduler.get_leases()["a"]["expires"] is None
+    assert not scheduler.reap("a", grace=100, now=since + 50)
+    assert scheduler.reap("a", grace=100, now=since + 101)
+    assert available(scheduler) == {0: 1024, 1: 1024}
+
+
+def test_renewed_leases_are_not_reaped(redis_server):
+    scheduler = make_scheduler(lease_ttl=60)
+    scheduler.try_acquire_cpu("a", [1024])
+    expires = scheduler.get_leases()["a"]["expires"]
+    scheduler.lease_ttl = 600
+    assert scheduler.renew_leases(["a", "gone"]) == ["gone"]
+    assert not scheduler.reap("a", grace=0, now=expires + 1)
+
+
+def test_check_consistency_repairs_derived_structures(redis_server):
+    scheduler = make_scheduler()
+    scheduler.try_acquire_cpu("a", [1024, 512])
+    assert scheduler.check_consistency() == []
+
+    connection = scheduler.redis_connection
+    connection.hset(AtomicCPUScheduler.node_free_map, "local", 12345)
+    for key in connection.keys("cpu-scheduler-free:*"):
+        connection.delete(key)
+    connection.delete("cpu-scheduler-user-cpus:a")
+
+    assert scheduler.check_consistency() != []
+    assert scheduler.check_consistency(repair=True) != []
+    assert scheduler.check_consistency() == []
+
+    # The repaired structures are used by later requests.
+    scheduler.release_all_cpus("a")
+    assert available(scheduler) == {0: 1024, 1: 1024}
+    assert sorted(scheduler.try_acquire_cpu("b", [1024, 1024])) == [0, 1]
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+from docker_sandboxer.atomic_scheduler import AtomicCPUScheduler
+from docker_sandboxer.sandboxer import Parser, Sandbox
+
+TEMPLATE = """game:
+    image: game
+    {{ sandbox }}
+    {{ make_manager }}
+"""
+
+
+class FakeRunner(object):
+    """
+    Runs each match for the seconds given by its uid's duration.
+    """
+
+    def __init__(self, durations):
+        self.durations = durations
+        self.started = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def run(self, project_name, compose_data, manager_services, timeout, docker_host=None):
+        with self._lock:
+            self.started.append(project_name)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.durations.get(project_name, 0.05))
+        with self._lock:
+            self.running -= 1
+
+
+@pytest.fixture
+def make_parser(redis_server, tmp_path):
+    with open(str(tmp_path / "match.yml"), "w") as f:
+        f.write(TEMPLATE)
+
+    def make_parser(durations=None, cpus=2, memory=None):
+        scheduler = AtomicCPUScheduler(lease_ttl=None)
+        scheduler.remove_cpu_stats()
+        scheduler.add_ases_available_cpus(range(cpus))
+        if memory is not None:
+            scheduler.set_memory(memory)
+        return Parser(scheduler, str(tmp_path), None, runner=FakeRunner(durations or {}))
+    return make_parser
+
+
+def job(uid, cpu, memory=0):
+    return uid, "match.yml", {"sandbox": Sandbox(cpu=cpu, memory=memory, swap=0)}
+
+
+def run_batch(parser, jobs, **kwargs):
+    kwargs.setdefault("poll_interval", 0.01)
+    return {result.uid: result for result in parser.run_batch(jobs, **kwargs)}
+
+
+def test_every_job_runs(make_parser):
+    parser = make_parser()
+    results = run_batch(parser, [job("match%d" % index, [512]) for index in range(6)], max_workers=3)
+    assert sorted(results) == ["match%d" % index for index in range(6)]
+    assert all(result.ok and result.reserved is not None for result in results.values())
+    assert parser.runner.max_running <= 3
+    assert parser.cpu_scheduler.get_leases() == {}
+
+
+def test_small_jobs_backfill_within_the_window(make_parser):
+    parser = make_parser({"long": 0.3})
+    run_batch(parser, [job("long", [1024]), job("wide", [1024, 1024]), job("small", [1024])], backfill_window=30)
+    assert parser.runner.started == ["long", "small", "wide"]
+
+
+def test_oldest_job_is_not_overtaken_after_the_window(make_parser):
+    parser = make_parser({"long": 0.3})
+    run_batch(parser, [job("long", [1024]), job("wide", [1024, 1024]), job("small", [1024])], backfill_window=0)
+    assert parser.runner.started == ["long", "wide", "small"]
+
+
+def test_memory_is_admitted_with_the_shares(make_parser):
+    parser = make_parser({"first": 0.2}, cpus=4, memory=1000)
+    run_batch(parser, [job("first", [256], memory=600), job("second", [256], memory=600)])
+    assert parser.runner.started == ["first", "second"]
+    assert parser.runner.max_running == 1
+
+
+def test_jobs_which_never_fit_fail_right_away(make_parser):
+    parser = make_parser(cpus=2, memory=1000)
+    start = time.time()
+    results = run_batch(parser, [job("three", [1024, 1024, 1024]), job("huge", [256], memory=5000),
+                                 ("broken", "missing.yml", {}), job("ok", [1024])], backfill_window=0)
+    assert time.time() - start < 5
+    assert isinstance(results["three"].error, AssertionError)
+    assert isinstance(results["huge"].error, AssertionError)
+    assert results["broken"].error is not None
+    assert results["ok"].ok
+    assert parser.runner.started == ["ok"]
+
+
+def test_run_batch_needs_a_scheduler_which_knows_its_capacity(make_parser):
+    parser = make_parser()
+    parser.cpu_scheduler = object()
+    with pytest.raises(AssertionError):
+        list(parser.run_batch([]))
@@ -0,0 +1,140 @@
+import time
+
+import pytest
+
+from docker_sandboxer.engine import EngineRunner, compose_project_names, container_config, project_containers, \
+    project_networks
+from docker_sandboxer.logs import LogCapture
+from docker_sandboxer.teardown import Teardown
+
+
+def test_compose_project_names():
+    assert compose_project_names("Match-42") == ["Match-42", "match-42", "match42"]
+    assert compose_project_names("game_7") == ["game7", "game_7"]
+    assert compose_project_names("match42") == ["match42"]
+
+
+@pytest.mark.parametrize("uid, label", [
+    ("Match-42", "match-42"),  # docker-compose 1.21 and later
+    ("Match-42", "match42"),  # older docker-compose
+    ("Game_7", "game_7"),
+    ("Game_7", "game7"),
+    ("Game_7", "Game_7"),  # EngineRunner
+    ("match-42", "match-42"),
+])
+def test_project_containers_under_every_label_form(docker_client, uid, label):
+    server = docker_client.add_compose_container(label, "server")
+    client = docker_client.add_compose_container(label, "client", state="exited")
+    docker_client.add_compose_container("other", "server")
+    assert sorted(container["Id"] for container in project_containers(docker_client, uid)) == sorted([server, client])
+
+
+def test_project_containers_by_name(docker_client):
+    # Containers of a warm pool are renamed to the project's names but keep their pool labels.
+    pooled = docker_client.add_container("match-42_server_1", {"com.docker.compose.service": "server"})
+    docker_client.add_container("match-42_client_x", {"com.docker.compose.service": "client"})
+    docker_client.add_compose_container("match-42_x", "server")
+    docker_client.add_container("match-42_x_server_1", {"com.docker.compose.service": "server"})
+    assert [container["Id"] for container in project_containers(docker_client, "Match-42")] == [pooled]
+
+
+def test_project_networks(docker_client):
+    docker_client.add_network("match-42_default", "match-42")
+    docker_client.add_network("Match-42_default", "Match-42")
+    docker_client.add_network("match-43_default", "match-43")
+    assert sorted(network["Name"] for network in project_networks(docker_client, "Match-42")) == \
+        ["Match-42_default", "match-42_default"]
+
+
+def test_container_config():
+    name, config = container_config("match", "client", {
+        "image": "client:latest",
+        "command": "run --team 'red team'",
+        "environment": {"TEAM": 1, "EMPTY": None},
+        "volumes": ["/srv/maps:/maps:ro"],
+        "mem_limit": 1 << 30,
+        "memswap_limit": 1 << 30,
+        "cpuset": "2,3",
+        "ulimits": {"nproc": 100, "nofile": {"soft": 10, "hard": 20}},
+        "ports": ["8080", "127.0.0.1:9000:9000/udp"],
+        "links": ["server:game", "db"],
+        "depends_on": ["server"],
+        "restart": "no",
+        "labels": {"team": "red"},
+    }, "match_default")
+    assert name == "match_client_1"
+    assert config["Image"] == "client:latest"
+    assert config["Cmd"] == ["run", "--team", "red team"]
+    assert sorted(config["Env"]) == ["EMPTY=", "TEAM=1"]
+    assert config["Labels"] == {"team": "red", "com.docker.compose.project": "match",
+                                "com.docker.compose.service": "client"}
+    assert config["ExposedPorts"] == {"8080/tcp": {}, "9000/udp": {}}
+    host_config = config["HostConfig"]
+    assert host_config["Binds"] == ["/srv/maps:/maps:ro"]
+    assert host_config["Memory"] == host_config["MemorySwap"] == 1 << 30
+    assert host_config["CpusetCpus"] == "2,3"
+    assert sorted(host_config["Ulimits"], key=lambda ulimit: ulimit["Name"]) == [
+        {"Name": "nofile", "Soft": 10, "Hard": 20}, {"Name": "nproc", "Soft": 100, "Hard": 100}]
+    assert host_config["PortBindings"] == {"9000/udp": [{"HostIp": "127.0.0.1", "HostPort": "9000"}]}
+    assert host_config["RestartPolicy"] == {"Name": "no"}
+    assert host_config["NetworkMode"] == "match_default"
+    endpoint = config["NetworkingConfig"]["EndpointsConfig"]["match_default"]
+    # The client resolves game to the server, others resolve client to the client.
+    assert endpoint["Aliases"] == ["client"]
+    assert endpoint["Links"] == ["match_server_1:game", "match_db_1:db"]
+
+
+def test_container_config_network_mode():
+    name, config = container_config("match", "server", {"image": "server", "network_mode": "host"}, "match_default")
+    assert config["HostConfig"]["NetworkMode"] == "host"
+    assert "NetworkingConfig" not in config
+
+
+def test_container_config_rejects_unsupported_keys():
+    with pytest.raises(AssertionError) as error:
+        container_config("match", "server", {"image": "server", "build": ".", "extends": "base"}, "match_default")
+    assert "build, extends" in str(error.value)
+
+
+COMPOSE_DATA = {
+    "server": {"image": "server", "command": "run-server", "cpuset": "0"},
+    "client": {"image": "client", "links": ["server:game"], "cpuset": "1"},
+}
+
+
+def run(docker_client, timeout=None, pool=None, project_name="Match-42"):
+    runner = EngineRunner(pool=pool, teardown=Teardown())
+    runner.get_client = lambda docker_host=None: docker_client
+    chunks = []
+    logs = LogCapture(callback=lambda service, stream, data: chunks.append((service, data)))
+    try:
+        runner.run(project_name, COMPOSE_DATA, ["server"], timeout, logs=logs)
+    finally:
+        assert runner.teardown.wait(5)
+    return chunks
+
+
+def test_engine_runner(docker_client):
+    docker_client.output["server"] = [(1, b"game finished\n")]
+    assert run(docker_client) == [("server", b"game finished\n")]
+    assert sorted(docker_client.removed) == ["id-Match-42_client_1", "id-Match-42_server_1"]
+    assert sorted(docker_client.killed) == ["id-Match-42_client_1", "id-Match-42_server_1"]
+    assert docker_client.removed_networks == ["net-Match-42_default"]
+    config = docker_client.configs["id-Match-42_client_1"]
+    assert config["NetworkingConfig"]["EndpointsConfig"]["Match-42_default"]["Links"] == ["Match-42_server_1:game"]
+
+
+def test_engine_runner_timeout(docker_client):
+    docker_client.run_time = 60
+    start = time.time()
+    with pytest.raises(TimeoutError):
+        run(docker_client, timeout=0.1)
+    assert time.time() - start < 5
+    assert docker_client.containers == [] and docker_client.networks == []
+
+
+def test_engine_runner_replaces_leftover_containers(docker_client):
+    docker_client.add_compose_container("Match-42", "server", state="exited")
+    run(docker_client)
+    assert docker_client.removed[0] == "id-Match-42_server_1"
+    assert docker_client.containers == []
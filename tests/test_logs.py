@@ -0,0 +1,119 @@
+import gzip
+import threading
+import time
+
+from docker_sandboxer.logs import LogCapture
+
+
+class FakeLogStream(object):
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = threading.Event()
+        self.read = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            if self.closed.is_set():
+                return
+            self.read += 1
+            yield chunk
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeClient(object):
+
+    def __init__(self, streams):
+        self.streams = streams
+
+    def stream_logs(self, container_id, tty=False):
+        return self.streams[container_id]
+
+
+def test_output_is_truncated_after_max_bytes():
+    chunks = []
+    capture = LogCapture(callback=lambda service, stream, data: chunks.append((service, stream, data)),
+                         max_bytes=10)
+    assert capture.feed("server", 1, b"12345")
+    assert not capture.feed("server", 1, b"6789abcdef")
+    assert not capture.feed("server", 2, b"more")
+    assert capture.feed("client", 1, b"abc")
+    assert capture.close() == {"server": (10, True), "client": (3, False)}
+
+    server = [(stream, data) for service, stream, data in chunks if service == "server"]
+    assert server[:2] == [(1, b"12345"), (1, b"6789a")]
+    assert server[2][0] == 2 and b"truncated after 10 bytes" in server[2][1]
+    assert len(server) == 3
+
+
+def test_chunk_ending_exactly_at_max_bytes_is_not_truncated():
+    capture = LogCapture(callback=lambda service, stream, data: None, max_bytes=4)
+    assert capture.feed("server", 1, b"1234")
+    assert not capture.feed("server", 1, b"5")
+    assert capture.close() == {"server": (4, True)}
+
+
+def test_truncated_containers_are_not_read_anymore():
+    stream = FakeLogStream([(1, b"x" * 4)] * 100)
+    capture = LogCapture(callback=lambda service, stream, data: None, max_bytes=10)
+    capture.attach(FakeClient({"c1": stream}), "server", "c1")
+    assert capture.close(timeout=5) == {"server": (10, True)}
+    assert stream.closed.is_set()
+    assert stream.read == 3
+
+
+def test_chunks_without_sink():
+    capture = LogCapture(max_bytes=3)
+    capture.feed("server", 1, b"abcdef")
+    capture.close()
+    chunks = list(capture.chunks())
+    assert chunks[0] == ("server", 1, b"abc")
+    assert chunks[1][1] == 2
+
+
+def test_file_lines_are_prefixed(tmp_path):
+    path = str(tmp_path / "match.log.gz")
+    capture = LogCapture(path=path)
+    capture.feed("server", 1, b"hello\nwor")
+    capture.feed("client", 2, b"oops\n")
+    capture.feed("server", 1, b"ld\nlast")
+    capture.close()
+    with gzip.open(path, "rb") as f:
+        lines = f.read().splitlines()
+    assert lines == [b"server | hello", b"client | oops", b"server | world", b"server | last"]
+
+
+def close_in_thread(capture, timeout=None):
+    result = []
+    closer = threading.Thread(target=lambda: result.append(capture.close(timeout)), daemon=True)
+    closer.start()
+    closer.join(5)
+    assert not closer.is_alive(), "close is stuck"
+    return result[0]
+
+
+def test_close_does_not_hang_on_a_full_queue_without_consumer():
+    stream = FakeLogStream([(1, b"x")] * 100)
+    capture = LogCapture(queue_size=4)
+    capture.attach(FakeClient({"c1": stream}), "server", "c1")
+    deadline = time.time() + 5
+    while capture._queue.qsize() < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    close_in_thread(capture)
+    assert stream.closed.is_set()
+    # Queued chunks are kept, but for the one replaced by the end marker.
+    assert len(list(capture.chunks())) == 3
+
+
+def test_close_with_a_full_queue_and_a_waiting_feed():
+    capture = LogCapture(queue_size=2)
+    capture.feed("server", 1, b"1")
+    capture.feed("server", 1, b"2")
+    results = []
+    feeder = threading.Thread(target=lambda: results.append(capture.feed("server", 1, b"3")), daemon=True)
+    feeder.start()
+    close_in_thread(capture, timeout=0.2)
+    feeder.join(5)
+    assert results == [False]
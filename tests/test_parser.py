@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from docker_sandboxer import metrics
+from docker_sandboxer.sandboxer import Parser, Sandbox
+from docker_sandboxer.scheduler import CPUReservation
+
+TEMPLATE = """server:
+    image: server
+    environment:
+        LOG_DIR: {{ log_dir }}
+    {{ server_sandbox }}
+    {{ make_manager }}
+client:
+    image: client
+    {{ client_sandbox }}
+"""
+
+
+class FakeScheduler(object):
+
+    def __init__(self):
+        self.released = []
+
+    def reserve(self, user, cpu_shares, timeout=None, priority=0, memory=0):
+        return CPUReservation(self, user, cpu_shares, list(range(len(cpu_shares))), memory=memory)
+
+    def release_all_cpus(self, user):
+        self.released.append(user)
+
+
+class FakeRunner(object):
+
+    def __init__(self):
+        self.runs = []
+
+    def run(self, project_name, compose_data, manager_services, timeout, docker_host=None):
+        self.runs.append((project_name, compose_data, manager_services))
+
+
+@pytest.fixture
+def templates(tmp_path):
+    with open(str(tmp_path / "match.yml"), "w") as f:
+        f.write(TEMPLATE)
+    return str(tmp_path)
+
+
+def context(log_dir="logs", server_cpu=1024):
+    return {"log_dir": log_dir, "server_sandbox": Sandbox(cpu=[server_cpu], memory=100),
+            "client_sandbox": Sandbox(cpu=[512], memory=50)}
+
+
+def test_run(templates):
+    scheduler, runner = FakeScheduler(), FakeRunner()
+    Parser(scheduler, templates, None, runner=runner).create_yml_and_run("match", "match.yml", context())
+    (project_name, compose_data, managers), = runner.runs
+    assert project_name == "match" and managers == ["server"]
+    assert compose_data["server"]["environment"] == {"LOG_DIR": "logs"}
+    assert compose_data["server"]["cpuset"] == "0" and compose_data["client"]["cpuset"] == "1"
+    assert compose_data["server"]["mem_limit"] == 100
+    assert "manager" not in compose_data["server"]
+    assert scheduler.released == ["match"]
+
+
+def test_identical_renderings_hit_the_cache(templates, monkeypatch):
+    monkeypatch.setattr(metrics, "enabled", True)
+    hits, misses = metrics.TEMPLATE_CACHE.value(result="hit"), metrics.TEMPLATE_CACHE.value(result="miss")
+    runner = FakeRunner()
+    parser = Parser(FakeScheduler(), templates, None, runner=runner)
+    parser.create_yml_and_run("match1", "match.yml", context())
+    # Other sandbox limits render the same text.
+    parser.create_yml_and_run("match2", "match.yml", context(server_cpu=512))
+    # Any other context value renders another text.
+    parser.create_yml_and_run("match3", "match.yml", context(log_dir="logs/match3"))
+    assert metrics.TEMPLATE_CACHE.value(result="hit") - hits == 1
+    assert metrics.TEMPLATE_CACHE.value(result="miss") - misses == 2
+    # Cached data is never shared between runs.
+    assert runner.runs[0][1]["server"]["cpuset"] == "0"
+    assert runner.runs[0][1]["server"] is not runner.runs[1][1]["server"]
+    assert runner.runs[2][1]["server"]["environment"] == {"LOG_DIR": "logs/match3"}
+
+
+def test_cache_is_dropped_when_the_template_changes(templates):
+    runner = FakeRunner()
+    parser = Parser(FakeScheduler(), templates, None, runner=runner)
+    parser.create_yml_and_run("match1", "match.yml", context())
+    path = os.path.join(templates, "match.yml")
+    with open(path, "w") as f:
+        f.write(TEMPLATE.replace("image: client", "image: client-v2"))
+    os.utime(path, (os.path.getmtime(path) + 10,) * 2)
+    parser.create_yml_and_run("match2", "match.yml", context())
+    assert runner.runs[1][1]["client"]["image"] == "client-v2"
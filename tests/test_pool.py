@@ -0,0 +1,97 @@
+import time
+
+from docker_sandboxer.engine import EngineRunner, container_config
+from docker_sandboxer.pool import ContainerPool
+from docker_sandboxer.teardown import Teardown
+
+
+def config(project="match", service="server", cpuset="0", image="server"):
+    return container_config(project, service, {"image": image, "cpuset": cpuset}, "%s_default" % project)[1]
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_claim_takes_a_warm_container_and_prepares_it(docker_client):
+    pool = ContainerPool(size=2)
+    pool.warm(docker_client, config(project="warm"))
+    assert pool.stats()["size"] == 2
+    assert all(container["Names"][0].startswith("/" + ContainerPool.name_prefix)
+               for container in docker_client.containers)
+
+    container_id = pool.claim(docker_client, "match_server_1", config(cpuset="3"))
+    assert container_id is not None
+    container = [c for c in docker_client.containers if c["Id"] == container_id][0]
+    assert container["Names"] == ["/match_server_1"]
+    assert docker_client.configs[container_id]["HostConfig"]["CpusetCpus"] == "3"
+    assert list(container["Networks"]) == ["match_default"]
+    assert pool.stats()["hits"] == 1 and pool.stats()["size"] == 1
+    pool.close()
+
+
+def test_claim_misses_configs_which_differ(docker_client):
+    pool = ContainerPool(size=1)
+    pool.warm(docker_client, config())
+    assert pool.claim(docker_client, "match_server_1", config(image="server:v2")) is None
+    assert pool.stats()["misses"] == 1 and pool.stats()["keys"] == 2
+    pool.close()
+
+
+def test_claimed_containers_are_refilled_in_the_background(docker_client):
+    pool = ContainerPool(size=2, refill_interval=0.01)
+    pool.start()
+    assert pool.claim(docker_client, "match_server_1", config()) is None
+    # The key is learned on its first miss.
+    assert wait_until(lambda: pool.stats()["size"] == 2)
+    assert pool.claim(docker_client, "match2_server_1", config(project="match2")) is not None
+    assert wait_until(lambda: pool.stats()["size"] == 2)
+    pool.close()
+    assert [container["Names"] for container in docker_client.containers] == [["/match2_server_1"]]
+
+
+def test_idle_and_least_recently_used_keys_are_evicted(docker_client):
+    pool = ContainerPool(size=2, max_containers=3, idle_timeout=60)
+    pool.warm(docker_client, config(image="old"))
+    pool.warm(docker_client, config(image="new"))
+    old, new = [entry for entry in pool._entries.values()]
+    assert (len(old.containers), len(new.containers)) == (2, 1)
+    # The most recently used key is filled first.
+    pool.refill()
+    assert wait_until(lambda: (len(old.containers), len(new.containers)) == (1, 2))
+    assert pool.stats()["evictions"] == 1
+    # Keys not claimed for idle_timeout seconds are dropped.
+    old.last_used -= 120
+    pool.refill()
+    assert pool.stats()["keys"] == 1 and pool.stats()["size"] == 2
+    assert pool.stats()["evictions"] == 2
+    pool.close()
+    assert docker_client.containers == []
+
+
+def test_remove_leftovers_keeps_claimed_containers(docker_client):
+    pool = ContainerPool(size=2)
+    pool.warm(docker_client, config())
+    claimed = pool.claim(docker_client, "match_server_1", config())
+    docker_client.add_container(ContainerPool.name_prefix + "started", {ContainerPool.label: "x"})
+    docker_client.add_container(ContainerPool.name_prefix + "foreign")
+    ContainerPool.remove_leftovers(docker_client)
+    assert sorted(container["Id"] for container in docker_client.containers) == sorted([
+        claimed, "id-%sstarted" % ContainerPool.name_prefix, "id-%sforeign" % ContainerPool.name_prefix])
+
+
+def test_engine_runner_runs_warm_containers(docker_client):
+    pool = ContainerPool(size=1)
+    runner = EngineRunner(pool=pool, teardown=Teardown())
+    runner.get_client = lambda docker_host=None: docker_client
+    compose_data = {"server": {"image": "server", "cpuset": "0"}, "client": {"image": "client", "cpuset": "1"}}
+    runner.warm(compose_data)
+    runner.run("match", dict(compose_data, client={"image": "client", "cpuset": "2"}), ["server"], None,
+               logs=None)
+    assert pool.stats()["hits"] == 2
+    assert runner.teardown.wait(5)
+    assert docker_client.containers == []
+    pool.close()
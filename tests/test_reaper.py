@@ -0,0 +1,46 @@
+from docker_sandboxer.atomic_scheduler import AtomicCPUScheduler
+from docker_sandboxer.reaper import Reaper
+
+
+def make_reaper(docker_client, lease_ttl=None):
+    scheduler = AtomicCPUScheduler(lease_ttl=lease_ttl)
+    scheduler.remove_cpu_stats()
+    scheduler.add_ases_available_cpus(range(2))
+    reaper = Reaper(scheduler, grace=100)
+    reaper._get_client = lambda docker_host: docker_client
+    return scheduler, reaper
+
+
+def test_running_matches_are_not_reaped(redis_server, docker_client):
+    scheduler, reaper = make_reaper(docker_client)
+    scheduler.try_acquire_cpu("Match-42", [1024])
+    # docker-compose 1.21 and later label the project match-42.
+    docker_client.add_compose_container("match-42", "server")
+    since = scheduler.get_leases()["Match-42"]["since"]
+    assert reaper.reap_once(now=since + 50) == []
+    assert reaper.reap_once(now=since + 200) == []
+    assert list(scheduler.get_leases()) == ["Match-42"]
+
+
+def test_stopped_matches_are_reaped_after_the_grace_period(redis_server, docker_client):
+    scheduler, reaper = make_reaper(docker_client)
+    scheduler.try_acquire_cpu("Match-42", [1024])
+    docker_client.add_compose_container("match-42", "server", state="exited")
+    since = scheduler.get_leases()["Match-42"]["since"]
+    assert [user for user, reason in reaper.reap_once(now=since + 200)] == ["Match-42"]
+    assert scheduler.get_leases() == {}
+    # Containers of reservations without a lease are left alone.
+    assert docker_client.removed == []
+
+
+def test_containers_of_expired_leases_are_removed(redis_server, docker_client):
+    scheduler, reaper = make_reaper(docker_client, lease_ttl=60)
+    scheduler.try_acquire_cpu("Match-42", [1024])
+    server = docker_client.add_compose_container("match-42", "server")
+    other = docker_client.add_compose_container("match-43", "server")
+    expires = scheduler.get_leases()["Match-42"]["expires"]
+    assert reaper.reap_once(now=expires - 1) == []
+    reaped = reaper.reap_once(now=expires + 1)
+    assert reaped == [("Match-42", "lease expired 1 seconds ago, removed 1 containers")]
+    assert docker_client.removed == [server]
+    assert [container["Id"] for container in docker_client.containers] == [other]
@@ -0,0 +1,106 @@
+import pickle
+
+import pytest
+
+from docker_sandboxer.sandboxer import FrozenSandbox, Sandbox
+
+
+def test_default_docker_limits():
+    limits = Sandbox().get_docker_limits()
+    assert "cpu" not in limits
+    assert limits["mem_limit"] == 1024 * 1024 * 1024
+    assert limits["memswap_limit"] == 1024 * 1024 * 1024
+    assert limits["ulimits"] == {"nproc": 20000, "nofile": {"soft": 20000, "hard": 20000}}
+
+
+def test_limits_are_validated():
+    assert Sandbox(cpu=512).get_limit("cpu") == [512]
+    assert Sandbox(cpu=(256, 512)).get_limit("cpu") == [256, 512]
+    for limits in ({"cpu": 2048}, {"cpu": "1024"}, {"memory": 1.5}, {"swap": "0"}):
+        with pytest.raises(AssertionError):
+            Sandbox(**limits)
+
+
+def test_update_limits_refreshes_docker_limits():
+    sandbox = Sandbox(memory=100, swap=50)
+    assert sandbox.get_docker_limits()["memswap_limit"] == 150
+    sandbox.update_limits(memory=200, processes_limit=None)
+    limits = sandbox.get_docker_limits()
+    assert limits["memswap_limit"] == 250
+    assert "nproc" not in limits["ulimits"]
+
+
+def test_docker_limits_are_copies():
+    sandbox = Sandbox(ulimits={"core": 0})
+    limits = sandbox.get_docker_limits()
+    limits["ulimits"]["nofile"]["soft"] = 1
+    limits["mem_limit"] = 1
+    assert sandbox.get_docker_limits()["ulimits"]["nofile"]["soft"] == 20000
+    assert sandbox.get_docker_limits()["mem_limit"] == 1024 * 1024 * 1024
+    assert sandbox.get_limit("ulimits") == {"core": 0}
+
+
+def test_with_limits_and_copy_do_not_change_the_original():
+    sandbox = Sandbox(cpu=[512], ulimits={"core": 0})
+    derived = sandbox.with_limits(memory=100)
+    copied = sandbox.copy()
+    copied.update_limits(cpu=[256])
+    derived.get_limit("cpu").append(1024)
+    derived.get_limit("ulimits")["core"] = 1
+    copied.get_limit("ulimits")["core"] = 2
+    assert derived.get_limit("memory") == 100
+    assert derived.get_limit("cpu") == [512, 1024]
+    assert sandbox.get_limit("memory") == 1024 * 1024 * 1024
+    assert sandbox.get_limit("cpu") == [512]
+    assert sandbox.get_limit("ulimits") == {"core": 0}
+
+
+def test_frozen_sandbox_can_not_be_changed():
+    sandbox = FrozenSandbox(cpu=[512, 256], ulimits={"core": 0})
+    with pytest.raises(AssertionError):
+        sandbox.update_limits(memory=100)
+    with pytest.raises(AssertionError):
+        sandbox.limits = {}
+    with pytest.raises(AssertionError):
+        del sandbox.limits
+    with pytest.raises(TypeError):
+        sandbox.limits["memory"] = 100
+    with pytest.raises((TypeError, AttributeError)):
+        sandbox.limits["cpu"].append(1024)
+    with pytest.raises(TypeError):
+        sandbox.limits["ulimits"]["core"] = 1
+    sandbox.get_all_limits()["cpu"].append(1024)
+    sandbox.get_docker_limits()["ulimits"]["nofile"]["soft"] = 1
+    assert sandbox.get_limit("cpu") == (512, 256)
+    assert sandbox.get_docker_limits()["ulimits"]["nofile"]["soft"] == 20000
+
+
+def test_frozen_sandbox_does_not_share_limits_with_its_source():
+    source = Sandbox(cpu=[512])
+    frozen = source.freeze()
+    source.update_limits(cpu=[256], memory=100)
+    assert frozen.get_limit("cpu") == (512,)
+    assert frozen.get_docker_limits()["mem_limit"] == 1024 * 1024 * 1024
+
+
+def test_frozen_sandbox_with_limits():
+    sandbox = FrozenSandbox(cpu=512)
+    derived = sandbox.with_limits(cpu=[256, 256], memory=100)
+    assert isinstance(derived, FrozenSandbox)
+    assert derived.get_limit("cpu") == (256, 256)
+    assert derived.get_docker_limits()["mem_limit"] == 100
+    assert sandbox.get_limit("cpu") == (512,)
+    with pytest.raises(AssertionError):
+        sandbox.with_limits(cpu=4096)
+    assert sandbox.copy() is sandbox
+    assert sandbox.freeze() is sandbox
+
+
+def test_frozen_sandbox_pickles():
+    sandbox = FrozenSandbox(cpu=[512], ulimits={"core": 0})
+    restored = pickle.loads(pickle.dumps(sandbox))
+    assert isinstance(restored, FrozenSandbox)
+    assert restored.get_all_limits() == sandbox.get_all_limits()
+    assert restored.get_docker_limits() == sandbox.get_docker_limits()
+    with pytest.raises(AssertionError):
+        restored.update_limits(memory=100)
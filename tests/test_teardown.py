@@ -0,0 +1,78 @@
+import threading
+import time
+
+from docker_sandboxer.engine import DockerEngineError
+from docker_sandboxer.teardown import Teardown
+
+
+def test_kill_waits_for_every_container(docker_client):
+    docker_client.run_time = 60
+    container_ids = [docker_client.add_compose_container("match", service) for service in ("server", "a", "b")]
+    teardown = Teardown()
+    assert teardown.kill(docker_client, container_ids) < 5
+    assert sorted(docker_client.killed) == sorted(container_ids)
+    assert all(container["State"] == "exited" for container in docker_client.containers)
+    assert teardown.stats()["kills"] == 1
+
+
+def test_kill_ignores_stopped_and_removed_containers(docker_client):
+    stopped = docker_client.add_compose_container("match", "server", state="exited")
+    original_kill = docker_client.kill_container
+
+    def kill_container(container_id, signal="SIGKILL"):
+        if container_id == "gone":
+            raise DockerEngineError(404, "No such container")
+        original_kill(container_id, signal)
+        raise DockerEngineError(409, "Container is not running")
+
+    docker_client.kill_container = kill_container
+    docker_client.wait_container = lambda container_id: 0
+    Teardown().kill(docker_client, [stopped])
+    assert docker_client.killed == [stopped]
+
+
+def test_containers_and_networks_are_removed_in_the_background(docker_client):
+    docker_client.add_network("match_default", "match")
+    container_ids = [docker_client.add_compose_container("match", service) for service in ("server", "client")]
+    removing = threading.Event()
+    original_remove = docker_client.remove_container
+
+    def remove_container(container_id, force=True, volumes=True):
+        removing.wait(5)
+        original_remove(container_id, force, volumes)
+
+    docker_client.remove_container = remove_container
+    teardown = Teardown()
+    teardown.remove_later(docker_client, container_ids, ["net-match_default"])
+    assert teardown.stats()["pending"] == 1
+    removing.set()
+    assert teardown.wait(5)
+    assert docker_client.containers == [] and docker_client.networks == []
+    assert teardown.stats()["removed"] == 3 and teardown.stats()["failed"] == 0
+
+
+def test_removal_failures_are_counted_and_cleaners_survive(docker_client):
+    container_id = docker_client.add_compose_container("match", "server")
+    failures = [DockerEngineError(404, "No such container"), DockerEngineError(500, "Driver failed"),
+                ValueError("Malformed response")]
+
+    def remove_container(container_id, force=True, volumes=True):
+        raise failures.pop(0)
+
+    docker_client.remove_container = remove_container
+    teardown = Teardown(cleaner_threads=1)
+    for i in range(3):
+        teardown.remove_later(docker_client, [container_id])
+    assert teardown.wait(5)
+    # A container someone else removed counts as removed.
+    assert teardown.stats()["removed"] == 1 and teardown.stats()["failed"] == 2
+    assert all(cleaner.is_alive() for cleaner in teardown._cleaners)
+
+
+def test_wait_times_out(docker_client):
+    container_id = docker_client.add_compose_container("match", "server")
+    docker_client.remove_container = lambda container_id, force=True, volumes=True: time.sleep(0.5)
+    teardown = Teardown()
+    teardown.remove_later(docker_client, [container_id])
+    assert not teardown.wait(0.05)
+    assert teardown.wait(5)
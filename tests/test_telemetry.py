@@ -0,0 +1,112 @@
+import os
+import time
+
+from docker_sandboxer import telemetry
+from docker_sandboxer.telemetry import CgroupSampler
+
+
+def write_cgroup(path, usage_usec, memory, memory_peak=None, rbytes=0, wbytes=0):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "cpu.stat"), "w") as f:
+        f.write("usage_usec %d\nuser_usec %d\nsystem_usec 0\nthrottled_usec 250\n" % (usage_usec, usage_usec))
+    with open(os.path.join(path, "memory.current"), "w") as f:
+        f.write("%d\n" % memory)
+    if memory_peak is not None:
+        with open(os.path.join(path, "memory.peak"), "w") as f:
+            f.write("%d\n" % memory_peak)
+    with open(os.path.join(path, "io.stat"), "w") as f:
+        f.write("8:0 rbytes=%d wbytes=%d rios=1 wios=1\n" % (rbytes, wbytes))
+        f.write("8:16 rbytes=%d wbytes=%d rios=1 wios=1\n" % (rbytes, wbytes))
+
+
+def test_cgroup_path_supports_both_drivers(tmp_path):
+    os.makedirs(str(tmp_path / "system.slice" / "docker-aaa.scope"))
+    os.makedirs(str(tmp_path / "docker" / "bbb"))
+    sampler = CgroupSampler(cgroup_root=str(tmp_path))
+    assert sampler.cgroup_path("aaa") == str(tmp_path / "system.slice" / "docker-aaa.scope")
+    assert sampler.cgroup_path("bbb") == str(tmp_path / "docker" / "bbb")
+    assert sampler.cgroup_path("ccc") is None
+
+
+def test_read(tmp_path):
+    path = str(tmp_path / "docker" / "aaa")
+    write_cgroup(path, 1500, 4096, memory_peak=8192, rbytes=10, wbytes=20)
+    values = CgroupSampler(cgroup_root=str(tmp_path)).read(path)
+    assert values == {"cpu_usec": 1500, "throttled_usec": 250, "memory": 4096, "memory_peak": 8192,
+                      "io_read": 20, "io_write": 40}
+
+
+def test_read_without_memory_peak_or_cgroup(tmp_path):
+    path = str(tmp_path / "docker" / "aaa")
+    write_cgroup(path, 0, 4096)
+    sampler = CgroupSampler(cgroup_root=str(tmp_path))
+    assert sampler.read(path)["memory_peak"] is None
+    assert sampler.read(str(tmp_path / "docker" / "gone")) is None
+
+
+def test_recording(tmp_path):
+    server = str(tmp_path / "system.slice" / "docker-aaa.scope")
+    client = str(tmp_path / "docker" / "bbb")
+    write_cgroup(server, 0, 1000)
+    write_cgroup(client, 0, 3000, memory_peak=5000)
+    calls = []
+
+    def find_containers(project_name, docker_host):
+        calls.append((project_name, docker_host))
+        return {"server": "aaa", "client": "bbb", "missing": "ccc"}
+
+    sampler = CgroupSampler(interval=3600, cgroup_root=str(tmp_path), find_containers=find_containers)
+    recording = sampler.start("match")
+    # The first sample is taken right away, the others are taken by hand.
+    deadline = time.time() + 5
+    while len(recording.series) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    recording.started_at -= 1
+    write_cgroup(server, 500000, 3000, rbytes=7)
+    recording.sample()
+    result = recording.stop()
+
+    assert calls == [("match", None)]
+    assert sorted(result["series"]) == ["client", "server"]
+    assert result["series"]["server"]["cpu_usec"] == [0, 500000]
+    summary = result["summary"]["server"]
+    assert summary["samples"] == 2
+    assert summary["cpu_seconds"] == 0.5
+    assert 0.4 < summary["cpu_mean"] <= 0.5
+    assert summary["memory_mean"] == 2000
+    assert summary["memory_peak"] == 3000
+    assert summary["io_read"] == 14
+    assert result["summary"]["client"]["memory_peak"] == 5000
+
+
+def test_remote_daemons_are_not_sampled(tmp_path):
+    sampler = CgroupSampler(cgroup_root=str(tmp_path), find_containers=lambda project_name, docker_host: {})
+    assert sampler.start("match", "tcp://10.0.0.1:2375") is None
+
+
+def test_find_containers(monkeypatch, docker_client):
+    monkeypatch.setattr(telemetry, "DockerEngineClient", lambda docker_host=None, **kwargs: docker_client)
+    server = docker_client.add_compose_container("match-42", "server")
+    client = docker_client.add_container("match-42_client_1", {"com.docker.compose.project": "match-42"})
+    docker_client.add_container("unknown", {"com.docker.compose.project": "match-42"})
+    assert CgroupSampler().find_containers("Match-42") == {"server": server, "client": client}
+
+
+def test_discovery_failures_do_not_end_sampling(tmp_path):
+    attempts = []
+
+    def find_containers(project_name, docker_host):
+        attempts.append(project_name)
+        if len(attempts) == 1:
+            raise ValueError("malformed response")
+        return {"server": "aaa"}
+
+    write_cgroup(str(tmp_path / "docker" / "aaa"), 100, 1000)
+    sampler = CgroupSampler(interval=0.01, cgroup_root=str(tmp_path), find_containers=find_containers)
+    recording = sampler.start("match")
+    deadline = time.time() + 5
+    while "server" not in recording.series and time.time() < deadline:
+        time.sleep(0.01)
+    recording.stop()
+    assert len(attempts) >= 2
+    assert recording.series["server"]["cpu_usec"][0] == 100
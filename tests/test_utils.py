@@ -0,0 +1,54 @@
+import pytest
+
+from docker_sandboxer import utils
+from docker_sandboxer.engine import DockerEngineError
+from docker_sandboxer.teardown import Teardown
+
+
+class FakeCommand(object):
+    calls = []
+
+    def dispatch(self, argv, global_options):
+        FakeCommand.calls.append(argv[4:])
+
+
+@pytest.fixture
+def compose(monkeypatch, docker_client):
+    FakeCommand.calls = []
+    monkeypatch.setattr(utils, "TopLevelCommand", FakeCommand)
+    monkeypatch.setattr(utils, "DockerEngineClient", lambda docker_host=None, **kwargs: docker_client)
+    return FakeCommand
+
+
+def test_containers_labelled_by_docker_compose_are_killed(compose, docker_client):
+    server = docker_client.add_compose_container("match-42", "server")
+    client = docker_client.add_compose_container("match-42", "client")
+    docker_client.add_network("match-42_default", "match-42")
+    teardown = Teardown()
+    utils.run_compose_with_file("Match-42", "match.yml", ["server"], None, teardown=teardown)
+    assert sorted(docker_client.killed) == sorted([server, client])
+    assert teardown.wait(5)
+    assert docker_client.containers == [] and docker_client.networks == []
+    assert compose.calls == [["up", "-d"], ["logs", "server"]]
+
+
+def test_docker_compose_kills_containers_which_are_not_found(compose, docker_client):
+    teardown = Teardown()
+    utils.run_compose_with_file("Match-42", "match.yml", ["server"], None, teardown=teardown)
+    assert compose.calls == [["up", "-d"], ["logs", "server"], ["kill"], ["rm", "--force"]]
+    assert teardown.stats()["kills"] == 0
+
+
+def test_find_containers(docker_client):
+    server = docker_client.add_compose_container("game_7", "server")
+    client = docker_client.add_compose_container("game_7", "client")
+    assert utils._find_containers(docker_client, "Game_7", ["server"]) == {"server": server}
+    assert utils._find_containers(docker_client, "Game_7", []) == {"server": server, "client": client}
+
+
+def test_find_containers_of_missing_managers(docker_client):
+    docker_client.add_compose_container("game_7", "client")
+    with pytest.raises(DockerEngineError):
+        utils._find_containers(docker_client, "Game_7", ["server"])
+    with pytest.raises(DockerEngineError):
+        utils._find_containers(docker_client, "Game_8", [])